@@ -1,8 +1,23 @@
 # active_learning.py
-
-from typing import List, Dict, Any
+#
+# Escolha do próximo caso a anotar. SeletorDiscordancia (usado pelo main.py
+# com ESTRATEGIA_SELECAO = "discordancia") calcula uma vez a matriz TF-IDF de
+# todas as notas (vetorizacao.matriz_notas) e um índice invertido
+# dimensão -> notas. Cada caso com discordância alta entre os médicos
+# atualiza, só nas notas que partilham termos com a sua, a proximidade de
+# cada nota ao caso difícil mais parecido; a escolha é o máximo dessa
+# proximidade entre as notas ainda por usar.
+
+from typing import List, Dict, Any, Optional, Tuple
+import os
 import random
 
+import numpy as np
+import pandas as pd
+
+from vetorizacao import MatrizEsparsa, matriz_notas
+import config
+
 
 def escolher_proximo_caso_random(indices_restantes: List[int]) -> int:
     return random.choice(indices_restantes)
@@ -34,19 +49,24 @@ def escolher_proximo_por_discordancia(
     casos: List[Dict[str, Any]],
     historico: List[Dict[str, Any]],
     indices_restantes: List[int],
+    len_notas: Optional[np.ndarray] = None,
 ) -> int:
     """
     Estratégia de active learning muito simples:
 
     - Se ainda não há histórico, escolhe um caso ao acaso.
     - Se já há histórico, identifica casos anteriores onde a discordância foi alta
-      (por ex. >= 0.3) e calcula o comprimento médio das notas desses casos.
+      (>= config.LIMIAR_DISCORDANCIA) e calcula o comprimento médio das notas desses casos.
     - Depois escolhe, entre os índices_restantes, o caso cujo comprimento da nota
       é mais próximo desse comprimento médio (proxy de "casos semelhantes" em
       termos de complexidade do texto).
 
     É uma heurística barata que já ilustra o conceito de active learning:
     focar a anotação em regiões do espaço de dados onde os modelos discordam.
+
+    len_notas (opcional): array com o comprimento de cada nota, indexado como
+    `casos` (ex.: comprimentos_notas(casos) ou o índice do armazém binário).
+    Com ele a escolha é vetorizada e não lê o texto das notas.
     """
     if not indices_restantes:
         raise ValueError("Sem índices restantes para escolher.")
@@ -55,21 +75,155 @@ def escolher_proximo_por_discordancia(
         return escolher_proximo_caso_random(indices_restantes)
 
     # filtrar casos com maior discordância
-    altos = [h for h in historico if h.get("discordancia", 0.0) >= 0.3]
+    altos = [h for h in historico if h.get("discordancia", 0.0) >= config.LIMIAR_DISCORDANCIA]
     if not altos:
         return escolher_proximo_caso_random(indices_restantes)
 
     media_len = sum(h["len_nota"] for h in altos) / len(altos)
 
     # escolher o índice cujo comprimento de nota é mais próximo da média dos casos "difíceis"
+    if len_notas is not None:
+        restantes = np.asarray(indices_restantes)
+        diffs = np.abs(np.asarray(len_notas)[restantes].astype(float) - media_len)
+        return int(restantes[np.argmin(diffs)])
+
     melhor_idx = None
     melhor_diff = None
     for idx in indices_restantes:
-        nota = casos[idx]["descricao"]
-        l = len(str(nota))
+        l = casos[idx].get("len_nota")
+        if l is None:
+            l = len(str(casos[idx]["descricao"]))
         diff = abs(l - media_len)
         if melhor_diff is None or diff < melhor_diff:
             melhor_diff = diff
             melhor_idx = idx
 
     return melhor_idx if melhor_idx is not None else escolher_proximo_caso_random(indices_restantes)
+
+
+def comprimentos_notas(casos: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    Array com o comprimento de cada nota (metadados, para usar em
+    escolher_proximo_por_discordancia). Para casos do armazém binário não
+    lê o texto.
+    """
+    return np.array(
+        [
+            c.get("len_nota") if c.get("len_nota") is not None else len(str(c["descricao"]))
+            for c in casos
+        ],
+        dtype=np.int64,
+    )
+
+
+class SeletorDiscordancia:
+    """
+    Active learning por vizinhança: escolhe a nota por usar mais parecida
+    (cosseno TF-IDF) com alguma nota de um caso anterior com discordância
+    >= limiar. Enquanto não houver nenhum, escolhe ao acaso.
+
+    Registar um caso custa O(entradas das listas invertidas dos seus termos)
+    e escolher é um argmax vetorizado, por isso não há releitura das notas.
+    """
+
+    def __init__(self, matriz: MatrizEsparsa, limiar: Optional[float] = None, max_df: float = 0.5):
+        self.matriz = matriz
+        self.limiar = config.LIMIAR_DISCORDANCIA if limiar is None else limiar
+        n = len(matriz)
+
+        # índice invertido: pares (dimensão, nota, peso) ordenados por dimensão.
+        # Termos presentes em mais de max_df das notas ficam de fora (IDF baixo,
+        # listas longas): a similaridade é aproximada por baixo.
+        notas = np.repeat(np.arange(n, dtype=np.int32), np.diff(matriz.indptr))
+        df = np.bincount(matriz.ids, minlength=matriz.dim)
+        manter = df[matriz.ids] <= max(1.0, max_df * n)
+        dims = matriz.ids[manter]
+        ordem = np.argsort(dims, kind="stable")
+        self._dims = dims[ordem]
+        self._notas = notas[manter][ordem]
+        self._pesos = matriz.pesos[manter][ordem]
+
+        self.proximidade = np.zeros(n, dtype=np.float32)  # cosseno com o caso difícil mais parecido
+        self.disponivel = np.ones(n, dtype=bool)
+        self.n_dificeis = 0
+
+    @classmethod
+    def de_casos(cls, casos: List[Dict[str, Any]], **kwargs) -> "SeletorDiscordancia":
+        return cls(matriz_notas(str(c["descricao"]) for c in casos), **kwargs)
+
+    def __len__(self) -> int:
+        return int(self.disponivel.sum())
+
+    def similaridades(self, idx: int) -> np.ndarray:
+        """Cosseno da nota idx com todas as notas (via índice invertido)."""
+        q_ids, q_pesos = self.matriz.linha(idx)
+        ini = np.searchsorted(self._dims, q_ids, side="left")
+        fim = np.searchsorted(self._dims, q_ids, side="right")
+        tamanhos = fim - ini
+        total = int(tamanhos.sum())
+        if total == 0:
+            return np.zeros(len(self.matriz), dtype=np.float32)
+        base = np.repeat(ini - (np.cumsum(tamanhos) - tamanhos), tamanhos)
+        pos = base + np.arange(total)
+        return np.bincount(
+            self._notas[pos],
+            weights=self._pesos[pos] * np.repeat(q_pesos, tamanhos),
+            minlength=len(self.matriz),
+        ).astype(np.float32)
+
+    def marcar_usado(self, idx: int):
+        self.disponivel[idx] = False
+
+    def registar(self, idx: int, discordancia: float):
+        """Caso avaliado; se a discordância for alta, puxa os vizinhos para cima."""
+        self.marcar_usado(idx)
+        if discordancia is None or not discordancia >= self.limiar:
+            return
+        np.maximum(self.proximidade, self.similaridades(idx), out=self.proximidade)
+        self.n_dificeis += 1
+
+    def escolher(self) -> int:
+        """Próximo caso (ainda não usado); ValueError se não houver."""
+        if self.n_dificeis == 0:
+            livres = np.flatnonzero(self.disponivel)
+            if len(livres) == 0:
+                raise ValueError("Sem índices restantes para escolher.")
+            return int(escolher_proximo_caso_random(livres.tolist()))
+        pontos = np.where(self.disponivel, self.proximidade, -1.0)
+        idx = int(np.argmax(pontos))
+        if pontos[idx] < 0:
+            raise ValueError("Sem índices restantes para escolher.")
+        return idx
+
+
+def discordancias_historico(path_csv: str, versao_prompt: str) -> Dict[Tuple[str, str], float]:
+    """(subject_id, hadm_id) -> discordância dos casos já no histórico com esta versão dos prompts."""
+    if not os.path.exists(path_csv):
+        return {}
+    df = pd.read_csv(
+        path_csv, dtype=str, usecols=lambda c: c in ("subject_id", "hadm_id", "discordancia", "versao_prompt")
+    )
+    if df.empty or "versao_prompt" not in df:
+        return {}
+    df = df[df["versao_prompt"] == str(versao_prompt)]
+    disc = pd.to_numeric(df["discordancia"], errors="coerce").fillna(0.0)
+    return dict(zip(zip(df["subject_id"], df["hadm_id"]), disc))
+
+
+def criar_seletor(
+    casos: List[Dict[str, Any]],
+    path_historico: str,
+    versao_prompt: str,
+) -> SeletorDiscordancia:
+    """
+    Seletor para os casos carregados, já com os casos do histórico (mesma
+    versão dos prompts) marcados como usados e as suas discordâncias.
+    """
+    seletor = SeletorDiscordancia.de_casos(casos)
+    anteriores = discordancias_historico(path_historico, versao_prompt)
+    if anteriores:
+        for idx, caso in enumerate(casos):
+            disc = anteriores.get((str(caso["subject_id"]), str(caso["hadm_id"])))
+            if disc is not None:
+                seletor.registar(idx, disc)
+    return seletor
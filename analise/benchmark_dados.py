@@ -0,0 +1,289 @@
+# benchmark_dados.py
+#
+# Benchmark da camada de dados (preprocess_mimic.py e dados_mimic.py) sobre
+# tabelas sintéticas com o formato MIMIC-III (gerar_dados_sinteticos.py), em
+# várias escalas (nº de linhas de NOTEEVENTS).
+#
+# Para cada escala os dados são gerados (ou reaproveitados) em
+# DIR_DADOS/<escala>/ e cada função corre num subprocesso próprio, pela ordem
+# de FUNCOES (o preprocess grava os *_filtred.csv e o armazém que as outras
+# leem). Mede-se:
+#   - tempo de parede;
+#   - pico de memória residente (ru_maxrss do processo e dos filhos);
+#   - débito em linhas de NOTEEVENTS por segundo.
+#
+# Os resultados são acrescentados a analise/output/benchmark_dados.csv (com a
+# data e o commit) e comparados com a última execução de outro commit.
+#
+# Uso:
+#   python analise/benchmark_dados.py [--escalas 10000 100000 1000000 10000000]
+#       [--funcoes preprocess rotulos ...] [--dir-dados DIR] [--tamanho-nota 600]
+#       [--casos 20] [--semente 0]
+
+from contextlib import redirect_stdout
+from typing import Any, Dict, List, Optional
+import argparse
+import csv
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows: sem ru_maxrss
+    resource = None
+
+# módulos do projeto (pasta acima de analise/)
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import config  # noqa: E402
+import gerar_dados_sinteticos  # noqa: E402
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CAMINHO_RESULTADOS = os.path.join(BASE_DIR, "output", "benchmark_dados.csv")
+DIR_DADOS = os.path.join(tempfile.gettempdir(), "iach_dados_sinteticos")
+ESCALAS = (10_000, 100_000, 1_000_000, 10_000_000)
+
+
+def _preprocess():
+    import preprocess_mimic
+
+    preprocess_mimic.main()
+
+
+def _preprocess_streaming():
+    import preprocess_mimic
+
+    preprocess_mimic.main_streaming()
+
+
+def _rotulos():
+    import dados_mimic
+
+    dados_mimic._carregar_rotulos_automaticos(config.CAMINHO_DIAGNOSES_ICD, config.CAMINHO_D_ICD_DIAGNOSES)
+
+
+def _carregar(args):
+    import dados_mimic
+
+    dados_mimic.carregar_casos_mimic(n_max=args.casos)
+
+
+# função -> (valores do config.py, execução). A tabela colunar é medida a frio
+# (diretório vazio, inclui a materialização) e a quente (já materializada).
+FUNCOES: Dict[str, Dict[str, Any]] = {
+    "preprocess": {"config": {}, "executar": lambda args: _preprocess()},
+    "preprocess_streaming": {"config": {}, "executar": lambda args: _preprocess_streaming()},
+    "rotulos": {"config": {}, "executar": lambda args: _rotulos()},
+    "casos_colunar_frio": {"config": {"USAR_TABELA_COLUNAR": True}, "executar": _carregar},
+    "casos_colunar_quente": {"config": {"USAR_TABELA_COLUNAR": True}, "executar": _carregar},
+    "casos_armazem": {
+        "config": {"USAR_TABELA_COLUNAR": False, "USAR_ARMAZEM_NOTAS": True},
+        "executar": _carregar,
+    },
+    "casos_streaming": {
+        "config": {"USAR_TABELA_COLUNAR": False, "USAR_ARMAZEM_NOTAS": False, "CARREGAMENTO_STREAMING": True},
+        "executar": _carregar,
+    },
+    "casos_pandas": {
+        "config": {"USAR_TABELA_COLUNAR": False, "USAR_ARMAZEM_NOTAS": False, "CARREGAMENTO_STREAMING": False},
+        "executar": _carregar,
+    },
+}
+
+
+def _pico_rss_mb() -> Optional[float]:
+    """Maior ru_maxrss entre este processo e os filhos já terminados (MB)."""
+    if resource is None:
+        return None
+    kb = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # Linux em KB, macOS em bytes
+    return kb / (1024.0 * 1024.0) if sys.platform == "darwin" else kb / 1024.0
+
+
+def _configurar(escala_dir: str, nome: str):
+    """Aponta o preprocess e o config.py para os dados da escala."""
+    import preprocess_mimic
+
+    originais = os.path.join(escala_dir, "original")
+    preprocess_mimic.PATH_NOTES = os.path.join(originais, gerar_dados_sinteticos.NOME_NOTAS)
+    preprocess_mimic.PATH_DIAG = os.path.join(originais, gerar_dados_sinteticos.NOME_DIAG)
+    preprocess_mimic.PATH_DIC = os.path.join(originais, gerar_dados_sinteticos.NOME_DIC)
+    preprocess_mimic.DATA_OUT = escala_dir
+
+    config.CAMINHO_CASOS = os.path.join(escala_dir, "NOTEEVENTS_random_separado_filtred.csv")
+    config.CAMINHO_DIAGNOSES_ICD = os.path.join(escala_dir, "DIAGNOSES_ICD_random_filtred.csv")
+    config.CAMINHO_D_ICD_DIAGNOSES = os.path.join(escala_dir, "D_ICD_DIAGNOSES_filtred.csv")
+    config.CAMINHO_ARMAZEM_NOTAS = os.path.join(escala_dir, "NOTEEVENTS_filtred_notas")
+    config.DIR_TABELA_CASOS = os.path.join(escala_dir, "tabela_casos")
+    for chave, valor in FUNCOES[nome]["config"].items():
+        setattr(config, chave, valor)
+
+
+def _executar_funcao(args, nome: str, escala: int) -> Dict[str, Any]:
+    """Corre uma função neste processo e devolve as métricas."""
+    escala_dir = os.path.join(args.dir_dados, str(escala))
+    _configurar(escala_dir, nome)
+    if nome == "casos_colunar_frio":
+        shutil.rmtree(config.DIR_TABELA_CASOS, ignore_errors=True)
+
+    rss_ini = _pico_rss_mb()
+    t_ini = time.perf_counter()
+    with open(os.devnull, "w", encoding="utf-8") as nulo, redirect_stdout(nulo):
+        FUNCOES[nome]["executar"](args)
+    parede = time.perf_counter() - t_ini
+    return {
+        "funcao": nome,
+        "escala": escala,
+        "parede_s": parede,
+        "linhas_por_s": escala / parede if parede > 0 else float("nan"),
+        "rss_inicial_mb": rss_ini,
+        "pico_rss_mb": _pico_rss_mb(),
+    }
+
+
+def _em_subprocesso(args, nome: str, escala: int) -> Dict[str, Any]:
+    with tempfile.NamedTemporaryFile("r", suffix=".json", delete=False) as f:
+        saida = f.name
+    comando = [
+        sys.executable, os.path.abspath(__file__),
+        "--_funcao", nome, "--_escala", str(escala), "--_saida", saida,
+    ]
+    comando += sys.argv[1:]
+    subprocess.run(comando, check=True)
+    with open(saida, "r", encoding="utf-8") as f:
+        res = json.load(f)
+    os.remove(saida)
+    return res
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=RAIZ, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _fmt(valor: Optional[float], formato: str) -> str:
+    return "-" if valor is None or valor != valor else format(valor, formato)
+
+
+def _anteriores(commit: str) -> Dict[tuple, Dict[str, str]]:
+    """(funcao, escala, tamanho_nota) -> última linha gravada de outro commit."""
+    if not os.path.exists(CAMINHO_RESULTADOS):
+        return {}
+    with open(CAMINHO_RESULTADOS, "r", newline="", encoding="utf-8") as f:
+        linhas = [r for r in csv.DictReader(f) if r.get("commit") != commit]
+    if not linhas:
+        return {}
+    ultimo = linhas[-1]["commit"]
+    return {
+        (r["funcao"], int(r["escala"]), int(r["tamanho_nota"])): r
+        for r in linhas
+        if r["commit"] == ultimo
+    }
+
+
+def _imprimir(args, resultados: List[Dict[str, Any]], anteriores: Dict[tuple, Dict[str, str]]):
+    print(f"\n{'função':22s} {'escala':>10s} {'parede (s)':>10s} {'linhas/s':>11s} {'pico RSS (MB)':>14s}   anterior")
+    for r in resultados:
+        ant = anteriores.get((r["funcao"], r["escala"], args.tamanho_nota))
+        comparacao = ""
+        if ant is not None:
+            t_ant = float(ant["parede_s"])
+            comparacao = f"{t_ant:.2f} s ({ant['commit']}, x{t_ant / r['parede_s']:.2f})"
+        print(
+            f"{r['funcao']:22s} {r['escala']:10d} {r['parede_s']:10.2f} "
+            f"{_fmt(r['linhas_por_s'], '11.0f'):>11s} {_fmt(r['pico_rss_mb'], '14.1f'):>14s}   {comparacao}"
+        )
+
+
+def _guardar(args, resultados: List[Dict[str, Any]]):
+    os.makedirs(os.path.dirname(CAMINHO_RESULTADOS), exist_ok=True)
+    comum = {
+        "data": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "tamanho_nota": args.tamanho_nota,
+        "casos": args.casos,
+        "semente": args.semente,
+    }
+    linhas = [{**comum, **r} for r in resultados]
+    novo = not os.path.exists(CAMINHO_RESULTADOS)
+    if not novo:
+        with open(CAMINHO_RESULTADOS, "r", newline="", encoding="utf-8") as f:
+            colunas = next(csv.reader(f), None)
+        if colunas != list(linhas[0]):
+            # colunas diferentes (versão antiga do script): começar um ficheiro novo
+            os.replace(CAMINHO_RESULTADOS, CAMINHO_RESULTADOS + ".antigo")
+            novo = True
+    with open(CAMINHO_RESULTADOS, "a", newline="", encoding="utf-8") as f:
+        escritor = csv.DictWriter(f, fieldnames=list(linhas[0]))
+        if novo:
+            escritor.writeheader()
+        escritor.writerows(linhas)
+    print(f"\nResultados acrescentados a {CAMINHO_RESULTADOS}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da camada de dados com tabelas sintéticas.")
+    parser.add_argument("--escalas", type=int, nargs="+", default=list(ESCALAS[:3]),
+                        help="linhas de NOTEEVENTS (10M pede vários GB em disco)")
+    parser.add_argument("--funcoes", nargs="+", choices=list(FUNCOES), default=list(FUNCOES))
+    parser.add_argument("--dir-dados", default=DIR_DADOS,
+                        help="onde gerar/reaproveitar os dados de cada escala")
+    parser.add_argument("--tamanho-nota", type=int, default=600, help="nº médio de caracteres por nota")
+    parser.add_argument("--casos", type=int, default=config.NUM_CASOS,
+                        help="n_max de carregar_casos_mimic (0 = todos)")
+    parser.add_argument("--semente", type=int, default=0)
+    parser.add_argument("--_funcao", help=argparse.SUPPRESS)
+    parser.add_argument("--_escala", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--_saida", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.casos = args.casos or None
+
+    if args._funcao:
+        # subprocesso: uma só função, resultado em JSON para o processo principal
+        res = _executar_funcao(args, args._funcao, args._escala)
+        with open(args._saida, "w", encoding="utf-8") as f:
+            json.dump(res, f)
+        return
+
+    # o preprocess tem de correr antes das funções que leem as suas saídas
+    funcoes = [f for f in FUNCOES if f in args.funcoes]
+    resultados = []
+    for escala in args.escalas:
+        escala_dir = os.path.join(args.dir_dados, str(escala))
+        print(f"Escala {escala}: a gerar/verificar dados em {escala_dir}...")
+        t0 = time.perf_counter()
+        gerar_dados_sinteticos.gerar(
+            os.path.join(escala_dir, "original"), escala, args.semente, args.tamanho_nota
+        )
+        print(f"  dados prontos em {time.perf_counter() - t0:.1f} s")
+        da_escala = list(funcoes)
+        if not os.path.exists(os.path.join(escala_dir, "NOTEEVENTS_random_separado_filtred.csv")):
+            if "preprocess" not in da_escala and "preprocess_streaming" not in da_escala:
+                da_escala.insert(0, "preprocess")  # as outras funções precisam das saídas
+        for nome in da_escala:
+            print(f"  {nome}...")
+            resultados.append(_em_subprocesso(args, nome, escala))
+
+    _imprimir(args, resultados, _anteriores(_commit()))
+    _guardar(args, resultados)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+# benchmark_pipeline.py
+#
+# Benchmark da orquestração (main.py / pipeline_async.py) com o modelo falso
+# (llm_falso.py): sem chave da OpenAI nem rede, com latências, tokens, 429s e
+# JSON malformado simulados e casos sintéticos (llm_falso.casos_sinteticos).
+#
+# Cada modo corre num subprocesso com um output/ temporário (limitador,
+# caches e percentis começam vazios) e mede:
+#   - casos por minuto (tempo de parede de main.main);
+#   - tempo de CPU do processo (todas as threads), total e por caso;
+#   - p50 / p95 / p99 de tempo_total, tempo_grafo e tempo_medicos;
+#   - pedidos, 429s e respostas malformadas do modelo falso.
+#
+# Os resultados são acrescentados a analise/output/benchmark_pipeline.csv
+# (com o commit e os parâmetros) para comparar entre versões.
+#
+# Uso:
+#   python analise/benchmark_pipeline.py [--casos 40] [--modos serial assincrono ...]
+#       [--mediana 1.5] [--sigma 0.4] [--s-por-token 0.01] [--prob-429 0.0]
+#       [--prob-json 0.0] [--rpm 500] [--tpm 2000000] [--em-voo 4] [--semente 0]
+
+from contextlib import redirect_stdout
+from typing import Any, Dict, List
+import argparse
+import csv
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+# módulos do projeto (pasta acima de analise/)
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import config  # noqa: E402
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CAMINHO_RESULTADOS = os.path.join(BASE_DIR, "output", "benchmark_pipeline.csv")
+
+# modo -> valores do config.py
+MODOS: Dict[str, Dict[str, Any]] = {
+    "serial": {"MODO_ASSINCRONO": False},
+    "assincrono": {"MODO_ASSINCRONO": True},
+    "painel": {"MODO_ASSINCRONO": True, "MODO_MEDICOS": "painel"},
+    "fundido": {"MODO_ASSINCRONO": True, "MODO_GRAFO": "fundido"},
+}
+TEMPOS = ("tempo_total", "tempo_grafo", "tempo_medicos")
+PERCENTIS = (50, 95, 99)
+
+
+def _configurar(args, modo: str, output_dir: str):
+    config.LLM_FALSO = True
+    config.LLM_FALSO_MEDIANA_S = args.mediana
+    config.LLM_FALSO_SIGMA = args.sigma
+    config.LLM_FALSO_S_POR_TOKEN = args.s_por_token
+    config.LLM_FALSO_PROB_429 = args.prob_429
+    config.LLM_FALSO_PROB_JSON_INVALIDO = args.prob_json
+    config.LLM_FALSO_SEMENTE = args.semente
+    config.LIMITE_RPM = args.rpm
+    config.LIMITE_TPM = args.tpm
+    config.MAX_CASOS_EM_VOO = args.em_voo
+    config.NUM_ITERACOES = args.casos
+
+    # tudo o que é gravado fica num diretório temporário
+    config.OUTPUT_DIR = output_dir
+    config.DIR_GRAFOS = os.path.join(output_dir, "grafos")
+    config.DIR_TABELA_CASOS = os.path.join(output_dir, "tabela_casos")
+    config.CAMINHO_REPUTACAO_DB = os.path.join(output_dir, "reputacao.sqlite")
+    config.DIR_CACHE_LLM = os.path.join(output_dir, "cache_llm")
+    config.CACHE_LLM_ATIVA = False  # cada pedido chega ao modelo (falso)
+    config.RETOMAR_EXECUCAO = False
+    for nome, valor in MODOS[modo].items():
+        setattr(config, nome, valor)
+
+
+def _executar_modo(args, modo: str) -> Dict[str, Any]:
+    """Corre main.main neste processo e devolve as métricas do modo."""
+    output_dir = tempfile.mkdtemp(prefix=f"bench_{modo}_")
+    _configurar(args, modo, output_dir)
+
+    import llm_falso
+    import main
+
+    casos = llm_falso.casos_sinteticos(args.casos, semente=args.semente)
+    cpu_ini = time.process_time()
+    t_ini = time.perf_counter()
+    with open(os.devnull, "w", encoding="utf-8") as nulo, redirect_stdout(nulo):
+        main.main(casos)
+    parede = time.perf_counter() - t_ini
+    cpu = time.process_time() - cpu_ini
+
+    df = pd.read_csv(os.path.join(output_dir, "historico_experimentos.csv"))
+    n = len(df)
+    res: Dict[str, Any] = {
+        "modo": modo,
+        "casos": n,
+        "parede_s": parede,
+        "casos_por_minuto": 60.0 * n / parede if parede > 0 else float("nan"),
+        "cpu_s": cpu,
+        "cpu_ms_por_caso": 1000.0 * cpu / n if n else float("nan"),
+        "acerto_A": float(df["acertou_A"].astype(float).mean()) if n else float("nan"),
+    }
+    for coluna in TEMPOS:
+        valores = df[coluna].astype(float).to_numpy()
+        for q, v in zip(PERCENTIS, np.percentile(valores, PERCENTIS) if n else [np.nan] * 3):
+            res[f"{coluna}_p{q}"] = float(v)
+    res.update({f"llm_{k}": v for k, v in llm_falso.estatisticas.como_dict().items()})
+    return res
+
+
+def _em_subprocesso(args, modo: str) -> Dict[str, Any]:
+    with tempfile.NamedTemporaryFile("r", suffix=".json", delete=False) as f:
+        saida = f.name
+    comando = [sys.executable, os.path.abspath(__file__), "--_modo", modo, "--_saida", saida]
+    comando += sys.argv[1:]
+    subprocess.run(comando, check=True)
+    with open(saida, "r", encoding="utf-8") as f:
+        res = json.load(f)
+    os.remove(saida)
+    return res
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=RAIZ, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _imprimir(resultados: List[Dict[str, Any]]):
+    print(f"\n{'modo':12s} {'casos':>5s} {'casos/min':>9s} {'CPU (s)':>8s} {'CPU/caso':>9s}   "
+          + "  ".join(f"{c[6:]:>20s}" for c in TEMPOS))
+    print(f"{'':12s} {'':>5s} {'':>9s} {'':>8s} {'(ms)':>9s}   "
+          + "  ".join(f"{'p50/p95/p99 (s)':>20s}" for _ in TEMPOS))
+    for r in resultados:
+        tempos = "  ".join(
+            f"{'/'.join('%.2f' % r[c + '_p' + str(q)] for q in PERCENTIS):>20s}" for c in TEMPOS
+        )
+        print(
+            f"{r['modo']:12s} {r['casos']:5d} {r['casos_por_minuto']:9.1f} {r['cpu_s']:8.2f} "
+            f"{r['cpu_ms_por_caso']:9.1f}   {tempos}"
+        )
+    for r in resultados:
+        print(
+            f"  {r['modo']}: {r['llm_pedidos']} pedidos, {r['llm_erros_429']} com 429, "
+            f"{r['llm_json_malformado']} malformados, acerto A = {r['acerto_A']:.2f}"
+        )
+
+
+def _guardar(args, resultados: List[Dict[str, Any]]):
+    os.makedirs(os.path.dirname(CAMINHO_RESULTADOS), exist_ok=True)
+    comum = {
+        "data": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "mediana_s": args.mediana,
+        "sigma": args.sigma,
+        "s_por_token": args.s_por_token,
+        "prob_429": args.prob_429,
+        "prob_json": args.prob_json,
+        "rpm": args.rpm,
+        "tpm": args.tpm,
+        "em_voo": args.em_voo,
+        "semente": args.semente,
+    }
+    linhas = [{**comum, **r} for r in resultados]
+    novo = not os.path.exists(CAMINHO_RESULTADOS)
+    if not novo:
+        with open(CAMINHO_RESULTADOS, "r", newline="", encoding="utf-8") as f:
+            colunas = next(csv.reader(f), None)
+        if colunas != list(linhas[0]):
+            # colunas diferentes (versão antiga do script): começar um ficheiro novo
+            os.replace(CAMINHO_RESULTADOS, CAMINHO_RESULTADOS + ".antigo")
+            novo = True
+    with open(CAMINHO_RESULTADOS, "a", newline="", encoding="utf-8") as f:
+        escritor = csv.DictWriter(f, fieldnames=list(linhas[0]))
+        if novo:
+            escritor.writeheader()
+        escritor.writerows(linhas)
+    print(f"\nResultados acrescentados a {CAMINHO_RESULTADOS}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline com o modelo falso.")
+    parser.add_argument("--casos", type=int, default=40)
+    parser.add_argument("--modos", nargs="+", choices=list(MODOS), default=list(MODOS))
+    parser.add_argument("--mediana", type=float, default=config.LLM_FALSO_MEDIANA_S,
+                        help="mediana (s) da latência até ao primeiro token")
+    parser.add_argument("--sigma", type=float, default=config.LLM_FALSO_SIGMA,
+                        help="sigma da lognormal (0 = latência fixa)")
+    parser.add_argument("--s-por-token", type=float, default=config.LLM_FALSO_S_POR_TOKEN)
+    parser.add_argument("--prob-429", type=float, default=config.LLM_FALSO_PROB_429)
+    parser.add_argument("--prob-json", type=float, default=config.LLM_FALSO_PROB_JSON_INVALIDO)
+    # por omissão sem o limite da conta: mede-se a orquestração, não o limitador
+    parser.add_argument("--rpm", type=float, default=500)
+    parser.add_argument("--tpm", type=float, default=2_000_000)
+    parser.add_argument("--em-voo", type=int, default=config.MAX_CASOS_EM_VOO)
+    parser.add_argument("--semente", type=int, default=0)
+    parser.add_argument("--_modo", help=argparse.SUPPRESS)
+    parser.add_argument("--_saida", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._modo:
+        # subprocesso: um só modo, resultado em JSON para o processo principal
+        res = _executar_modo(args, args._modo)
+        with open(args._saida, "w", encoding="utf-8") as f:
+            json.dump(res, f)
+        return
+
+    resultados = []
+    for modo in args.modos:
+        print(f"A correr o modo {modo} ({args.casos} casos)...")
+        resultados.append(_em_subprocesso(args, modo))
+    _imprimir(resultados)
+    _guardar(args, resultados)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# gerar_dados_sinteticos.py
+#
+# Gera tabelas com o formato das do MIMIC-III usadas pelo preprocess_mimic.py,
+# para medir a camada de dados em escalas maiores do que o ficheiro real
+# (analise/benchmark_dados.py):
+#
+#   NOTEEVENTS_random_separado.csv  ROW_ID, SUBJECT_ID, HADM_ID, CHARTDATE,
+#                                   CATEGORY, NOTE_TEXT
+#   DIAGNOSES_ICD_random.csv        ROW_ID, SUBJECT_ID, HADM_ID, SEQ_NUM, ICD9_CODE
+#   D_ICD_DIAGNOSES.csv             ROW_ID, ICD9_CODE, SHORT_TITLE, LONG_TITLE
+#
+# Mantêm-se as particularidades dos ficheiros reais:
+#   - HADM_ID das notas em formato float ("174105.0") e SEQ_NUM como "1.0";
+#   - notas sem HADM_ID (~3%) e admissões com várias notas (~2 por admissão);
+#   - admissões com notas e sem diagnósticos, e com diagnósticos sem notas;
+#   - alguns ICD9_CODE em falta; texto com vírgulas, aspas e mudanças de linha;
+#   - doentes com várias admissões; códigos com frequência de Zipf, por isso
+#     parte do dicionário ICD não é usada (é filtrada pelo preprocess).
+#
+# `linhas` é o nº de linhas de NOTEEVENTS; DIAGNOSES_ICD fica com cerca de
+# 1.5x. Tudo é escrito por blocos (memória independente da escala).
+#
+# Uso:
+#   python analise/gerar_dados_sinteticos.py DESTINO --linhas 100000 [--semente 0]
+#       [--tamanho-nota 600]
+
+from typing import Dict, List
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# módulos do projeto (pasta acima de analise/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+
+NOME_NOTAS = "NOTEEVENTS_random_separado.csv"
+NOME_DIAG = "DIAGNOSES_ICD_random.csv"
+NOME_DIC = "D_ICD_DIAGNOSES.csv"
+NOME_META = "gerado.json"
+
+PROP_SEM_HADM = 0.03  # notas sem HADM_ID
+PROP_ADM_SEM_DIAG = 0.10  # admissões com notas mas sem diagnósticos
+PROP_ADM_SO_DIAG = 0.05  # admissões extra só com diagnósticos
+PROP_SEM_CODIGO = 0.005  # linhas de DIAGNOSES_ICD sem ICD9_CODE
+MAX_DIAG_POR_ADM = 8
+
+_CATEGORIAS = ["Discharge summary", "Nursing", "Radiology", "Physician ", "ECG", "Echo"]
+_PALAVRAS = (
+    "patient admitted with fever cough dyspnea chest pain hypotension tachycardia edema "
+    "history of diabetes hypertension copd smoker alcohol creatinine troponin infiltrate "
+    "blood cultures antibiotics diuretics stable improved discharged follow-up normal "
+    "mild moderate severe acute chronic left right bilateral noted denies reports"
+).split()
+
+
+def _frases(rng: np.random.Generator, n: int = 512) -> List[str]:
+    """Conjunto de frases de onde se compõem as notas (com vírgulas e aspas)."""
+    frases = []
+    for _ in range(n):
+        palavras = rng.choice(_PALAVRAS, size=int(rng.integers(6, 14)))
+        frase = " ".join(palavras).capitalize()
+        if rng.random() < 0.3:
+            frase = frase.replace(" ", ", ", 1)
+        if rng.random() < 0.05:
+            frase += ' "per family"'
+        frases.append(frase + ".")
+    return frases
+
+
+def _dicionario_icd(rng: np.random.Generator) -> pd.DataFrame:
+    """O dicionário filtrado do repositório, ou códigos inventados se não existir."""
+    if os.path.exists(config.CAMINHO_D_ICD_DIAGNOSES):
+        return pd.read_csv(config.CAMINHO_D_ICD_DIAGNOSES, dtype=str)
+    n = 2000
+    codigos = [f"{c:04d}" for c in rng.choice(10000, size=n, replace=False)]
+    return pd.DataFrame(
+        {
+            "ROW_ID": [str(i + 1) for i in range(n)],
+            "ICD9_CODE": codigos,
+            "SHORT_TITLE": [f"Diag {c}" for c in codigos],
+            "LONG_TITLE": [f"Synthetic diagnosis {c}" for c in codigos],
+        }
+    )
+
+
+def _texto_notas(rng: np.random.Generator, frases: List[str], m: int, tamanho_nota: int) -> List[str]:
+    media_frase = sum(len(f) for f in frases) / len(frases)
+    alvo = rng.lognormal(np.log(tamanho_nota), 0.6, size=m)
+    n_frases = np.maximum(1, (alvo / media_frase).astype(np.int64))
+    escolhas = rng.integers(0, len(frases), size=int(n_frases.sum()))
+    fins = np.cumsum(n_frases)
+    textos = []
+    ini = 0
+    for fim in fins:
+        partes = [frases[i] for i in escolhas[ini:fim]]
+        # parágrafos: uma mudança de linha a cada ~4 frases
+        textos.append("\n".join(" ".join(partes[k : k + 4]) for k in range(0, len(partes), 4)))
+        ini = fim
+    return textos
+
+
+def gerar(
+    destino: str,
+    linhas: int,
+    semente: int = 0,
+    tamanho_nota: int = 600,
+    bloco: int = 100_000,
+) -> Dict[str, str]:
+    """
+    Escreve as três tabelas em `destino` e devolve os caminhos. Se já existirem
+    com os mesmos parâmetros (gerado.json), não são geradas de novo.
+    """
+    parametros = {"linhas": linhas, "semente": semente, "tamanho_nota": tamanho_nota}
+    caminhos = {
+        "notas": os.path.join(destino, NOME_NOTAS),
+        "diagnosticos": os.path.join(destino, NOME_DIAG),
+        "dicionario": os.path.join(destino, NOME_DIC),
+    }
+    path_meta = os.path.join(destino, NOME_META)
+    if os.path.exists(path_meta) and all(os.path.exists(p) for p in caminhos.values()):
+        with open(path_meta, "r", encoding="utf-8") as f:
+            if json.load(f) == parametros:
+                return caminhos
+    os.makedirs(destino, exist_ok=True)
+    if os.path.exists(path_meta):
+        os.remove(path_meta)  # inválido até a geração acabar
+
+    rng = np.random.default_rng(semente)
+    frases = _frases(rng)
+    dic = _dicionario_icd(rng)
+    codigos = dic["ICD9_CODE"].to_numpy()
+    # frequência de Zipf sobre uma ordem aleatória dos códigos
+    ordem_codigos = codigos[rng.permutation(len(codigos))]
+
+    n_adm = max(1, linhas // 2)
+    n_doentes = max(1, (2 * n_adm) // 3)
+    hadm_ids = 100_000 + rng.permutation(n_adm + int(n_adm * PROP_ADM_SO_DIAG)).astype(np.int64)
+    subj_ids = 10_000 + rng.integers(0, n_doentes, size=len(hadm_ids))
+
+    # ----------------- NOTEEVENTS -----------------
+    row_id = 1
+    for ini in range(0, linhas, bloco):
+        m = min(bloco, linhas - ini)
+        adm = rng.integers(0, n_adm, size=m)
+        hadm = np.char.add(hadm_ids[adm].astype(str), ".0").astype(object)
+        hadm[rng.random(m) < PROP_SEM_HADM] = ""
+        df = pd.DataFrame(
+            {
+                "ROW_ID": np.arange(row_id, row_id + m),
+                "SUBJECT_ID": subj_ids[adm],
+                "HADM_ID": hadm,
+                "CHARTDATE": np.char.add("21", rng.integers(10, 99, size=m).astype(str)).astype(object),
+                "CATEGORY": rng.choice(_CATEGORIAS, size=m),
+                "NOTE_TEXT": _texto_notas(rng, frases, m, tamanho_nota),
+            }
+        )
+        df.to_csv(caminhos["notas"], mode="w" if ini == 0 else "a", header=ini == 0, index=False)
+        row_id += m
+
+    # ----------------- DIAGNOSES_ICD -----------------
+    # admissões [0, n_adm) têm notas; as seguintes só têm diagnósticos
+    com_diag = np.concatenate(
+        [
+            np.flatnonzero(rng.random(n_adm) >= PROP_ADM_SEM_DIAG),
+            np.arange(n_adm, len(hadm_ids)),
+        ]
+    )
+    row_id = 1
+    primeiro = True
+    for ini in range(0, len(com_diag), bloco):
+        adm = com_diag[ini : ini + bloco]
+        n_por_adm = rng.integers(1, MAX_DIAG_POR_ADM + 1, size=len(adm))
+        adm_linhas = np.repeat(adm, n_por_adm)
+        m = len(adm_linhas)
+        # SEQ_NUM 1..n dentro de cada admissão
+        seq = np.arange(m) - np.repeat(np.cumsum(n_por_adm) - n_por_adm, n_por_adm) + 1
+        idx = np.minimum(rng.zipf(1.3, size=m) - 1, len(ordem_codigos) - 1)
+        icd = ordem_codigos[idx].astype(object)
+        icd[rng.random(m) < PROP_SEM_CODIGO] = None
+        df = pd.DataFrame(
+            {
+                "ROW_ID": np.arange(row_id, row_id + m),
+                "SUBJECT_ID": subj_ids[adm_linhas],
+                "HADM_ID": hadm_ids[adm_linhas],
+                "SEQ_NUM": np.char.add(seq.astype(str), ".0"),
+                "ICD9_CODE": icd,
+            }
+        )
+        df.to_csv(caminhos["diagnosticos"], mode="w" if primeiro else "a", header=primeiro, index=False)
+        primeiro = False
+        row_id += m
+
+    dic.to_csv(caminhos["dicionario"], index=False)
+    with open(path_meta, "w", encoding="utf-8") as f:
+        json.dump(parametros, f)
+    return caminhos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera tabelas sintéticas com o formato MIMIC-III.")
+    parser.add_argument("destino")
+    parser.add_argument("--linhas", type=int, default=10_000, help="linhas de NOTEEVENTS")
+    parser.add_argument("--semente", type=int, default=0)
+    parser.add_argument("--tamanho-nota", type=int, default=600, help="nº médio de caracteres por nota")
+    args = parser.parse_args()
+    caminhos = gerar(args.destino, args.linhas, args.semente, args.tamanho_nota)
+    for p in caminhos.values():
+        print(f" - {p} ({os.path.getsize(p) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
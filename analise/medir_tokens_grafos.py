@@ -0,0 +1,142 @@
+# medir_tokens_grafos.py
+#
+# Mede o tamanho em tokens de cada codificação do grafo (codificacao_grafo.py)
+# sobre os grafos já guardados, para escolher CODIFICACAO_GRAFO / PODAR_GRAFO.
+#
+# Lê:
+#   - output/grafos/json/*.json            (grafos gravados pelo pipeline)
+#   - <pasta>/*.html                       (HTML pyvis de execuções antigas)
+#
+# Conta tokens com o tiktoken se estiver instalado (encoding do modelo em
+# config.MODEL_NAME); senão usa a estimativa do limitador (~4 caracteres por token).
+#
+# Uso:
+#   python analise/medir_tokens_grafos.py [PASTA ...]
+
+from typing import Any, Callable, Dict, List
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+# módulos do projeto (pasta acima de analise/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from codificacao_grafo import CODIFICACOES, codificar_grafo, explicacao  # noqa: E402
+from limitador import estimar_tokens  # noqa: E402
+import config  # noqa: E402
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_RE_DATASET = re.compile(r"(nodes|edges) = new vis\.DataSet\((\[.*?\])\);", re.S)
+
+
+def contador_tokens() -> Callable[[str], int]:
+    try:
+        import tiktoken
+    except ImportError:
+        print("(tiktoken não instalado: a usar estimativa de ~4 caracteres por token)")
+        return estimar_tokens
+    try:
+        try:
+            enc = tiktoken.encoding_for_model(config.MODEL_NAME)
+        except KeyError:
+            enc = tiktoken.get_encoding("o200k_base")
+    except Exception as exc:  # o tiktoken descarrega o encoding na 1ª utilização
+        print(f"(tiktoken sem encoding disponível: {exc.__class__.__name__}; a usar estimativa)")
+        return estimar_tokens
+    return lambda texto: len(enc.encode(texto))
+
+
+def grafo_do_html(path: str) -> Dict[str, Any]:
+    """Reconstrói o JSON do grafo a partir do HTML gerado pelo pyvis."""
+    with open(path, "r", encoding="utf-8") as f:
+        html = f.read()
+    dados = {nome: json.loads(valor) for nome, valor in _RE_DATASET.findall(html)}
+    return {
+        "nodes": [
+            {"id": n["id"], "label": n.get("label"), "type": n.get("title", "")}
+            for n in dados.get("nodes", [])
+        ],
+        "edges": [
+            {"source": e["from"], "target": e["to"], "relation": e.get("label", "")}
+            for e in dados.get("edges", [])
+        ],
+    }
+
+
+def carregar_grafos(pastas: List[str]) -> Dict[str, Dict[str, Any]]:
+    grafos = {}
+    for pasta in pastas:
+        for path in sorted(glob.glob(os.path.join(pasta, "json", "*.json"))):
+            with open(path, "r", encoding="utf-8") as f:
+                grafos[os.path.basename(path)[:-5]] = json.load(f)
+        for path in sorted(glob.glob(os.path.join(pasta, "*.html"))):
+            nome = os.path.basename(path)[:-5]
+            if nome not in grafos and nome != "visualizador_grafos":
+                grafos[nome] = grafo_do_html(path)
+    return grafos
+
+
+def medir(grafos: Dict[str, Dict[str, Any]], contar: Callable[[str], int]) -> pd.DataFrame:
+    """Uma linha por (codificação, podar) com tokens por grafo e custo da explicação."""
+    linhas = []
+    for codificacao in CODIFICACOES:
+        for podar in (False, True):
+            tokens = np.array(
+                [contar(codificar_grafo(g, codificacao, podar)) for g in grafos.values()]
+            )
+            linhas.append(
+                {
+                    "codificacao": codificacao,
+                    "podar": podar,
+                    "tokens_total": int(tokens.sum()),
+                    "tokens_medio": float(tokens.mean()),
+                    "tokens_mediana": float(np.median(tokens)),
+                    "tokens_max": int(tokens.max()),
+                    # explicação no prompt de sistema: paga uma vez por pedido
+                    "tokens_explicacao": contar(explicacao(codificacao)),
+                }
+            )
+    df = pd.DataFrame(linhas)
+    n_medicos = 2
+    # custo por caso = (grafo + explicação) em cada um dos pedidos aos médicos
+    df["tokens_por_caso"] = n_medicos * (df["tokens_medio"] + df["tokens_explicacao"])
+    base = df.loc[(df["codificacao"] == "json") & (~df["podar"]), "tokens_por_caso"].iloc[0]
+    df["relativo_json"] = df["tokens_por_caso"] / base
+    return df.sort_values("tokens_por_caso").reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokens por codificação do grafo.")
+    parser.add_argument(
+        "pastas",
+        nargs="*",
+        default=[config.DIR_GRAFOS, os.path.join(BASE_DIR, "output", "grafos")],
+    )
+    args = parser.parse_args()
+
+    grafos = carregar_grafos(args.pastas)
+    if not grafos:
+        print("Nenhum grafo encontrado em:", ", ".join(args.pastas))
+        return
+    print(f"{len(grafos)} grafos")
+
+    df = medir(grafos, contador_tokens())
+    with pd.option_context("display.width", 140):
+        print(df.to_string(index=False, float_format=lambda x: f"{x:.2f}"))
+
+    saida = os.path.join(BASE_DIR, "output", "tokens_codificacoes_grafo.csv")
+    os.makedirs(os.path.dirname(saida), exist_ok=True)
+    df.to_csv(saida, index=False)
+    print("\nResultados gravados em:", saida)
+
+
+if __name__ == "__main__":
+    main()
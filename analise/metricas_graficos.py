@@ -92,6 +92,71 @@ plt.title("Taxa de acerto global dos médicos (casos com ground truth)")
 plt.show()
 
 
+# ---------------------------------------------------------
+# 3b) Configurações dos pedidos: grafo separado/fundido e médicos separados/painel
+# ---------------------------------------------------------
+# Compara só os casos (subject_id, hadm_id) avaliados em todas as
+# configurações presentes no histórico (MODO_GRAFO / MODO_MEDICOS no config.py).
+
+for col in ["modo_grafo", "modo_medicos"]:
+    if col in df_gt.columns:
+        df_gt[col] = df_gt[col].fillna("separado")
+    else:
+        df_gt[col] = "separado"
+df_gt["configuracao"] = "grafo " + df_gt["modo_grafo"] + " / médicos " + df_gt["modo_medicos"]
+
+configuracoes = sorted(df_gt["configuracao"].unique())
+comparacao_modos = pd.DataFrame()
+if len(configuracoes) > 1:
+    chaves = df_gt.groupby(["subject_id", "hadm_id"])["configuracao"].nunique()
+    comuns = chaves[chaves == len(configuracoes)].index
+    df_modos = df_gt.set_index(["subject_id", "hadm_id"]).loc[comuns].reset_index()
+
+    # tokens de entrada por caso (colunas <etapa>_tokens_prompt)
+    cols_tokens = ["grafo_tokens_prompt", "medico_A_tokens_prompt", "medico_B_tokens_prompt"]
+    for col in cols_tokens:
+        if col not in df_modos.columns:
+            df_modos[col] = float("nan")
+        df_modos[col] = pd.to_numeric(df_modos[col], errors="coerce")
+    df_modos["tokens_prompt_caso"] = df_modos[cols_tokens].sum(axis=1, min_count=1)
+
+    comparacao_modos = df_modos.groupby("configuracao").agg(
+        casos=("hadm_id", "count"),
+        acerto_A=("acertou_A_bool", "mean"),
+        acerto_B=("acertou_B_bool", "mean"),
+        discordancia=("discordancia", "mean"),
+        tempo_grafo=("tempo_grafo", "mean"),
+        tempo_medicos=("tempo_medicos", "mean"),
+        tempo_total=("tempo_total", "mean"),
+        tokens_prompt_caso=("tokens_prompt_caso", "mean"),
+    )
+    print(f"\n=== Configurações dos pedidos ({len(comuns)} casos em comum) ===")
+    print(comparacao_modos.round(3).to_string())
+
+    plt.figure()
+    largura = 0.8 / len(configuracoes)
+    for i, conf in enumerate(comparacao_modos.index):
+        plt.bar(
+            [x + i * largura for x in range(2)],
+            comparacao_modos.loc[conf, ["acerto_A", "acerto_B"]],
+            width=largura,
+            label=conf,
+        )
+    plt.xticks([x + largura * (len(configuracoes) - 1) / 2 for x in range(2)], ["Médico A", "Médico B"])
+    plt.ylim(0, 1)
+    plt.ylabel("Taxa de acerto")
+    plt.title("Acerto por configuração (mesmos casos)")
+    plt.legend()
+    plt.show()
+
+    plt.figure()
+    plt.bar(comparacao_modos.index, comparacao_modos["tempo_total"])
+    plt.ylabel("Tempo total médio por caso (s)")
+    plt.title("Latência por configuração (mesmos casos)")
+    plt.xticks(rotation=15)
+    plt.show()
+
+
 # ---------------------------------------------------------
 # 4) Evolução da reputação ao longo das iterações
 # ---------------------------------------------------------
@@ -204,6 +269,73 @@ plt.grid(True)
 plt.show()
 
 
+# ---------------------------------------------------------
+# 7b) Tokens e latência por chamada ao LLM
+# ---------------------------------------------------------
+# Colunas <etapa>_<campo> escritas pelo etapas.py (uma por chamada ao LLM).
+# Ficam vazias em linhas antigas, no modo em lote e nas respostas da cache.
+
+ETAPAS_LLM = ["grafo", "medico_A", "medico_B"]
+CAMPOS_LLM = ["tokens_prompt", "tokens_resposta", "tokens_cache",
+              "ttft", "latencia", "tentativas", "espera_limitador"]
+
+etapas_llm = [e for e in ETAPAS_LLM if f"{e}_latencia" in df.columns]
+for etapa in etapas_llm:
+    for campo in CAMPOS_LLM:
+        df[f"{etapa}_{campo}"] = pd.to_numeric(df[f"{etapa}_{campo}"], errors="coerce")
+
+resumo_llm = pd.DataFrame()
+if etapas_llm:
+    resumo_llm = pd.DataFrame(
+        {
+            etapa: {campo: df[f"{etapa}_{campo}"].mean() for campo in CAMPOS_LLM}
+            for etapa in etapas_llm
+        }
+    ).T
+    # fração do prompt servida pela cache de prompts da API
+    resumo_llm["frac_cache"] = resumo_llm["tokens_cache"] / resumo_llm["tokens_prompt"]
+    # tempo de geração = latência - tempo até ao primeiro token (só com MEDIR_TTFT)
+    resumo_llm["geracao"] = resumo_llm["latencia"] - resumo_llm["ttft"]
+
+    print("\n=== Tokens e latência médios por chamada ===")
+    print(resumo_llm.round(3).to_string())
+
+    # Gráfico: decomposição do tempo de cada etapa (espera no limitador,
+    # primeiro token e geração; sem TTFT a latência aparece inteira)
+    plt.figure()
+    espera = resumo_llm["espera_limitador"].fillna(0)
+    ttft = resumo_llm["ttft"].fillna(0)
+    resto = resumo_llm["latencia"].fillna(0) - ttft
+    plt.bar(etapas_llm, espera, label="Espera no limitador")
+    plt.bar(etapas_llm, ttft, bottom=espera, label="Até ao 1º token")
+    plt.bar(etapas_llm, resto, bottom=espera + ttft, label="Geração")
+    plt.ylabel("Tempo médio por chamada (s)")
+    plt.title("Decomposição do tempo das chamadas ao LLM")
+    plt.legend()
+    plt.show()
+
+    # Latência vs tokens de resposta: regressão linear (mínimos quadrados)
+    # dá o custo fixo por chamada e o tempo por token gerado
+    plt.figure()
+    for etapa in etapas_llm:
+        sel = df[[f"{etapa}_tokens_resposta", f"{etapa}_latencia"]].dropna()
+        sel = sel[sel[f"{etapa}_tokens_resposta"] > 0]
+        plt.scatter(sel[f"{etapa}_tokens_resposta"], sel[f"{etapa}_latencia"], label=etapa, s=12)
+        if len(sel) >= 2:
+            x, y = sel[f"{etapa}_tokens_resposta"], sel[f"{etapa}_latencia"]
+            declive = ((x - x.mean()) * (y - y.mean())).sum() / ((x - x.mean()) ** 2).sum()
+            ordenada = y.mean() - declive * x.mean()
+            resumo_llm.loc[etapa, "s_por_token"] = declive
+            resumo_llm.loc[etapa, "s_fixos"] = ordenada
+            print(f"{etapa}: latência ~ {ordenada:.2f} s + {1000 * declive:.1f} ms/token")
+    plt.xlabel("Tokens de resposta")
+    plt.ylabel("Latência (s)")
+    plt.title("Latência vs tokens gerados por chamada")
+    plt.legend()
+    plt.grid(True)
+    plt.show()
+
+
 # ---------------------------------------------------------
 # 8) (Opcional) Guardar um pequeno resumo em texto
 # ---------------------------------------------------------
@@ -220,5 +352,11 @@ with open(resumo_path, "w", encoding="utf-8") as f:
         media = df[col].mean()
         std = df[col].std()
         f.write(f"{col}: média = {media:.2f} s, desvio-padrão = {std:.2f} s\n")
+    if not comparacao_modos.empty:
+        f.write("\nConfigurações dos pedidos (casos em comum):\n")
+        f.write(comparacao_modos.round(3).to_string() + "\n")
+    if not resumo_llm.empty:
+        f.write("\nMédias por chamada ao LLM:\n")
+        f.write(resumo_llm.round(3).to_string() + "\n")
 
 print("\nResumo de métricas guardado em:", resumo_path)
@@ -0,0 +1,236 @@
+# reavaliacao.py
+#
+# Reavalia todo o output/historico_experimentos.csv sem chamar o LLM, para
+# escolher o critério de avaliação e o limiar (ver avaliacao.py).
+#
+# Para cada estratégia calcula-se, uma única vez, a "melhor semelhança"
+# entre as previsões de cada médico e o rótulo de cada caso:
+#   - "sequencia": SequenceMatcher (como diagnostico_correto), calculado só
+#                  uma vez por par (previsão, rótulo) distinto;
+#   - "ngramas":   cosseno TF-IDF de n-gramas de caracteres, pela matriz
+#                  previsões x rótulos (produto de matrizes NumPy);
+#   - "codigo" / "categoria": similaridade do melhor código ICD-9 (top-k do
+#                  indice_icd) que coincide com o código / categoria verdadeiros.
+# Depois, para a grelha de limiares inteira, acertou = semelhança >= limiar
+# (broadcast NumPy), e as trajetórias de reputação são somas cumulativas.
+#
+# Uso:
+#   python analise/reavaliacao.py [--historico CAMINHO] [--limiares 0.3 0.4 ...]
+
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# módulos do projeto (pasta acima de analise/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from indice_icd import obter_indice_icd, codigos_equivalentes  # noqa: E402
+import config  # noqa: E402
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MEDICOS = ("A", "B")
+ESTRATEGIAS = ("sequencia", "ngramas", "codigo", "categoria")
+LIMIARES_PADRAO = np.round(np.arange(0.2, 0.95, 0.05), 2)
+
+
+# ---------------------------------------------------------
+# 1) Histórico -> pares (caso, médico, previsão)
+# ---------------------------------------------------------
+
+def carregar_historico(path: str) -> pd.DataFrame:
+    df = pd.read_csv(path, dtype={"subject_id": str, "hadm_id": str})
+    df = df[df["diagnostico_verdadeiro"].notna()].reset_index(drop=True)
+    return df
+
+
+def _previsoes(df: pd.DataFrame) -> pd.DataFrame:
+    """Uma linha por (caso, médico, previsão), com índices para rótulos e previsões únicas."""
+    partes = []
+    for j, mid in enumerate(MEDICOS):
+        serie = df[f"diag_{mid}"].fillna("").astype(str).str.split("|")
+        ex = serie.explode()
+        partes.append(
+            pd.DataFrame({"caso": ex.index.to_numpy(), "medico": j, "previsao": ex.to_numpy()})
+        )
+    prev = pd.concat(partes, ignore_index=True)
+    prev["previsao"] = prev["previsao"].str.strip().str.lower()
+    prev = prev[prev["previsao"] != ""].reset_index(drop=True)
+    return prev
+
+
+# ---------------------------------------------------------
+# 2) Semelhança previsão x rótulo por estratégia
+# ---------------------------------------------------------
+
+def _sim_sequencia(prev_u: List[str], rot_u: List[str], ip: np.ndarray, ir: np.ndarray) -> np.ndarray:
+    pares, inv = np.unique(np.stack([ip, ir], axis=1), axis=0, return_inverse=True)
+    sims = np.fromiter(
+        (SequenceMatcher(None, rot_u[r], prev_u[p]).ratio() for p, r in pares),
+        dtype=np.float64,
+        count=len(pares),
+    )
+    return sims[inv.reshape(-1)]
+
+
+def _matriz_densa(vetores, dim: int) -> np.ndarray:
+    """Empilha vetores esparsos numa matriz densa (dimensões dobradas para `dim`)."""
+    m = np.zeros((len(vetores), dim), dtype=np.float32)
+    if not vetores:
+        return m
+    linhas = np.concatenate([np.full(len(ids), i) for i, (ids, _) in enumerate(vetores)])
+    cols = np.concatenate([ids for ids, _ in vetores]) % dim
+    pesos = np.concatenate([p for _, p in vetores])
+    np.add.at(m, (linhas, cols), pesos)
+    normas = np.linalg.norm(m, axis=1, keepdims=True)
+    np.divide(m, normas, out=m, where=normas > 0)
+    return m
+
+
+def _sim_ngramas(
+    prev_u: List[str],
+    rot_u: List[str],
+    ip: np.ndarray,
+    ir: np.ndarray,
+    dim: int = 1 << 14,
+    bloco: int = 2048,
+) -> np.ndarray:
+    vet = obter_indice_icd().vetorizador
+    r = _matriz_densa([vet.transformar(t) for t in rot_u], dim)
+    sims = np.empty(len(ip), dtype=np.float64)
+    for ini in range(0, len(prev_u), bloco):
+        p = _matriz_densa([vet.transformar(t) for t in prev_u[ini : ini + bloco]], dim)
+        s = p @ r.T  # matriz (previsões do bloco) x (rótulos)
+        sel = (ip >= ini) & (ip < ini + bloco)
+        sims[sel] = s[ip[sel] - ini, ir[sel]]
+    return sims
+
+
+def _sim_codigos(
+    prev_u: List[str],
+    rot_u: List[str],
+    ip: np.ndarray,
+    ir: np.ndarray,
+    criterio: str,
+    k: int,
+) -> np.ndarray:
+    indice = obter_indice_icd()
+    codigos_rot = [indice.codigo_do_rotulo(t) for t in rot_u]
+    top = [indice.resolver(t, k=k) for t in prev_u]
+    pares, inv = np.unique(np.stack([ip, ir], axis=1), axis=0, return_inverse=True)
+    sims = np.zeros(len(pares), dtype=np.float64)
+    for n, (p, r) in enumerate(pares):
+        for codigo, sim in top[p]:
+            if codigos_equivalentes(codigo, codigos_rot[r], criterio):
+                sims[n] = sim
+                break
+    return sims[inv.reshape(-1)]
+
+
+def melhor_semelhanca(df: pd.DataFrame, estrategia: str, k: Optional[int] = None) -> np.ndarray:
+    """
+    Array (n_casos, n_medicos) com a melhor semelhança entre as previsões de
+    cada médico e o rótulo do caso (0 se o médico não deu previsões).
+    """
+    prev = _previsoes(df)
+    rot_cod, rot_u = pd.factorize(df["diagnostico_verdadeiro"].str.strip().str.lower())
+    prev_cod, prev_u = pd.factorize(prev["previsao"])
+    ip = prev_cod.astype(np.int64)
+    ir = rot_cod[prev["caso"].to_numpy()].astype(np.int64)
+    prev_u, rot_u = list(prev_u), list(rot_u)
+
+    if estrategia == "sequencia":
+        sims = _sim_sequencia(prev_u, rot_u, ip, ir)
+    elif estrategia == "ngramas":
+        sims = _sim_ngramas(prev_u, rot_u, ip, ir)
+    elif estrategia in ("codigo", "categoria"):
+        sims = _sim_codigos(prev_u, rot_u, ip, ir, estrategia, k or config.TOP_K_ICD)
+    else:
+        raise ValueError(f"estratégia desconhecida: {estrategia}")
+
+    melhor = np.zeros((len(df), len(MEDICOS)), dtype=np.float64)
+    np.maximum.at(melhor, (prev["caso"].to_numpy(), prev["medico"].to_numpy()), sims)
+    return melhor
+
+
+# ---------------------------------------------------------
+# 3) Grelha de limiares
+# ---------------------------------------------------------
+
+def reavaliar(
+    df: pd.DataFrame,
+    limiares=LIMIARES_PADRAO,
+    estrategias=ESTRATEGIAS,
+) -> Tuple[pd.DataFrame, Dict[Tuple[str, float], np.ndarray]]:
+    """
+    Devolve:
+      - resumo: uma linha por (estratégia, limiar) com a taxa de acerto e a
+        reputação final de cada médico;
+      - trajetorias[(estrategia, limiar)]: array (n_casos, n_medicos) com a
+        reputação depois de cada caso (pela ordem do histórico).
+    Também junta ao df as colunas semelhanca_<estrategia>_<medico>, para
+    inspeção manual dos casos.
+    """
+    limiares = np.asarray(limiares, dtype=np.float64)
+    n = len(df)
+    totais = np.arange(1, n + 1, dtype=np.float64)[None, :, None]
+
+    linhas = []
+    trajetorias = {}
+    for estrategia in estrategias:
+        melhor = melhor_semelhanca(df, estrategia)              # (casos, médicos)
+        acertos = melhor[None, :, :] >= limiares[:, None, None]  # (limiares, casos, médicos)
+        reput = np.cumsum(acertos, axis=1) / totais
+        taxa = acertos.mean(axis=1) if n else np.full((len(limiares), len(MEDICOS)), np.nan)
+
+        for i, limiar in enumerate(limiares):
+            linha = {"estrategia": estrategia, "limiar": float(limiar)}
+            for j, mid in enumerate(MEDICOS):
+                linha[f"acerto_{mid}"] = float(taxa[i, j])
+                linha[f"reputacao_final_{mid}"] = float(reput[i, -1, j]) if n else 0.5
+            linhas.append(linha)
+            trajetorias[(estrategia, float(limiar))] = reput[i]
+
+        for j, mid in enumerate(MEDICOS):
+            df[f"semelhanca_{estrategia}_{mid}"] = melhor[:, j]
+
+    return pd.DataFrame(linhas), trajetorias
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reavaliação do histórico com vários limiares.")
+    parser.add_argument(
+        "--historico",
+        default=os.path.join(config.OUTPUT_DIR, "historico_experimentos.csv"),
+    )
+    parser.add_argument("--limiares", type=float, nargs="*", default=list(LIMIARES_PADRAO))
+    parser.add_argument("--estrategias", nargs="*", default=list(ESTRATEGIAS), choices=ESTRATEGIAS)
+    parser.add_argument("--saida", default=os.path.join(BASE_DIR, "output", "reavaliacao_limiares.csv"))
+    args = parser.parse_args()
+
+    print("A carregar histórico de:", args.historico)
+    df = carregar_historico(args.historico)
+    print("Casos com ground truth:", len(df))
+
+    resumo, _ = reavaliar(df, args.limiares, args.estrategias)
+
+    os.makedirs(os.path.dirname(args.saida), exist_ok=True)
+    resumo.to_csv(args.saida, index=False)
+    with pd.option_context("display.max_rows", None, "display.width", 120):
+        print(resumo.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+    print("\nResumo gravado em:", args.saida)
+
+    # melhor limiar por estratégia (média dos dois médicos)
+    resumo["acerto_medio"] = resumo[[f"acerto_{m}" for m in MEDICOS]].mean(axis=1)
+    melhores = resumo.loc[resumo.groupby("estrategia")["acerto_medio"].idxmax()]
+    print("\n=== Melhor limiar por estratégia ===")
+    print(melhores[["estrategia", "limiar", "acerto_medio"]].to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+# armazem_notas.py
+#
+# Armazém binário das notas clínicas, para acesso aleatório a uma nota de
+# cada vez sem manter o texto de todas em memória.
+#
+# Formato (dois ficheiros com o mesmo nome base):
+#   <base>.bin      registos concatenados (append-only), cada um com o texto
+#                   da nota em UTF-8, opcionalmente comprimido com zlib
+#   <base>.idx.npy  array estruturado NumPy com uma linha por nota:
+#                   row_id, subject_id, hadm_id, offset, tamanho (bytes no
+#                   .bin), len_nota (nº de caracteres) e comprimido (0/1)
+#   <base>.hadm.npy (opcional) HADM_ID tal como está no CSV (ex.: "174105.0"),
+#                   para os casos devolverem o mesmo texto que o pandas; sem
+#                   ele (armazéns antigos) o hadm_id sai normalizado ("174105")
+#
+# O índice é pequeno e pode ser lido com mmap; as heurísticas de seleção
+# (ex.: active_learning) trabalham só sobre estes arrays. O texto só é lido
+# quando um caso é efetivamente processado (ver CasoNota).
+
+from collections.abc import Mapping
+from typing import Dict, Any, List, Optional, Iterator
+import mmap
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+
+
+DTYPE_INDICE = np.dtype(
+    [
+        ("row_id", "<i8"),
+        ("subject_id", "<i8"),
+        ("hadm_id", "<i8"),  # -1 quando a nota não tem HADM_ID válido
+        ("offset", "<u8"),
+        ("tamanho", "<u4"),
+        ("len_nota", "<u4"),
+        ("comprimido", "u1"),
+    ]
+)
+
+
+def chave_composta(subject_id, hadm_id):
+    """Chave inteira (SUBJECT_ID, HADM_ID) -> int64, funciona com escalares ou arrays."""
+    return (np.asarray(subject_id, dtype=np.int64) << 32) | (
+        np.asarray(hadm_id, dtype=np.int64) & 0xFFFFFFFF
+    )
+
+
+def _caminhos(path_base: str):
+    return f"{path_base}.bin", f"{path_base}.idx.npy"
+
+
+def _caminho_hadm(path_base: str) -> str:
+    return f"{path_base}.hadm.npy"
+
+
+def existe_armazem(path_base: str) -> bool:
+    return all(os.path.exists(p) for p in _caminhos(path_base))
+
+
+class EscritorNotas:
+    """
+    Acrescenta notas ao armazém. O índice só é gravado em fechar(), de forma
+    atómica; se o processo morrer a meio, os bytes extra no .bin são ignorados.
+    """
+
+    def __init__(self, path_base: str, comprimir: bool = True, min_bytes_compressao: int = 256):
+        self.path_bin, self.path_idx = _caminhos(path_base)
+        self.comprimir = comprimir
+        self.min_bytes_compressao = min_bytes_compressao
+
+        os.makedirs(os.path.dirname(self.path_bin) or ".", exist_ok=True)
+        self._indice_antigo = (
+            np.load(self.path_idx) if os.path.exists(self.path_idx) else np.empty(0, DTYPE_INDICE)
+        )
+        self._f = open(self.path_bin, "ab")
+        # continuar a seguir ao último registo indexado (descarta lixo de escritas interrompidas)
+        if len(self._indice_antigo):
+            ultimo = self._indice_antigo[-1]
+            fim = int(ultimo["offset"]) + int(ultimo["tamanho"])
+            self._f.truncate(fim)
+        self._f.seek(0, os.SEEK_END)
+        self._offset = self._f.tell()
+        self._novas: List[tuple] = []
+
+    def adicionar(self, row_id: int, subject_id: int, hadm_id: Optional[int], texto: str):
+        texto = "" if texto is None else str(texto)
+        dados = texto.encode("utf-8")
+        comprimido = 0
+        if self.comprimir and len(dados) >= self.min_bytes_compressao:
+            z = zlib.compress(dados, 6)
+            if len(z) < len(dados):
+                dados, comprimido = z, 1
+
+        self._f.write(dados)
+        self._novas.append(
+            (
+                int(row_id),
+                int(subject_id),
+                -1 if hadm_id is None else int(hadm_id),
+                self._offset,
+                len(dados),
+                len(texto),
+                comprimido,
+            )
+        )
+        self._offset += len(dados)
+
+    def fechar(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+
+        novas = np.array(self._novas, dtype=DTYPE_INDICE)
+        indice = np.concatenate([self._indice_antigo, novas])
+        tmp = f"{self.path_idx}.tmp.npy"
+        np.save(tmp, indice)
+        os.replace(tmp, self.path_idx)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+
+class ArmazemNotas:
+    """Leitura aleatória de notas a partir do índice (mmap) e do ficheiro binário."""
+
+    def __init__(self, path_base: str):
+        self.path_bin, self.path_idx = _caminhos(path_base)
+        self.indice = np.load(self.path_idx, mmap_mode="r")
+        path_hadm = _caminho_hadm(path_base)
+        self.hadm_texto = np.load(path_hadm, mmap_mode="r") if os.path.exists(path_hadm) else None
+        self._mm: Optional[mmap.mmap] = None
+        self._ordem_chaves = None
+        self._ordem_row_ids = None
+
+    def __len__(self) -> int:
+        return len(self.indice)
+
+    # ---------------------- metadados -------------------------
+
+    @property
+    def len_notas(self) -> np.ndarray:
+        return self.indice["len_nota"]
+
+    def posicoes_admissao(self, subject_id: int, hadm_id: int) -> np.ndarray:
+        """Posições (no índice) de todas as notas de uma admissão."""
+        if self._ordem_chaves is None:
+            chaves = chave_composta(self.indice["subject_id"], self.indice["hadm_id"])
+            self._ordem_chaves = np.argsort(chaves, kind="stable")
+            self._chaves_ordenadas = chaves[self._ordem_chaves]
+        alvo = chave_composta(subject_id, hadm_id)
+        ini = np.searchsorted(self._chaves_ordenadas, alvo, side="left")
+        fim = np.searchsorted(self._chaves_ordenadas, alvo, side="right")
+        return self._ordem_chaves[ini:fim]
+
+    def posicao_row_id(self, row_id: int) -> Optional[int]:
+        if self._ordem_row_ids is None:
+            self._ordem_row_ids = np.argsort(self.indice["row_id"], kind="stable")
+            self._row_ids_ordenados = self.indice["row_id"][self._ordem_row_ids]
+        i = np.searchsorted(self._row_ids_ordenados, row_id)
+        if i < len(self._row_ids_ordenados) and self._row_ids_ordenados[i] == row_id:
+            return int(self._ordem_row_ids[i])
+        return None
+
+    # ---------------------- texto -------------------------
+
+    def ler(self, pos: int) -> str:
+        if self._mm is None:
+            with open(self.path_bin, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return ""
+                # leitura por slices de mmap é segura entre threads
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        reg = self.indice[pos]
+        ini = int(reg["offset"])
+        dados = self._mm[ini : ini + int(reg["tamanho"])]
+        if reg["comprimido"]:
+            dados = zlib.decompress(dados)
+        return dados.decode("utf-8")
+
+    def caso(self, pos: int, diagnostico_verdadeiro=None, extras=None) -> "CasoNota":
+        return CasoNota(self, int(pos), diagnostico_verdadeiro, extras)
+
+
+class CasoNota(Mapping):
+    """
+    Caso "leve": comporta-se como o dicionário devolvido por
+    carregar_casos_mimic, mas o texto ("descricao") só é lido do armazém
+    quando é pedido. "len_nota" vem do índice, sem tocar no texto.
+    """
+
+    _CHAVES = ("id", "subject_id", "hadm_id", "descricao", "diagnostico_verdadeiro", "len_nota")
+
+    def __init__(
+        self,
+        armazem: ArmazemNotas,
+        pos: int,
+        diagnostico_verdadeiro=None,
+        extras: Optional[Dict[str, Any]] = None,
+    ):
+        self._armazem = armazem
+        self._pos = pos
+        self._diag = diagnostico_verdadeiro
+        self._extras = extras or {}
+
+    def __getitem__(self, chave: str) -> Any:
+        if chave in self._extras:
+            return self._extras[chave]
+        reg = self._armazem.indice[self._pos]
+        if chave == "id":
+            return int(reg["row_id"])
+        if chave == "subject_id":
+            return str(int(reg["subject_id"]))
+        if chave == "hadm_id":
+            if self._armazem.hadm_texto is not None:
+                return self._armazem.hadm_texto[self._pos].decode("ascii") or None
+            return None if reg["hadm_id"] < 0 else str(int(reg["hadm_id"]))
+        if chave == "descricao":
+            return self._armazem.ler(self._pos)
+        if chave == "diagnostico_verdadeiro":
+            return self._diag
+        if chave == "len_nota":
+            return int(reg["len_nota"])
+        return self._extras[chave]
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._CHAVES
+        yield from self._extras
+
+    def __len__(self) -> int:
+        return len(self._CHAVES) + len(self._extras)
+
+    def __repr__(self) -> str:
+        return f"CasoNota(pos={self._pos}, subject_id={self['subject_id']}, hadm_id={self['hadm_id']})"
+
+
+def gravar_armazem_notas(
+    path_csv: str,
+    path_base: str,
+    comprimir: bool = True,
+    chunksize: int = 5000,
+) -> int:
+    """
+    Converte um CSV de notas (SUBJECT_ID, HADM_ID, NOTE_TEXT e, se houver,
+    ROW_ID) num
+    armazém binário, lendo por blocos. Substitui um armazém já existente.
+    Devolve o nº de notas gravadas.
+    """
+    for p in (*_caminhos(path_base), _caminho_hadm(path_base)):
+        if os.path.exists(p):
+            os.remove(p)
+
+    colunas = pd.read_csv(path_csv, nrows=0).columns
+    usecols = [c for c in ("ROW_ID", "SUBJECT_ID", "HADM_ID", "NOTE_TEXT") if c in colunas]
+
+    n = 0
+    hadm_texto: List[np.ndarray] = []
+    with EscritorNotas(path_base, comprimir=comprimir) as escritor:
+        for chunk in pd.read_csv(path_csv, dtype=str, usecols=usecols, chunksize=chunksize):
+            hadm_texto.append(chunk["HADM_ID"].fillna("").to_numpy(dtype="S"))
+            subj = pd.to_numeric(chunk["SUBJECT_ID"], errors="coerce").fillna(-1).astype("int64")
+            hadm = pd.to_numeric(chunk["HADM_ID"], errors="coerce").fillna(-1).astype("int64")
+            if "ROW_ID" in chunk:
+                row_ids = pd.to_numeric(chunk["ROW_ID"], errors="coerce").fillna(-1).astype("int64")
+            else:
+                row_ids = pd.Series(range(n, n + len(chunk)))
+            for row_id, s, h, texto in zip(row_ids, subj, hadm, chunk["NOTE_TEXT"]):
+                escritor.adicionar(row_id, s, None if h < 0 else h, "" if pd.isna(texto) else texto)
+            n += len(chunk)
+
+    path_hadm = _caminho_hadm(path_base)
+    tmp = f"{path_hadm}.tmp.npy"
+    np.save(tmp, np.concatenate(hadm_texto) if hadm_texto else np.empty(0, "S1"))
+    os.replace(tmp, path_hadm)
+    return n
@@ -1,8 +1,11 @@
 # avaliacao.py
 
-from typing import List
+from typing import List, Optional
 from difflib import SequenceMatcher
 
+from indice_icd import IndiceICD, obter_indice_icd, codigos_equivalentes
+import config
+
 
 def _similaridade(a: str, b: str) -> float:
     return SequenceMatcher(None, a, b).ratio()
@@ -34,3 +37,56 @@ def diagnostico_correto(
         if _similaridade(alvo, cand) >= limiar:
             return True
     return False
+
+
+def diagnostico_correto_por_codigo(
+    diagnosticos_modelo: List[str],
+    codigo_verdadeiro: Optional[str],
+    criterio: str = "categoria",
+    k: Optional[int] = None,
+    limiar: Optional[float] = None,
+    indice: Optional[IndiceICD] = None,
+) -> bool:
+    """
+    Considera correto se algum dos diagnósticos do modelo, resolvido para os
+    seus k códigos ICD-9 mais prováveis (com similaridade >= limiar), for
+    igual ao código verdadeiro (criterio="codigo") ou da mesma categoria de
+    3 dígitos (criterio="categoria").
+    """
+    if not codigo_verdadeiro:
+        return False
+    if indice is None:
+        indice = obter_indice_icd()
+    if k is None:
+        k = config.TOP_K_ICD
+    if limiar is None:
+        limiar = config.LIMIAR_SIMILARIDADE_ICD
+
+    for nome in diagnosticos_modelo:
+        if not nome:
+            continue
+        for codigo, sim in indice.resolver(nome, k=k):
+            if sim >= limiar and codigos_equivalentes(codigo, codigo_verdadeiro, criterio):
+                return True
+    return False
+
+
+def avaliar_diagnosticos(
+    diagnosticos_modelo: List[str],
+    diagnostico_verdadeiro: Optional[str],
+    codigo_verdadeiro: Optional[str] = None,
+    criterio: Optional[str] = None,
+) -> bool:
+    """
+    Avaliação usada pelo pipeline, segundo config.CRITERIO_AVALIACAO:
+      - "texto": diagnostico_correto (semelhança de strings, como antes);
+      - "codigo" / "categoria": diagnostico_correto_por_codigo. Se o caso
+        não trouxer o código ICD-9, é obtido a partir do rótulo.
+    """
+    if criterio is None:
+        criterio = config.CRITERIO_AVALIACAO
+    if criterio == "texto":
+        return diagnostico_correto(diagnosticos_modelo, diagnostico_verdadeiro)
+    if not codigo_verdadeiro:
+        codigo_verdadeiro = obter_indice_icd().codigo_do_rotulo(diagnostico_verdadeiro)
+    return diagnostico_correto_por_codigo(diagnosticos_modelo, codigo_verdadeiro, criterio)
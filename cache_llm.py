@@ -0,0 +1,172 @@
+# cache_llm.py
+#
+# Cache persistente (em disco) das respostas do modelo.
+#
+# Cada entrada é endereçada pelo conteúdo: a chave é o SHA-256 de
+# (modelo, temperatura, mensagens já renderizadas - prompt de sistema e
+# mensagem do utilizador). Guarda-se a resposta em bruto e o JSON já
+# interpretado, para que uma nova execução sobre as mesmas notas não volte
+# a pagar as chamadas a ConstrutorGrafoLLM.construir / MedicoLLM.diagnosticar.
+#
+# Eviction:
+#   - por idade desde a criação (criado_em / mtime do ficheiro, que não muda
+#     depois de escrito): entradas com mais de max_idade_s são ignoradas e
+#     apagadas, mesmo que continuem a ser usadas;
+#   - por tamanho (nº de entradas e/ou bytes totais), apagando primeiro as
+#     entradas usadas há mais tempo (atime, atualizado em cada hit).
+
+from typing import Dict, Any, List, Optional
+import hashlib
+import json
+import os
+import threading
+import time
+
+import config
+
+
+class CacheLLM:
+    def __init__(
+        self,
+        diretorio: str,
+        max_entradas: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        max_idade_s: Optional[float] = None,
+    ):
+        self.diretorio = diretorio
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.max_idade_s = max_idade_s
+        self.hits = 0
+        self.misses = 0
+        self._escritas_desde_limpeza = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.diretorio, exist_ok=True)
+
+    # ---------------------- chaves -------------------------
+
+    @staticmethod
+    def chave(model_name: str, temperature: float, mensagens: List[Any]) -> str:
+        """Hash de (modelo, temperatura, mensagens renderizadas)."""
+        conteudo = {
+            "model": model_name,
+            "temperature": float(temperature),
+            "messages": [[getattr(m, "type", ""), str(m.content)] for m in mensagens],
+        }
+        texto = json.dumps(conteudo, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+    def _caminho(self, chave: str) -> str:
+        # subpastas pelos 2 primeiros caracteres para não ter milhares de ficheiros juntos
+        return os.path.join(self.diretorio, chave[:2], f"{chave}.json")
+
+    # ---------------------- leitura / escrita -------------------------
+
+    def obter(self, chave: str) -> Optional[Dict[str, Any]]:
+        """Devolve {"texto": ..., "dados": ...} ou None (e conta hit/miss)."""
+        path = self._caminho(chave)
+        entrada = None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entrada = json.load(f)
+            st = os.stat(path)
+            if self.max_idade_s is not None:
+                criado_em = entrada.get("criado_em", st.st_mtime)
+                if time.time() - criado_em > self.max_idade_s:
+                    self._remover(path)
+                    raise FileNotFoundError(path)
+            # marca como usada recentemente (LRU pelo atime); o mtime fica o da criação
+            os.utime(path, (time.time(), st.st_mtime))
+        except (FileNotFoundError, json.JSONDecodeError):
+            entrada = None
+
+        with self._lock:
+            if entrada is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entrada
+
+    def guardar(self, chave: str, texto: str, dados: Any):
+        path = self._caminho(chave)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entrada = {"texto": texto, "dados": dados, "criado_em": time.time()}
+        # escrita atómica: ficheiro temporário + rename
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entrada, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+        with self._lock:
+            self._escritas_desde_limpeza += 1
+            limpar = self._escritas_desde_limpeza >= 50
+            if limpar:
+                self._escritas_desde_limpeza = 0
+        if limpar:
+            self.limpar()
+
+    # ---------------------- eviction -------------------------
+
+    def _entradas(self):
+        for raiz, _, ficheiros in os.walk(self.diretorio):
+            for nome in ficheiros:
+                if not nome.endswith(".json"):
+                    continue
+                path = os.path.join(raiz, nome)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, st.st_mtime, st.st_atime, st.st_size
+
+    def limpar(self):
+        """Aplica os limites de idade, nº de entradas e bytes."""
+        agora = time.time()
+        entradas = []
+        for path, criado, usado, tamanho in self._entradas():
+            if self.max_idade_s is not None and agora - criado > self.max_idade_s:
+                self._remover(path)
+            else:
+                entradas.append((usado, tamanho, path))
+
+        # usadas há mais tempo primeiro
+        entradas.sort()
+        total_bytes = sum(t for _, t, _ in entradas)
+        n = len(entradas)
+        for _, tamanho, path in entradas:
+            excede_n = self.max_entradas is not None and n > self.max_entradas
+            excede_b = self.max_bytes is not None and total_bytes > self.max_bytes
+            if not (excede_n or excede_b):
+                break
+            self._remover(path)
+            n -= 1
+            total_bytes -= tamanho
+
+    @staticmethod
+    def _remover(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+_cache_global: Optional[CacheLLM] = None
+_lock_global = threading.Lock()
+
+
+def obter_cache() -> Optional[CacheLLM]:
+    """Devolve a cache única do processo, ou None se estiver desligada no config.py."""
+    global _cache_global
+    if not config.CACHE_LLM_ATIVA:
+        return None
+    with _lock_global:
+        if _cache_global is None:
+            max_mb = config.CACHE_LLM_MAX_MB
+            max_dias = config.CACHE_LLM_MAX_DIAS
+            _cache_global = CacheLLM(
+                config.DIR_CACHE_LLM,
+                max_entradas=config.CACHE_LLM_MAX_ENTRADAS,
+                max_bytes=int(max_mb * 1024 * 1024) if max_mb else None,
+                max_idade_s=max_dias * 86400.0 if max_dias else None,
+            )
+        return _cache_global
@@ -0,0 +1,580 @@
+# cliente_llm.py
+#
+# Ponto único por onde passam todas as chamadas ao modelo de chat
+# (ConstrutorGrafoLLM e MedicoLLM). Antes de cada pedido reserva
+# capacidade no limitador de taxa partilhado; quando a API devolve 429
+# lê o Retry-After, avisa o limitador e tenta de novo.
+#
+# Se a cache em disco estiver ativa (cache_llm.py), as respostas são
+# procuradas/guardadas por hash de (modelo, temperatura, mensagens).
+#
+# Cada RespostaLLM traz as métricas da chamada: tokens de prompt, de
+# resposta e de prompt servidos pela cache da OpenAI (usage_metadata),
+# latência total, tempo até ao primeiro token (com config.MEDIR_TTFT o
+# pedido é feito em streaming), nº de tentativas e espera no limitador.
+#
+# Com ao_pedaco (ver json_incremental.py) o pedido também é feito em streaming
+# e cada pedaço de texto é entregue ao chamador à medida que chega. Se a
+# ligação cair a meio, o texto já recebido é devolvido (o parser repara o
+# JSON) em vez de se repetir o pedido inteiro.
+#
+# Com um prazo (cobertura.Prazo) a chamada é cancelada quando o prazo do caso
+# acaba (PrazoExcedido). Uma chamada mais lenta que o percentil configurado
+# da sua etapa leva um pedido de cobertura (duplicado), se o limitador tiver
+# orçamento livre; fica a primeira resposta. No modo assíncrono o outro pedido
+# é cancelado; em invocar() os dois correm em threads e o que perde deixa de
+# ser lido (em streaming é interrompido no pedaço seguinte).
+#
+# Com config.LLM_FALSO o ChatOpenAI é substituído pelo modelo falso de
+# llm_falso.py (sem chave nem rede), para testes e benchmarks.
+#
+# Com config.RASTREIO_ATIVO cada chamada fica num span "llm" (etapa, tokens,
+# tentativas, cache) com os filhos "limitador", "pedido" e "parser".
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional, Callable, Tuple
+import asyncio
+import threading
+import time
+
+from langchain_openai import ChatOpenAI
+
+from limitador import LimitadorTaxa, obter_limitador, estimar_tokens
+from cache_llm import CacheLLM, obter_cache
+from cobertura import Prazo, PrazoExcedido, obter_percentis
+from llm_falso import ModeloFalso
+from rastreio import span
+import config
+
+
+@dataclass
+class RespostaLLM:
+    texto: str
+    dados: Any = None  # resultado do parser (ex.: JSON interpretado)
+    em_cache: bool = False
+    tentativas: int = 1
+    espera_limitador: float = 0.0  # segundos à espera de orçamento RPM/TPM
+    tokens_prompt: int = 0
+    tokens_resposta: int = 0
+    tokens_cache: int = 0  # tokens do prompt servidos pela cache de prompts da API
+    ttft: float = float("nan")  # tempo até ao primeiro token (s), só em streaming
+    latencia: float = 0.0  # duração do pedido bem-sucedido (s)
+    cobertura: bool = False  # foi enviado um pedido de cobertura
+    cobertura_venceu: bool = False  # a resposta usada foi a do pedido de cobertura
+
+
+# colunas por chamada no histórico (ver etapas.CABECALHO_HISTORICO)
+CAMPOS_METRICAS = (
+    "tokens_prompt",
+    "tokens_resposta",
+    "tokens_cache",
+    "ttft",
+    "latencia",
+    "tentativas",
+    "espera_limitador",
+)
+
+
+def metricas_resposta(resposta: Optional[RespostaLLM]) -> List[Any]:
+    """Valores de CAMPOS_METRICAS (NaN se não houve chamada, ex.: modo em lote)."""
+    if resposta is None:
+        return [float("nan")] * len(CAMPOS_METRICAS)
+    return [getattr(resposta, c) for c in CAMPOS_METRICAS]
+
+
+def _atributos_span(resposta: RespostaLLM) -> Dict[str, Any]:
+    """Atributos do span "llm" (rastreio.py)."""
+    return {
+        "em_cache": resposta.em_cache,
+        "tentativas": resposta.tentativas,
+        "espera_limitador": round(resposta.espera_limitador, 4),
+        "tokens_prompt": resposta.tokens_prompt,
+        "tokens_resposta": resposta.tokens_resposta,
+        "tokens_cache": resposta.tokens_cache,
+        "cobertura": resposta.cobertura,
+    }
+
+
+def _uso_tokens(response) -> Tuple[int, int, int]:
+    """(prompt, resposta, prompt em cache) a partir dos metadados da resposta."""
+    uso = getattr(response, "usage_metadata", None) or {}
+    detalhes = uso.get("input_token_details") or {}
+    return (
+        int(uso.get("input_tokens", 0) or 0),
+        int(uso.get("output_tokens", 0) or 0),
+        int(detalhes.get("cache_read", 0) or 0),
+    )
+
+
+def _e_limite_taxa(exc: Exception) -> bool:
+    """True se a exceção corresponde a um 429 (rate limit) recuperável."""
+    if getattr(exc, "status_code", None) != 429:
+        return False
+    # quota esgotada também vem como 429 mas não adianta repetir
+    return getattr(exc, "code", None) != "insufficient_quota"
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    """Extrai o Retry-After (em segundos) da resposta HTTP, se existir."""
+    resp = getattr(exc, "response", None)
+    headers = getattr(resp, "headers", None)
+    if not headers:
+        return None
+    valor_ms = headers.get("retry-after-ms")
+    if valor_ms is not None:
+        try:
+            return float(valor_ms) / 1000.0
+        except ValueError:
+            pass
+    valor = headers.get("retry-after")
+    if valor is not None:
+        try:
+            return float(valor)
+        except ValueError:
+            pass
+    return None
+
+
+def criar_modelo_chat(model_name: str, temperature: float):
+    """ChatOpenAI, ou o modelo falso (llm_falso.py) com config.LLM_FALSO."""
+    if config.LLM_FALSO:
+        return ModeloFalso(model=model_name, temperature=temperature)
+    # as repetições ficam a cargo do ClienteLLM (para passarem pelo limitador);
+    # stream_usage para ter usage_metadata também nos pedidos em streaming
+    return ChatOpenAI(
+        model=model_name, temperature=temperature, max_retries=0, stream_usage=True
+    )
+
+
+_INTERROMPIDA = "streaming_interrompido"  # chave em response_metadata
+
+
+def _resposta_completa(response, parser: Optional[Callable]) -> bool:
+    """False se o streaming foi interrompido ou o parser teve de reparar o JSON."""
+    if response is not None and getattr(response, "response_metadata", {}).get(_INTERROMPIDA):
+        return False
+    return not getattr(parser, "reparado", False)
+
+
+class _PedidoAbandonado(Exception):
+    """Interrompe o streaming de um pedido cuja resposta já não é precisa."""
+
+
+class _PedacosGuardados:
+    """
+    ao_pedaco do pedido principal quando há cobertura em threads: depois de
+    fechar(), os pedaços já não chegam ao parser e o streaming é interrompido.
+    """
+
+    def __init__(self, ao_pedaco: Optional[Callable[[str], None]]):
+        self._ao_pedaco = ao_pedaco
+        self._lock = threading.Lock()
+        self._fechado = False
+
+    def ao_pedaco(self, texto: str):
+        with self._lock:
+            if self._fechado:
+                raise _PedidoAbandonado()
+            self._ao_pedaco(texto)
+
+    def fechar(self):
+        with self._lock:
+            self._fechado = True
+
+
+class _Streaming:
+    """Junta os pedaços de uma resposta em streaming e mede o primeiro token."""
+
+    def __init__(self, t0: float, ao_pedaco: Optional[Callable[[str], None]]):
+        self.t0 = t0
+        self.ao_pedaco = ao_pedaco
+        self.response = None
+        self.ttft = float("nan")
+
+    def receber(self, pedaco):
+        self.response = pedaco if self.response is None else self.response + pedaco
+        if pedaco.content:
+            if self.ttft != self.ttft:  # NaN: ainda sem primeiro token
+                self.ttft = time.perf_counter() - self.t0
+            if self.ao_pedaco is not None:
+                self.ao_pedaco(pedaco.content)
+
+    def interrompido(self, exc: Exception):
+        # sem texto recebido, ou sem parser incremental para o reparar: erro normal
+        # (os 429 também seguem para o ciclo de repetição)
+        if isinstance(exc, _PedidoAbandonado) or self.ao_pedaco is None or self.response is None or _e_limite_taxa(exc):
+            raise exc
+        print(
+            f"[cliente_llm] streaming interrompido ({exc.__class__.__name__}); "
+            f"a usar os {len(self.response.content)} caracteres recebidos"
+        )
+        # marca a resposta como incompleta: é usada, mas não fica na cache em disco
+        self.response.response_metadata[_INTERROMPIDA] = True
+
+
+class ClienteLLM:
+    """Wrapper de ChatOpenAI com limitador de taxa partilhado e repetições em 429."""
+
+    def __init__(
+        self,
+        model_name: str = "gpt-4o-mini",
+        temperature: float = 0.0,
+        limitador: Optional[LimitadorTaxa] = None,
+        max_tentativas: Optional[int] = None,
+        usar_cache: bool = True,
+        etapa: str = "llm",
+    ):
+        self.model_name = model_name
+        # nome da etapa nos percentis de latência ("grafo", "medico_A", ...)
+        self.etapa = etapa
+        self.temperature = temperature
+        self.model = criar_modelo_chat(model_name, temperature)
+        self.limitador = limitador or obter_limitador()
+        self.max_tentativas = max_tentativas or config.MAX_TENTATIVAS_LLM
+        # usar_cache=False para modelos não determinísticos (ex.: médico explorador)
+        self.cache: Optional[CacheLLM] = obter_cache() if usar_cache else None
+
+    def _estimar(self, mensagens: List[Any]) -> int:
+        prompt = sum(estimar_tokens(str(m.content)) for m in mensagens)
+        return prompt + config.TOKENS_RESPOSTA_ESTIMADOS
+
+    def _registar_uso(self, estimados: int, response):
+        uso = getattr(response, "usage_metadata", None) or {}
+        self.limitador.ajustar_tokens(estimados, uso.get("total_tokens", 0))
+        self.limitador.registar_sucesso()
+
+    def _consultar_cache(self, mensagens: List[Any], parser: Optional[Callable]):
+        """Devolve (chave, RespostaLLM em cache ou None)."""
+        if self.cache is None:
+            return None, None
+        chave = CacheLLM.chave(self.model_name, self.temperature, mensagens)
+        entrada = self.cache.obter(chave)
+        if entrada is None:
+            return chave, None
+        dados = entrada.get("dados")
+        if dados is None and parser is not None:
+            dados = parser(entrada["texto"])
+        return chave, RespostaLLM(
+            texto=entrada["texto"], dados=dados, em_cache=True, tentativas=0
+        )
+
+    def _concluir(
+        self,
+        chave: Optional[str],
+        texto: str,
+        parser: Optional[Callable],
+        tentativa: int,
+        espera: float,
+        response=None,
+        ttft: float = float("nan"),
+        latencia: float = 0.0,
+        cobertura: bool = False,
+        cobertura_venceu: bool = False,
+    ) -> RespostaLLM:
+        # se o parser falhar a exceção propaga e a resposta não fica em cache;
+        # respostas interrompidas ou reparadas também não
+        with span("parser", caracteres=len(texto)):
+            dados = parser(texto) if parser is not None else None
+        if self.cache is not None and chave is not None and _resposta_completa(response, parser):
+            self.cache.guardar(chave, texto, dados)
+        tokens_prompt, tokens_resposta, tokens_cache = _uso_tokens(response)
+        return RespostaLLM(
+            texto=texto,
+            dados=dados,
+            tentativas=tentativa,
+            espera_limitador=espera,
+            tokens_prompt=tokens_prompt,
+            tokens_resposta=tokens_resposta,
+            tokens_cache=tokens_cache,
+            ttft=ttft,
+            latencia=latencia,
+            cobertura=cobertura,
+            cobertura_venceu=cobertura_venceu,
+        )
+
+    def _chamar(
+        self,
+        mensagens: List[Any],
+        ao_pedaco: Optional[Callable[[str], None]] = None,
+        timeout: Optional[float] = None,
+    ):
+        """Um pedido ao modelo. Devolve (resposta, ttft, latência)."""
+        t0 = time.perf_counter()
+        # o timeout (prazo do caso) segue para o cliente HTTP da OpenAI
+        extra = {} if timeout is None else {"timeout": timeout}
+        if not config.MEDIR_TTFT and ao_pedaco is None:
+            response = self.model.invoke(mensagens, **extra)
+            return response, float("nan"), time.perf_counter() - t0
+        estado = _Streaming(t0, ao_pedaco)
+        try:
+            for pedaco in self.model.stream(mensagens, **extra):
+                estado.receber(pedaco)
+        except Exception as exc:
+            estado.interrompido(exc)
+        return estado.response, estado.ttft, time.perf_counter() - t0
+
+    async def _achamar(self, mensagens: List[Any], ao_pedaco: Optional[Callable[[str], None]] = None):
+        """Versão assíncrona de _chamar()."""
+        t0 = time.perf_counter()
+        if not config.MEDIR_TTFT and ao_pedaco is None:
+            response = await self.model.ainvoke(mensagens)
+            return response, float("nan"), time.perf_counter() - t0
+        estado = _Streaming(t0, ao_pedaco)
+        try:
+            async for pedaco in self.model.astream(mensagens):
+                estado.receber(pedaco)
+        except Exception as exc:
+            estado.interrompido(exc)
+        return estado.response, estado.ttft, time.perf_counter() - t0
+
+    def _chamar_coberto(
+        self,
+        mensagens: List[Any],
+        ao_pedaco: Optional[Callable[[str], None]],
+        prazo: Optional[Prazo],
+        estimados: int,
+    ):
+        """
+        Versão síncrona de _achamar_coberto(), com os pedidos em threads.
+        Devolve (resposta, ttft, latência, cobertura enviada, cobertura venceu).
+
+        Um pedido síncrono não se pode cancelar: o que perde deixa de entregar
+        pedaços (em streaming é interrompido no pedaço seguinte) e, sem
+        streaming, acaba em segundo plano (no máximo até ao timeout do prazo).
+        """
+        timeout = None if prazo is None else prazo.verificar(self.etapa)
+        limiar = obter_percentis().limiar_cobertura(self.etapa)
+        if limiar is None:
+            response, ttft, latencia = self._chamar(mensagens, ao_pedaco, timeout)
+            return response, ttft, latencia, False, False
+
+        t0 = time.perf_counter()
+        guardados = _PedacosGuardados(ao_pedaco) if ao_pedaco is not None else None
+        executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix=f"llm-{self.etapa}")
+        pedidos = {
+            executor.submit(self._chamar, mensagens, guardados and guardados.ao_pedaco, timeout)
+        }
+        tentou_cobertura = False
+        cobertura = None
+        t_cobertura = 0.0
+        try:
+            while True:
+                decorrido = time.perf_counter() - t0
+                if not tentou_cobertura and decorrido >= limiar:
+                    tentou_cobertura = True
+                    if self.limitador.tentar_adquirir(estimados):
+                        print(
+                            f"[cobertura] {self.etapa}: sem resposta após {decorrido:.1f} s "
+                            f"(p{config.PERCENTIL_COBERTURA}); pedido duplicado"
+                        )
+                        t_cobertura = decorrido
+                        restante = None if prazo is None else prazo.verificar(self.etapa)
+                        cobertura = executor.submit(self._chamar, mensagens, None, restante)
+                        pedidos.add(cobertura)
+
+                esperas = []
+                if prazo is not None:
+                    esperas.append(prazo.verificar(self.etapa))
+                if not tentou_cobertura:
+                    esperas.append(limiar - decorrido)
+                feitos, _ = wait(
+                    pedidos,
+                    timeout=min(esperas) if esperas else None,
+                    return_when=FIRST_COMPLETED,
+                )
+                for pedido in feitos:
+                    pedidos.discard(pedido)
+                    # um pedido que falhe só conta se não houver outro em curso
+                    if pedido.exception() is not None and pedidos:
+                        continue
+                    response, ttft, _ = pedido.result()
+                    venceu = pedido is cobertura
+                    if venceu:
+                        ttft += t_cobertura
+                    return response, ttft, time.perf_counter() - t0, cobertura is not None, venceu
+        finally:
+            # o pedido que perdeu (ou os dois, se o prazo acabou) deixa de ser lido
+            if guardados is not None:
+                guardados.fechar()
+            executor.shutdown(wait=False)
+
+    async def _achamar_coberto(
+        self,
+        mensagens: List[Any],
+        ao_pedaco: Optional[Callable[[str], None]],
+        prazo: Optional[Prazo],
+        estimados: int,
+    ):
+        """
+        _achamar() com prazo e pedido de cobertura. Devolve (resposta, ttft,
+        latência, cobertura enviada, cobertura venceu); ttft e latência contam
+        desde o primeiro pedido.
+
+        O pedido de cobertura não recebe ao_pedaco: se vencer, o parser volta
+        a ler o texto completo (ParserJSONIncremental.concluir).
+        """
+        t0 = time.perf_counter()
+        limiar = obter_percentis().limiar_cobertura(self.etapa)
+        tentou_cobertura = limiar is None
+        cobertura = None
+        t_cobertura = 0.0
+        tarefas = {asyncio.ensure_future(self._achamar(mensagens, ao_pedaco))}
+        try:
+            while True:
+                decorrido = time.perf_counter() - t0
+                if not tentou_cobertura and decorrido >= limiar:
+                    tentou_cobertura = True
+                    if self.limitador.tentar_adquirir(estimados):
+                        print(
+                            f"[cobertura] {self.etapa}: sem resposta após {decorrido:.1f} s "
+                            f"(p{config.PERCENTIL_COBERTURA}); pedido duplicado"
+                        )
+                        t_cobertura = decorrido
+                        cobertura = asyncio.ensure_future(self._achamar(mensagens, None))
+                        tarefas.add(cobertura)
+
+                esperas = []
+                if prazo is not None:
+                    esperas.append(prazo.verificar(self.etapa))
+                if not tentou_cobertura:
+                    esperas.append(limiar - decorrido)
+                feitas, _ = await asyncio.wait(
+                    tarefas,
+                    timeout=min(esperas) if esperas else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for tarefa in feitas:
+                    tarefas.discard(tarefa)
+                    # um pedido que falhe só conta se não houver outro em curso
+                    if tarefa.exception() is not None and tarefas:
+                        continue
+                    response, ttft, _ = tarefa.result()
+                    venceu = tarefa is cobertura
+                    if venceu:
+                        ttft += t_cobertura
+                    return response, ttft, time.perf_counter() - t0, cobertura is not None, venceu
+        finally:
+            # o pedido que perdeu (ou os dois, se o prazo acabou) é cancelado
+            for tarefa in tarefas:
+                tarefa.cancel()
+            if tarefas:
+                await asyncio.gather(*tarefas, return_exceptions=True)
+
+    def invocar(
+        self,
+        mensagens: List[Any],
+        parser: Optional[Callable] = None,
+        ao_pedaco: Optional[Callable[[str], None]] = None,
+        prazo: Optional[Prazo] = None,
+    ) -> RespostaLLM:
+        """
+        No modo síncrono o prazo passa a timeout do pedido HTTP e o pedido de
+        cobertura corre numa thread (ver _chamar_coberto).
+        """
+        with span("llm", etapa=self.etapa) as s:
+            resposta = self._invocar(mensagens, parser, ao_pedaco, prazo)
+            s.definir(**_atributos_span(resposta))
+        return resposta
+
+    async def ainvocar(
+        self,
+        mensagens: List[Any],
+        parser: Optional[Callable] = None,
+        ao_pedaco: Optional[Callable[[str], None]] = None,
+        prazo: Optional[Prazo] = None,
+    ) -> RespostaLLM:
+        with span("llm", etapa=self.etapa) as s:
+            resposta = await self._ainvocar(mensagens, parser, ao_pedaco, prazo)
+            s.definir(**_atributos_span(resposta))
+        return resposta
+
+    def _invocar(self, mensagens, parser, ao_pedaco, prazo) -> RespostaLLM:
+        chave, em_cache = self._consultar_cache(mensagens, parser)
+        if em_cache is not None:
+            return em_cache
+
+        estimados = self._estimar(mensagens)
+        espera = 0.0
+        for tentativa in range(1, self.max_tentativas + 1):
+            with span("limitador", tokens_estimados=estimados):
+                espera_agora = self.limitador.adquirir(estimados)
+            espera += espera_agora
+            if prazo is not None:
+                prazo.adiar(espera_agora)
+            try:
+                with span("pedido", tentativa=tentativa):
+                    response, ttft, latencia, cobertura, venceu = self._chamar_coberto(
+                        mensagens, ao_pedaco, prazo, estimados
+                    )
+            except PrazoExcedido:
+                raise
+            except Exception as exc:
+                if prazo is not None and prazo.restante() <= 0:
+                    raise PrazoExcedido(
+                        f"prazo de {prazo.segundos:.0f} s do caso excedido na etapa {self.etapa}"
+                    ) from exc
+                if not _e_limite_taxa(exc) or tentativa == self.max_tentativas:
+                    raise
+                ra = _retry_after(exc)
+                print(f"[limitador] 429 recebido; nova tentativa após {ra or 'backoff'} s")
+                self.limitador.registar_limite_excedido(ra)
+                continue
+            self._registar_uso(estimados, response)
+            obter_percentis().registar(self.etapa, latencia)
+            return self._concluir(
+                chave,
+                response.content,
+                parser,
+                tentativa,
+                espera,
+                response,
+                ttft,
+                latencia,
+                cobertura,
+                venceu,
+            )
+        raise RuntimeError("número máximo de tentativas excedido")
+
+    async def _ainvocar(self, mensagens, parser, ao_pedaco, prazo) -> RespostaLLM:
+        chave, em_cache = self._consultar_cache(mensagens, parser)
+        if em_cache is not None:
+            return em_cache
+
+        estimados = self._estimar(mensagens)
+        espera = 0.0
+        for tentativa in range(1, self.max_tentativas + 1):
+            with span("limitador", tokens_estimados=estimados):
+                espera_agora = await self.limitador.aadquirir(estimados)
+            espera += espera_agora
+            if prazo is not None:
+                prazo.adiar(espera_agora)
+            try:
+                with span("pedido", tentativa=tentativa):
+                    response, ttft, latencia, cobertura, venceu = await self._achamar_coberto(
+                        mensagens, ao_pedaco, prazo, estimados
+                    )
+            except PrazoExcedido:
+                raise
+            except Exception as exc:
+                if not _e_limite_taxa(exc) or tentativa == self.max_tentativas:
+                    raise
+                ra = _retry_after(exc)
+                print(f"[limitador] 429 recebido; nova tentativa após {ra or 'backoff'} s")
+                self.limitador.registar_limite_excedido(ra)
+                continue
+            self._registar_uso(estimados, response)
+            obter_percentis().registar(self.etapa, latencia)
+            return self._concluir(
+                chave,
+                response.content,
+                parser,
+                tentativa,
+                espera,
+                response,
+                ttft,
+                latencia,
+                cobertura,
+                venceu,
+            )
+        raise RuntimeError("número máximo de tentativas excedido")
@@ -0,0 +1,125 @@
+# cobertura.py
+#
+# Prazo por caso e pedidos de cobertura ("hedged requests") para cortar a
+# cauda da latência das chamadas ao LLM.
+#
+#   - Prazo: cada caso recebe config.PRAZO_CASO_S segundos, passados a todas
+#     as chamadas ao modelo desse caso (grafo e médicos). O tempo à espera no
+#     limitador de taxa não conta: é o próprio programa a travar, não o
+#     modelo a demorar. Quando o prazo acaba, a chamada em curso é cancelada
+#     e sai PrazoExcedido; o caso fica fora do histórico e é repetido numa
+#     próxima execução (RETOMAR_EXECUCAO).
+#   - Percentis: a latência de cada chamada bem-sucedida é registada por
+#     etapa ("grafo", "medico_A", ...) numa janela deslizante, por isso o
+#     limiar acompanha o ritmo real da API ao longo da execução.
+#   - Cobertura: se uma chamada passar o percentil config.PERCENTIL_COBERTURA
+#     da sua etapa, é enviado um segundo pedido igual (só se o limitador
+#     tiver orçamento livre nesse instante). Fica a primeira resposta; a
+#     outra é cancelada (modo assíncrono) ou abandonada (ciclo em série, com
+#     os pedidos em threads). Ver ClienteLLM.ainvocar e ClienteLLM.invocar.
+
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+import threading
+import time
+
+import numpy as np
+
+import config
+
+
+class PrazoExcedido(TimeoutError):
+    """O prazo do caso acabou antes de a chamada ao LLM terminar."""
+
+
+class Prazo:
+    """Instante limite (time.monotonic) de um caso."""
+
+    def __init__(self, segundos: float):
+        self.segundos = float(segundos)
+        self.fim = time.monotonic() + self.segundos
+
+    def adiar(self, segundos: float):
+        """Descontar tempo que não conta para o prazo (espera no limitador)."""
+        # médicos em paralelo à espera ao mesmo tempo adiam os dois: o prazo
+        # fica um pouco mais folgado, nunca mais apertado
+        if segundos > 0:
+            self.fim += segundos
+
+    def restante(self) -> float:
+        return self.fim - time.monotonic()
+
+    def verificar(self, etapa: str) -> float:
+        """Segundos que faltam; PrazoExcedido se já não houver."""
+        restante = self.restante()
+        if restante <= 0:
+            raise PrazoExcedido(f"prazo de {self.segundos:.0f} s do caso excedido na etapa {etapa}")
+        return restante
+
+
+def prazo_caso() -> Optional[Prazo]:
+    """Prazo para um caso novo, ou None se config.PRAZO_CASO_S não estiver definido."""
+    if not config.PRAZO_CASO_S:
+        return None
+    return Prazo(config.PRAZO_CASO_S)
+
+
+class PercentisLatencia:
+    """Latências recentes por etapa (janela deslizante), seguro entre threads."""
+
+    def __init__(self, janela: Optional[int] = None, min_amostras: Optional[int] = None):
+        self.janela = janela or config.JANELA_LATENCIAS
+        self.min_amostras = min_amostras or config.MIN_AMOSTRAS_COBERTURA
+        self._amostras: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def registar(self, etapa: str, segundos: float):
+        with self._lock:
+            if etapa not in self._amostras:
+                self._amostras[etapa] = deque(maxlen=self.janela)
+            self._amostras[etapa].append(float(segundos))
+
+    def percentil(self, etapa: str, q: float) -> Optional[float]:
+        """Percentil q (0-100) da etapa; None enquanto houver poucas amostras."""
+        with self._lock:
+            amostras = list(self._amostras.get(etapa, ()))
+        if len(amostras) < self.min_amostras:
+            return None
+        return float(np.percentile(amostras, q))
+
+    def limiar_cobertura(self, etapa: str) -> Optional[float]:
+        """Segundos a partir dos quais uma chamada desta etapa leva cobertura."""
+        if not config.COBERTURA_ATIVA:
+            return None
+        return self.percentil(etapa, config.PERCENTIL_COBERTURA)
+
+    def resumo(self) -> Dict[str, Tuple[int, float, float, float]]:
+        """etapa -> (nº de amostras, p50, p95, p99)."""
+        with self._lock:
+            copia = {e: list(a) for e, a in self._amostras.items()}
+        return {
+            etapa: (len(a), *(float(p) for p in np.percentile(a, [50, 95, 99])))
+            for etapa, a in copia.items()
+            if a
+        }
+
+    def imprimir(self):
+        resumo = self.resumo()
+        if not resumo:
+            return
+        print("Latência por etapa (últimas chamadas):")
+        for etapa, (n, p50, p95, p99) in sorted(resumo.items()):
+            print(f"  {etapa:10s} n={n:4d}  p50={p50:6.2f} s  p95={p95:6.2f} s  p99={p99:6.2f} s")
+
+
+_percentis_global: Optional[PercentisLatencia] = None
+_lock_global = threading.Lock()
+
+
+def obter_percentis() -> PercentisLatencia:
+    """Devolve os percentis de latência únicos do processo."""
+    global _percentis_global
+    with _lock_global:
+        if _percentis_global is None:
+            _percentis_global = PercentisLatencia()
+        return _percentis_global
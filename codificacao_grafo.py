@@ -0,0 +1,129 @@
+# codificacao_grafo.py
+#
+# Codificações do grafo de conhecimento enviado aos médicos.
+#
+# O grafo é enviado em cada pedido aos dois médicos, por isso o seu tamanho
+# em tokens conta duas vezes por caso. Além do JSON original há formatos
+# mais curtos:
+#
+#   "json"          - json.dumps do grafo, como sai do LLM (formato original)
+#   "json_compacto" - o mesmo JSON sem espaços
+#   "triplos"       - nós "id tipo label" com ids curtos (0, 1, ...) e códigos
+#                     de tipo de 2 letras, e arestas "origem relação destino"
+#   "por_relacao"   - nós como em "triplos" e arestas agrupadas por relação
+#                     ("has_symptom: 0>1 0>2")
+#
+# Com podar=True, os nós que não estão ligados ao nó "patient" são retirados
+# (se o grafo não tiver doente, fica inteiro).
+#
+# O formato é explicado uma única vez, no prompt de sistema (explicacao()).
+# analise/medir_tokens_grafos.py mede o custo de cada codificação.
+
+from typing import Any, Dict, List
+import json
+
+from grafo_clinico import GrafoClinico, TipoNo
+
+
+CODIFICACOES = ("json", "json_compacto", "triplos", "por_relacao")
+
+CODIGOS_TIPO = {
+    TipoNo.PATIENT: "PT",
+    TipoNo.DEMOGRAPHIC: "DM",
+    TipoNo.SYMPTOM: "SY",
+    TipoNo.SIGN: "SG",
+    TipoNo.RISK_FACTOR: "RF",
+    TipoNo.HABIT: "HB",
+    TipoNo.COMORBIDITY: "CM",
+    TipoNo.TEST: "TS",
+    TipoNo.TREATMENT: "TX",
+    TipoNo.INTERMEDIATE_HYPOTHESIS: "HY",
+    TipoNo.DIAGNOSIS: "DX",
+    TipoNo.OTHER: "OT",
+}
+
+_LEGENDA_TIPOS = ", ".join(f"{c}={t.name.lower()}" for t, c in CODIGOS_TIPO.items())
+
+_EXPLICACAO_NOS = f"""
+GRAPH ENCODING
+The knowledge graph is NOT given as JSON but in a compact text encoding.
+Section "NODES" has one node per line: "<id> <type code> <label>", where <id> is
+a short integer and the type codes are: {_LEGENDA_TIPOS}.
+"""
+
+_EXPLICACOES = {
+    "triplos": _EXPLICACAO_NOS + """Section "EDGES" has one edge per line: "<source id> <relation> <target id>".
+""",
+    "por_relacao": _EXPLICACAO_NOS + """Section "EDGES" has one line per relation: "<relation>: <source>><target> <source>><target> ...".
+""",
+}
+
+
+def explicacao(codificacao: str) -> str:
+    """Texto a acrescentar (uma vez) ao prompt de sistema; vazio para os formatos JSON."""
+    return _EXPLICACOES.get(codificacao, "")
+
+
+def podar_grafo(grafo: GrafoClinico) -> GrafoClinico:
+    """Subgrafo com os nós ligados (sem direção) a algum nó "patient"."""
+    doentes = grafo.nos_do_tipo(TipoNo.PATIENT)
+    if len(doentes) == 0:
+        return grafo
+    mascara = grafo.alcancaveis(doentes)
+    if mascara.all():
+        return grafo
+    completo = grafo.para_json()
+    manter = {grafo.ids[i] for i in range(grafo.num_nos) if mascara[i]}
+    return GrafoClinico.de_json(
+        {
+            "nodes": [n for n in completo["nodes"] if n["id"] in manter],
+            "edges": [
+                e for e in completo["edges"]
+                if e.get("source") in manter and e.get("target") in manter
+            ],
+        }
+    )
+
+
+def _linhas_nos(grafo: GrafoClinico) -> List[str]:
+    linhas = ["NODES"]
+    for i in range(grafo.num_nos):
+        label = grafo.labels[i] if grafo.labels[i] is not None else grafo.ids[i]
+        label = " ".join(str(label).split())  # sem quebras de linha dentro do label
+        linhas.append(f"{i} {CODIGOS_TIPO[TipoNo(int(grafo.tipos[i]))]} {label}")
+    return linhas
+
+
+def _triplos(grafo: GrafoClinico) -> str:
+    linhas = _linhas_nos(grafo) + ["EDGES"]
+    for s, t, r in zip(grafo.origem.tolist(), grafo.destino.tolist(), grafo.relacao.tolist()):
+        linhas.append(f"{s} {grafo.relacoes[r] or 'related'} {t}")
+    return "\n".join(linhas)
+
+
+def _por_relacao(grafo: GrafoClinico) -> str:
+    linhas = _linhas_nos(grafo) + ["EDGES"]
+    for codigo, nome in enumerate(grafo.relacoes):
+        sel = grafo.relacao == codigo
+        pares = " ".join(f"{s}>{t}" for s, t in zip(grafo.origem[sel].tolist(), grafo.destino[sel].tolist()))
+        linhas.append(f"{nome or 'related'}: {pares}")
+    return "\n".join(linhas)
+
+
+def codificar_grafo(grafo_json: Dict[str, Any], codificacao: str = "json", podar: bool = False) -> str:
+    if codificacao not in CODIFICACOES:
+        raise ValueError(f"codificação desconhecida: {codificacao}")
+    if codificacao == "json" and not podar:
+        return json.dumps(grafo_json, ensure_ascii=False)
+
+    grafo = GrafoClinico.de_json(grafo_json)
+    if podar:
+        grafo = podar_grafo(grafo)
+
+    if codificacao == "json":
+        return json.dumps(grafo.para_json(), ensure_ascii=False)
+    if codificacao == "json_compacto":
+        return json.dumps(grafo.para_json(), ensure_ascii=False, separators=(",", ":"))
+    if codificacao == "triplos":
+        return _triplos(grafo)
+    return _por_relacao(grafo)
@@ -20,5 +20,181 @@ MODEL_NAME = "gpt-4o-mini"
 NUM_ITERACOES = 15
 NUM_CASOS = 20
 
+# Carregamento das notas (dados_mimic.py). Com streaming o CSV é lido por blocos
+# (memória independente do tamanho do ficheiro). Nota: a amostragem por
+# reservatório escolhe casos diferentes de DataFrame.sample(random_state=42).
+# Ordem das fontes em carregar_casos_mimic: streaming > tabela colunar >
+# armazém > CSV com pandas (ligar o streaming ignora as duas seguintes).
+CARREGAMENTO_STREAMING = False
+MODO_AMOSTRAGEM = "amostra"  # "amostra" (reservatório) ou "primeiros" (primeiros N)
+TAMANHO_CHUNK_NOTAS = 5000
+
+# Armazém binário de notas (armazem_notas.py, gerado pelo preprocess_mimic.py):
+# notas.bin + índice com offsets; os casos carregam o texto só quando é usado.
+CAMINHO_ARMAZEM_NOTAS = os.path.join(DATA_DIR, "NOTEEVENTS_filtred_notas")
+USAR_ARMAZEM_NOTAS = True  # usado apenas se o armazém existir
+
+# Tabela colunar da junção notas + rótulos (dados_mimic.materializar_tabela_casos),
+# em arrays NumPy lidos com mmap. Só é reconstruída quando o mtime/tamanho dos
+# CSV de origem muda (com TABELA_CASOS_COM_HASH também se compara o SHA-256).
+# Tal como o armazém, devolve os mesmos casos (amostra com random_state=42) e o
+# mesmo texto de HADM_ID ("174105.0") que a leitura com pandas.
+USAR_TABELA_COLUNAR = True
+DIR_TABELA_CASOS = os.path.join(OUTPUT_DIR, "tabela_casos")
+TABELA_CASOS_COM_HASH = False
+
+# Escolha do próximo caso no ciclo em série (main.py; o modo assíncrono
+# segue sempre a ordem dos casos):
+#   "ordem"        - pela ordem dos casos carregados (original)
+#   "aleatoria"    - ao acaso entre os casos por usar
+#   "discordancia" - active learning (active_learning.SeletorDiscordancia): a
+#                    nota por usar mais parecida (TF-IDF de palavras e bigramas)
+#                    com a de um caso anterior com discordância entre os médicos
+#                    >= LIMIAR_DISCORDANCIA; ao acaso enquanto não houver nenhum.
+#                    Os casos já no histórico contam logo como anteriores.
+ESTRATEGIA_SELECAO = "ordem"
+LIMIAR_DISCORDANCIA = 0.3
+
+# Formato do grafo nos prompts dos médicos (codificacao_grafo.py):
+# "json" (original), "json_compacto", "triplos" ou "por_relacao"; PODAR_GRAFO
+# retira os nós não ligados ao doente. Ver analise/medir_tokens_grafos.py.
+CODIFICACAO_GRAFO = "json"
+PODAR_GRAFO = False
+
+# Disposição do prompt dos médicos (medicos.py):
+#   "original" - perfil (conservador/explorador) no fim do prompt de sistema
+#   "prefixo"  - prompt base + nota + grafo primeiro, perfil no fim: os dois
+#                médicos partilham o prefixo e a API serve-o da cache de prompts
+#                (colunas medico_*_tokens_cache do histórico)
+# A disposição entra na versão dos prompts (etapas.versao_prompts).
+LAYOUT_PROMPT_MEDICOS = "original"
+
+# Pedidos aos médicos (etapas.py):
+#   "separado" - um pedido por médico (modo original)
+#   "painel"   - um só pedido devolve os diagnósticos de todos os perfis
+#                (medicos.PainelMedicosLLM), com temperatura TEMPERATURA_PAINEL
+# O modo fica na coluna modo_medicos do histórico; como muda a versão dos
+# prompts, correr os dois modos repete os mesmos casos (comparação na
+# secção 3b de analise/metricas_graficos.py).
+MODO_MEDICOS = "separado"
+TEMPERATURA_PAINEL = 0.0
+
+# Construção do grafo (grafo_fundido.py):
+#   "separado" - pedido do grafo seguido dos pedidos dos médicos (modo original)
+#   "fundido"  - experimental: um só pedido devolve o grafo e os diagnósticos do
+#                médico MEDICO_FUNDIDO; os outros médicos recebem esse grafo.
+#                Não se combina com MODO_MEDICOS = "painel" nem com lote.py.
+MODO_GRAFO = "separado"
+MEDICO_FUNDIDO = "A"
+
+# HTML dos grafos (grafo_conhecimento.py). O JSON de cada grafo é sempre
+# gravado em output/grafos/json/ e pode ser visto em visualizador_grafos.html.
+#   "sincrono" - HTML pyvis escrito dentro de construir() (conta no tempo_grafo)
+#   "fundo"    - HTML escrito por uma thread em segundo plano
+#   "diferido" - sem HTML; gerar a pedido com python grafo_conhecimento.py --todos
+MODO_HTML = "fundo"
+
+# Histórico (historico.py): as linhas são gravadas em lotes (por nº de linhas
+# ou por tempo). Com RETOMAR_EXECUCAO, os casos já presentes no histórico com
+# a mesma versão dos prompts são saltados. VERSAO_PROMPT = None usa um hash
+# automático dos prompts, modelos e temperaturas.
+HISTORICO_MAX_LINHAS_BUFFER = 5
+HISTORICO_MAX_SEGUNDOS_BUFFER = 30.0
+RETOMAR_EXECUCAO = True
+VERSAO_PROMPT = None
+
+# Avaliação dos diagnósticos (avaliacao.py):
+#   "texto"     - semelhança de strings com o LONG_TITLE (SequenceMatcher, limiar 0.6)
+#   "codigo"    - cada previsão é resolvida para os TOP_K_ICD códigos ICD-9 mais
+#                 parecidos (indice_icd.py) e comparada com o código verdadeiro
+#   "categoria" - como "codigo", mas basta acertar a categoria de 3 dígitos
+# "codigo" e "categoria" contam acertos que "texto" não conta (as taxas de acerto
+# e a reputação não são comparáveis com as do critério original). O critério
+# fica na coluna criterio_avaliacao do histórico e entra na versão dos prompts.
+CRITERIO_AVALIACAO = "texto"
+TOP_K_ICD = 3
+LIMIAR_SIMILARIDADE_ICD = 0.4
+
+# Armazenamento da reputação (reputacao.py):
+#   "json"   - reputacao.json reescrito a cada atualização (um só processo)
+#   "sqlite" - log de eventos em SQLite (WAL) com commits em lote e compactação
+#              periódica num snapshot; pode ser partilhado por vários processos
+MODO_REPUTACAO = "sqlite"
+CAMINHO_REPUTACAO_DB = os.path.join(OUTPUT_DIR, "reputacao.sqlite")
+REPUTACAO_EVENTOS_POR_COMMIT = 10
+REPUTACAO_COMPACTAR_CADA = 500
+
+# Métricas por chamada ao LLM (tokens, latência, tentativas) gravadas no
+# histórico. Com MEDIR_TTFT os pedidos são feitos em streaming para medir o
+# tempo até ao primeiro token (a resposta final é a mesma).
+MEDIR_TTFT = False
+
+# Respostas JSON lidas à medida que chegam (json_incremental.py): diagnósticos,
+# nós e arestas ficam disponíveis quando cada objeto fecha, e uma resposta
+# truncada é reparada a partir do que chegou em vez de fazer cair a execução.
+STREAMING_JSON = True
+
+# Modo assíncrono (pipeline_async.py): grafo do caso i+1 em paralelo com os
+# médicos do caso i. O ritmo real é limitado por LIMITE_RPM / LIMITE_TPM.
+MODO_ASSINCRONO = False
+MAX_CASOS_EM_VOO = 2
+TAMANHO_FILAS_PIPELINE = 2
+
+# Cauda da latência (cobertura.py). Cada caso tem PRAZO_CASO_S segundos para
+# as chamadas ao LLM (sem contar a espera no limitador; None = sem prazo); um
+# caso que passe o prazo não entra no histórico e é repetido ao retomar.
+# Com COBERTURA_ATIVA, uma chamada que passe o percentil PERCENTIL_COBERTURA
+# da latência da sua etapa (calculado sobre as últimas JANELA_LATENCIAS
+# chamadas, a partir de MIN_AMOSTRAS_COBERTURA) leva um pedido duplicado se o
+# limitador tiver orçamento livre; fica a primeira resposta. No modo
+# assíncrono a outra é cancelada; no ciclo em série (threads) deixa de ser
+# lida e, sem streaming, acaba em segundo plano.
+PRAZO_CASO_S = 120.0
+COBERTURA_ATIVA = True
+PERCENTIL_COBERTURA = 95
+JANELA_LATENCIAS = 200
+MIN_AMOSTRAS_COBERTURA = 10
+
+# Modelo falso (llm_falso.py) no lugar do ChatOpenAI: respostas JSON
+# determinísticas derivadas da nota, sem chave nem rede (testes e
+# analise/benchmark_pipeline.py). Latência de cada pedido: lognormal com
+# LLM_FALSO_MEDIANA_S e LLM_FALSO_SIGMA até ao primeiro token, mais
+# LLM_FALSO_S_POR_TOKEN por token de resposta. PROB_429 e PROB_JSON_INVALIDO
+# simulam limites de taxa e respostas malformadas.
+LLM_FALSO = False
+LLM_FALSO_MEDIANA_S = 1.5
+LLM_FALSO_SIGMA = 0.4
+LLM_FALSO_S_POR_TOKEN = 0.01
+LLM_FALSO_PROB_429 = 0.0
+LLM_FALSO_PROB_JSON_INVALIDO = 0.0
+LLM_FALSO_SEMENTE = 0
+
+# Rastreio por caso e etapa (rastreio.py): spans encaixados (caso, grafo,
+# médicos, pedido ao LLM, parser, componentes, HTML, avaliação, reputação,
+# histórico) com atributos como o comprimento da nota, nós/arestas e tokens.
+# Gravados em CAMINHO_RASTREIO no formato Chrome trace (abre em
+# https://ui.perfetto.dev); `python rastreio.py` resume o tempo por span.
+# Desligado, cada span custa apenas a verificação desta flag.
+RASTREIO_ATIVO = False
+CAMINHO_RASTREIO = os.path.join(OUTPUT_DIR, "rastreio.json")
+
+# Limites da conta OpenAI (limitador.py). Todas as chamadas ao modelo passam
+# por um limitador único que respeita pedidos/minuto e tokens/minuto; em caso
+# de 429 respeita o Retry-After e reduz temporariamente o ritmo.
+LIMITE_RPM = 3
+LIMITE_TPM = 40000
+TOKENS_RESPOSTA_ESTIMADOS = 800  # estimativa de tokens de saída por pedido
+MAX_TENTATIVAS_LLM = 5
+
+# Cache em disco das respostas do modelo (cache_llm.py), endereçada por hash
+# de (modelo, temperatura, prompt de sistema, mensagem do utilizador).
+CACHE_LLM_ATIVA = True
+DIR_CACHE_LLM = os.path.join(OUTPUT_DIR, "cache_llm")
+CACHE_LLM_MAX_ENTRADAS = 5000
+CACHE_LLM_MAX_MB = 200
+CACHE_LLM_MAX_DIAS = 30  # idade desde a criação da entrada (os hits não a renovam)
+# o médico explorador (temperature=0.4) não é determinístico: por omissão não usa cache
+CACHE_MEDICO_EXPLORADOR = False
+
 #tem de ter uma chave open ai valida e enviar:
 #$env:OPENAI_API_KEY = "chave_aqui"
@@ -1,10 +1,18 @@
 # dados_mimic.py
 
-from typing import List, Dict, Optional
+from typing import List, Dict, Any, Optional, Iterator, Mapping
+import hashlib
+import json
 import os
 
+import numpy as np
 import pandas as pd
 import config
+from armazem_notas import ArmazemNotas, existe_armazem, gravar_armazem_notas
+
+
+# colunas das notas realmente usadas pelo pipeline
+COLUNAS_NOTAS = ["SUBJECT_ID", "HADM_ID", "NOTE_TEXT"]
 
 
 def _carregar_rotulos_automaticos(
@@ -45,13 +53,343 @@ def _carregar_rotulos_automaticos(
 
     df_prim.rename(columns={"LONG_TITLE": "DIAGNOSTICO_VERDADEIRO"}, inplace=True)
 
-    return df_prim[["HADM_ID", "DIAGNOSTICO_VERDADEIRO"]]
+    return df_prim[["HADM_ID", "ICD9_CODE", "DIAGNOSTICO_VERDADEIRO"]]
+
+
+def _mapa_rotulos() -> Dict[str, str]:
+    """HADM_ID normalizado -> DIAGNOSTICO_VERDADEIRO (dicionário para lookups por chunk)."""
+    df_rot = _carregar_rotulos_automaticos(
+        config.CAMINHO_DIAGNOSES_ICD,
+        config.CAMINHO_D_ICD_DIAGNOSES,
+    )
+    if df_rot is None:
+        return {}
+    return dict(zip(df_rot["HADM_ID"].astype(str), df_rot["DIAGNOSTICO_VERDADEIRO"]))
+
+
+def _normalizar_hadm(serie: pd.Series) -> pd.Series:
+    """Versão vetorizada de "174105.0" -> "174105" (inválidos ficam "<NA>")."""
+    return pd.to_numeric(serie, errors="coerce").astype("Int64").astype(str)
+
+
+def _casos_do_chunk(df: pd.DataFrame, row_ids, mapa_rot: Dict[str, str]) -> Iterator[Dict]:
+    """Junta os rótulos a um bloco de notas e produz os dicionários de caso."""
+    rotulos = _normalizar_hadm(df["HADM_ID"]).map(mapa_rot)
+    for row_id, subject_id, hadm_id, nota, diag in zip(
+        row_ids,
+        df["SUBJECT_ID"],
+        df["HADM_ID"],
+        df["NOTE_TEXT"],
+        rotulos,
+    ):
+        yield {
+            "id": int(row_id),
+            "subject_id": subject_id,
+            "hadm_id": hadm_id,
+            "descricao": nota,
+            "diagnostico_verdadeiro": diag,
+        }
+
+
+def iterar_casos_mimic(
+    path: str = None,
+    n_max: Optional[int] = None,
+    modo: str = "amostra",
+    seed: int = 42,
+    chunksize: int = 5000,
+) -> Iterator[Dict]:
+    """
+    Versão em streaming de carregar_casos_mimic: lê só as colunas necessárias,
+    por blocos de `chunksize` linhas, e devolve os casos num gerador. A
+    memória máxima depende do tamanho do bloco e de n_max, não do ficheiro.
+
+    - modo="primeiros": os primeiros n_max casos do ficheiro, sem ler além
+      da linha n_max; os rótulos são juntos bloco a bloco.
+    - modo="amostra": amostragem por reservatório (algoritmo R) numa única
+      passagem, com semente fixa; os casos só saem no fim da passagem,
+      pela ordem em que aparecem no ficheiro.
+
+    Sem n_max, devolve todas as notas (bloco a bloco).
+    """
+    if path is None:
+        path = config.CAMINHO_CASOS
+    if modo not in ("amostra", "primeiros"):
+        raise ValueError(f"modo desconhecido: {modo}")
+
+    mapa_rot = _mapa_rotulos()
+
+    leitor = pd.read_csv(
+        path,
+        dtype=str,
+        usecols=COLUNAS_NOTAS,
+        chunksize=chunksize,
+        nrows=n_max if modo == "primeiros" else None,
+    )
+
+    if n_max is None or modo == "primeiros":
+        vistos = 0
+        for chunk in leitor:
+            yield from _casos_do_chunk(chunk, range(vistos, vistos + len(chunk)), mapa_rot)
+            vistos += len(chunk)
+        return
+
+    # ----------------- amostragem por reservatório -----------------
+    k = int(n_max)
+    if k <= 0:
+        return
+    rng = np.random.default_rng(seed)
+    res_ids = np.full(k, -1, dtype=np.int64)
+    res_linhas: List[Optional[tuple]] = [None] * k
+    vistos = 0
+
+    for chunk in leitor:
+        n = len(chunk)
+        cols = (chunk["SUBJECT_ID"].to_numpy(), chunk["HADM_ID"].to_numpy(), chunk["NOTE_TEXT"].to_numpy())
+
+        # 1) encher o reservatório com as primeiras k linhas
+        inicio = 0
+        if vistos < k:
+            inicio = min(n, k - vistos)
+            for pos in range(inicio):
+                res_ids[vistos + pos] = vistos + pos
+                res_linhas[vistos + pos] = (cols[0][pos], cols[1][pos], cols[2][pos])
+
+        # 2) cada linha i >= k substitui a posição j ~ U[0, i] se j < k
+        if inicio < n:
+            i_glob = np.arange(vistos + inicio, vistos + n)
+            j = rng.integers(0, i_glob + 1)
+            for pos in np.nonzero(j < k)[0]:
+                slot = j[pos]
+                p = inicio + pos
+                res_ids[slot] = i_glob[pos]
+                res_linhas[slot] = (cols[0][p], cols[1][p], cols[2][p])
+
+        vistos += n
+
+    usados = min(k, vistos)
+    ordem = np.argsort(res_ids[:usados], kind="stable")
+    df_amostra = pd.DataFrame(
+        [res_linhas[i] for i in ordem],
+        columns=COLUNAS_NOTAS,
+    )
+    yield from _casos_do_chunk(df_amostra, res_ids[:usados][ordem], mapa_rot)
+
+
+def _linhas_escolhidas(n: int, n_max: Optional[int], modo: str, seed: int = 42) -> np.ndarray:
+    """
+    Posições das notas a usar. Com modo="amostra" são as mesmas, e pela mesma
+    ordem, que DataFrame.sample(n_max, random_state=seed) sobre o CSV completo
+    (o pandas usa RandomState(seed).choice), por isso o armazém e a tabela
+    colunar escolhem os mesmos casos que o carregamento original.
+    """
+    if n_max is None or n_max >= n:
+        return np.arange(n)
+    if modo == "primeiros":
+        return np.arange(n_max)
+    return np.random.RandomState(seed).choice(n, size=n_max, replace=False)
+
+
+def carregar_casos_armazem(
+    path_base: str = None,
+    n_max: Optional[int] = None,
+    modo: str = "amostra",
+    seed: int = 42,
+) -> List[Mapping]:
+    """
+    Casos "leves" a partir do armazém binário de notas (armazem_notas.py):
+    a escolha dos casos e a junção dos rótulos usam só o índice, e o texto
+    de cada nota só é lido quando o caso é processado.
+    """
+    if path_base is None:
+        path_base = config.CAMINHO_ARMAZEM_NOTAS
+    armazem = ArmazemNotas(path_base)
+
+    posicoes = _linhas_escolhidas(len(armazem), n_max, modo, seed)
+    mapa_rot = _mapa_rotulos()
+    hadm = armazem.indice["hadm_id"][posicoes]
+    return [
+        armazem.caso(pos, mapa_rot.get(str(int(h))) if h >= 0 else None)
+        for pos, h in zip(posicoes, hadm)
+    ]
+
+
+# -------------------------------------------------------------------
+# TABELA DE CASOS EM FORMATO COLUNAR (cache entre execuções)
+# -------------------------------------------------------------------
+#
+# A junção notas + rótulos é materializada uma vez em arrays NumPy (.npy),
+# lidos depois com mmap. Colunas (uma linha por nota):
+#   row_id, subject_id, hadm_id (normalizado, -1 se inválido), len_nota,
+#   codigo (índice no vocabulário de códigos ICD-9 do diagnóstico
+#   principal, -1 se não houver) e pos_nota (posição da nota no armazém
+#   binário, que é o ponteiro para o texto).
+# O vocabulário de códigos e os respetivos LONG_TITLE ficam em meta.json,
+# juntamente com a "impressão digital" dos ficheiros de origem. A tabela
+# só é reconstruída quando essa impressão digital muda.
+
+_VERSAO_TABELA = 2  # 2: armazém com o HADM_ID original
+_COLUNAS_TABELA = ("row_id", "subject_id", "hadm_id", "len_nota", "codigo", "pos_nota")
+
+
+def _hash_ficheiro(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloco in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def _impressao_fontes(fontes: List[str], com_hash: bool) -> Dict[str, Dict[str, Any]]:
+    out = {}
+    for path in fontes:
+        st = os.stat(path)
+        info = {"mtime": st.st_mtime, "tamanho": st.st_size}
+        if com_hash:
+            info["sha256"] = _hash_ficheiro(path)
+        out[os.path.abspath(path)] = info
+    return out
+
+
+def _tabela_atualizada(meta: Dict[str, Any], fontes: List[str]) -> bool:
+    """True se os ficheiros de origem não mudaram desde a materialização."""
+    if meta.get("versao") != _VERSAO_TABELA:
+        return False
+    guardadas = meta.get("fontes", {})
+    atuais = _impressao_fontes(fontes, com_hash=False)
+    if set(guardadas) != set(atuais):
+        return False
+    for path, info in atuais.items():
+        antiga = guardadas[path]
+        if antiga["tamanho"] != info["tamanho"]:
+            return False
+        if antiga["mtime"] != info["mtime"]:
+            # mtime mudou (ex.: cópia do ficheiro): se houver hash, comparar o conteúdo
+            if "sha256" not in antiga or antiga["sha256"] != _hash_ficheiro(path):
+                return False
+    return True
+
+
+def materializar_tabela_casos(
+    path: str = None,
+    diretorio: str = None,
+    com_hash: bool = None,
+    forcar: bool = False,
+) -> str:
+    """
+    Constrói (se necessário) a tabela colunar da junção notas + rótulos em
+    `diretorio`. Devolve o diretório da tabela.
+    """
+    if path is None:
+        path = config.CAMINHO_CASOS
+    if diretorio is None:
+        diretorio = config.DIR_TABELA_CASOS
+    if com_hash is None:
+        com_hash = config.TABELA_CASOS_COM_HASH
+
+    fontes = [p for p in (path, config.CAMINHO_DIAGNOSES_ICD, config.CAMINHO_D_ICD_DIAGNOSES) if os.path.exists(p)]
+    path_meta = os.path.join(diretorio, "meta.json")
+    if not forcar and os.path.exists(path_meta):
+        with open(path_meta, "r", encoding="utf-8") as f:
+            if _tabela_atualizada(json.load(f), fontes):
+                return diretorio
+
+    print(f"A materializar tabela de casos em {diretorio}...")
+    os.makedirs(diretorio, exist_ok=True)
+    if os.path.exists(path_meta):
+        os.remove(path_meta)  # a tabela fica inválida até acabar a reconstrução
+
+    # 1) texto das notas -> armazém binário (lido por blocos)
+    base_armazem = os.path.join(diretorio, "notas")
+    gravar_armazem_notas(path, base_armazem)
+    indice = ArmazemNotas(base_armazem).indice
+
+    # 2) código ICD-9 principal por admissão, codificado como índice num vocabulário
+    df_rot = _carregar_rotulos_automaticos(
+        config.CAMINHO_DIAGNOSES_ICD,
+        config.CAMINHO_D_ICD_DIAGNOSES,
+    )
+    codigo = np.full(len(indice), -1, dtype=np.int32)
+    codigos: List[str] = []
+    rotulos: List[Optional[str]] = []
+    if df_rot is not None:
+        df_rot = df_rot.dropna(subset=["ICD9_CODE"])
+        hadm_rot = pd.to_numeric(df_rot["HADM_ID"], errors="coerce")
+        df_rot = df_rot[hadm_rot.notna()]
+        hadm_rot = hadm_rot[hadm_rot.notna()].astype(np.int64)
+
+        vocab = df_rot[["ICD9_CODE", "DIAGNOSTICO_VERDADEIRO"]].drop_duplicates("ICD9_CODE")
+        codigos = vocab["ICD9_CODE"].tolist()
+        rotulos = [None if pd.isna(r) else r for r in vocab["DIAGNOSTICO_VERDADEIRO"]]
+        idx_codigo = pd.Index(codigos).get_indexer(df_rot["ICD9_CODE"])
+
+        pos = pd.Index(hadm_rot.to_numpy()).get_indexer(np.asarray(indice["hadm_id"]))
+        tem = pos >= 0
+        codigo[tem] = idx_codigo[pos[tem]]
+
+    colunas = {
+        "row_id": np.asarray(indice["row_id"]),
+        "subject_id": np.asarray(indice["subject_id"]),
+        "hadm_id": np.asarray(indice["hadm_id"]),
+        "len_nota": np.asarray(indice["len_nota"]),
+        "codigo": codigo,
+        "pos_nota": np.arange(len(indice), dtype=np.int64),
+    }
+    for nome, arr in colunas.items():
+        np.save(os.path.join(diretorio, f"{nome}.npy"), arr)
+
+    meta = {
+        "versao": _VERSAO_TABELA,
+        "n": int(len(indice)),
+        "fontes": _impressao_fontes(fontes, com_hash),
+        "codigos": codigos,
+        "rotulos": rotulos,
+    }
+    tmp = path_meta + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp, path_meta)
+    return diretorio
+
+
+class TabelaCasos:
+    """Tabela colunar lida com mmap; os casos são construídos só para as linhas usadas."""
+
+    def __init__(self, diretorio: str):
+        with open(os.path.join(diretorio, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.codigos: List[str] = meta["codigos"]
+        self.rotulos: List[Optional[str]] = meta["rotulos"]
+        self.colunas = {
+            nome: np.load(os.path.join(diretorio, f"{nome}.npy"), mmap_mode="r")
+            for nome in _COLUNAS_TABELA
+        }
+        self.armazem = ArmazemNotas(os.path.join(diretorio, "notas"))
+
+    def __len__(self) -> int:
+        return len(self.colunas["row_id"])
+
+    def caso(self, i: int) -> Mapping:
+        c = int(self.colunas["codigo"][i])
+        return self.armazem.caso(
+            int(self.colunas["pos_nota"][i]),
+            self.rotulos[c] if c >= 0 else None,
+            extras={"icd9_verdadeiro": self.codigos[c] if c >= 0 else None},
+        )
+
+    def casos(self, n_max: Optional[int] = None, modo: str = "amostra", seed: int = 42) -> List[Mapping]:
+        return [self.caso(i) for i in _linhas_escolhidas(len(self), n_max, modo, seed)]
+
+
+def carregar_tabela_casos(path: str = None) -> TabelaCasos:
+    """Materializa a tabela se as fontes mudaram e devolve-a (em mmap)."""
+    return TabelaCasos(materializar_tabela_casos(path))
 
 
 def carregar_casos_mimic(
     path: str = None,
     n_max: Optional[int] = None,
-) -> List[Dict]:
+    streaming: Optional[bool] = None,
+) -> List[Mapping]:
     """
     Lê o CSV de notas (NOTEEVENTS_random_separado_filtred.csv) e junta
     automaticamente o diagnóstico principal de cada admissão com base
@@ -63,10 +401,38 @@ def carregar_casos_mimic(
       - hadm_id
       - descricao
       - diagnostico_verdadeiro (LONG_TITLE) ou None se não houver
+
+    A fonte é escolhida por esta ordem:
+      1. streaming=True (ou, sem argumento, config.CARREGAMENTO_STREAMING):
+         iterar_casos_mimic, que não carrega o ficheiro inteiro em memória;
+      2. config.USAR_TABELA_COLUNAR: tabela colunar em cache;
+      3. config.USAR_ARMAZEM_NOTAS, se o armazém existir;
+      4. leitura do CSV inteiro com pandas (modo original).
+    As opções 2 e 3 escolhem os mesmos casos e o mesmo texto de hadm_id que a 4.
     """
     if path is None:
         path = config.CAMINHO_CASOS
 
+    if streaming is None:
+        streaming = config.CARREGAMENTO_STREAMING
+    if streaming:
+        return list(
+            iterar_casos_mimic(
+                path,
+                n_max=n_max,
+                modo=config.MODO_AMOSTRAGEM,
+                chunksize=config.TAMANHO_CHUNK_NOTAS,
+            )
+        )
+
+    # tabela colunar em cache (reconstruída só se os CSV mudarem)
+    if config.USAR_TABELA_COLUNAR and os.path.exists(path):
+        return carregar_tabela_casos(path).casos(n_max=n_max, modo=config.MODO_AMOSTRAGEM)
+
+    # armazém binário gerado pelo preprocess_mimic.py (texto lido só quando preciso)
+    if config.USAR_ARMAZEM_NOTAS and existe_armazem(config.CAMINHO_ARMAZEM_NOTAS):
+        return carregar_casos_armazem(n_max=n_max, modo=config.MODO_AMOSTRAGEM)
+
     df_notes = pd.read_csv(path, dtype=str)
 
     # amostragem opcional
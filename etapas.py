@@ -0,0 +1,353 @@
+# etapas.py
+#
+# Etapas partilhadas entre o ciclo em série (main.py) e o pipeline
+# assíncrono (pipeline_async.py): preparação do histórico, avaliação dos
+# diagnósticos, atualização da reputação e escrita da linha no CSV.
+
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Any, List, Optional
+import os
+import csv
+import hashlib
+import time
+import math  # <-- para testar NaN
+
+from grafo_conhecimento import GrafoResultado
+from grafo_fundido import GrafoFundidoLLM
+from medicos import (
+    MedicoLLM,
+    PainelMedicosLLM,
+    ResultadoMedico,
+    PROMPT_MEDICO_BASE,
+    PERFIL_MEDICO_CONSERVADOR,
+    PERFIL_MEDICO_EXPLORADOR,
+)
+from reputacao import GestorReputacao
+from cobertura import Prazo
+from cliente_llm import CAMPOS_METRICAS, metricas_resposta
+from avaliacao import avaliar_diagnosticos
+from active_learning import calcular_discordancia
+from rastreio import span
+import config
+
+
+CABECALHO_HISTORICO = [
+    "iteracao",
+    "idx",
+    "subject_id",
+    "hadm_id",
+    "len_nota",
+    "diagnostico_verdadeiro",
+    "diag_A",
+    "diag_B",
+    "acertou_A",
+    "acertou_B",
+    "reputacao_A",
+    "reputacao_B",
+    "discordancia",
+    "num_componentes",
+    "tempo_total",
+    "tempo_grafo",
+    "tempo_medicos",
+    "cache_hits",
+    "cache_misses",
+    "versao_prompt",
+]
+
+# métricas de cada chamada ao LLM (cliente_llm.RespostaLLM), uma coluna por
+# etapa e campo: grafo_tokens_prompt, ..., medico_A_latencia, ...
+ETAPAS_LLM = ["grafo", "medico_A", "medico_B"]
+CABECALHO_HISTORICO += [f"{etapa}_{campo}" for etapa in ETAPAS_LLM for campo in CAMPOS_METRICAS]
+CABECALHO_HISTORICO += ["modo_medicos", "modo_grafo"]
+# pedidos de cobertura enviados no caso e quantos deram a resposta usada (cobertura.py)
+CABECALHO_HISTORICO += ["coberturas", "coberturas_vencidas"]
+# critério usado em acertou_A/acertou_B (config.CRITERIO_AVALIACAO; vazio = "texto")
+CABECALHO_HISTORICO += ["criterio_avaliacao"]
+
+
+@dataclass
+class CasoProcessado:
+    """Resultado das etapas com LLM (grafo + médicos) para um caso."""
+    iteracao: int
+    idx: int
+    caso: Dict[str, Any]
+    grafo_res: GrafoResultado
+    resultados: Dict[str, ResultadoMedico] = field(default_factory=dict)
+    tempo_grafo: float = 0.0
+    tempo_medicos: float = 0.0
+    t_total_ini: float = 0.0
+    versao_prompt: str = ""
+    modo_medicos: str = "separado"
+    modo_grafo: str = "separado"
+    prazo: Optional[Prazo] = None  # prazo do caso para as chamadas ao LLM
+
+
+def criar_medicos() -> Dict[str, MedicoLLM]:
+    """Os dois médicos virtuais usados em todas as formas de execução."""
+    return {
+        "A": MedicoLLM(
+            "A",
+            PROMPT_MEDICO_BASE,
+            perfil=PERFIL_MEDICO_CONSERVADOR,
+            model_name=config.MODEL_NAME,
+            temperature=0.0,  # conservador, determinístico
+        ),
+        "B": MedicoLLM(
+            "B",
+            PROMPT_MEDICO_BASE,
+            perfil=PERFIL_MEDICO_EXPLORADOR,
+            model_name=config.MODEL_NAME,
+            temperature=0.4,  # explorador, mais variabilidade
+            usar_cache=config.CACHE_MEDICO_EXPLORADOR,
+        ),
+    }
+
+
+def criar_painel(medicos: Dict[str, MedicoLLM]) -> Optional[PainelMedicosLLM]:
+    """Painel com todos os médicos num só pedido, se config.MODO_MEDICOS = "painel"."""
+    if config.MODO_MEDICOS == "separado":
+        return None
+    if config.MODO_MEDICOS != "painel":
+        raise ValueError(f"MODO_MEDICOS desconhecido: {config.MODO_MEDICOS}")
+    return PainelMedicosLLM(medicos)
+
+
+def _textos_prompt(prompt) -> List[str]:
+    return [
+        getattr(getattr(m, "prompt", None), "template", None) or str(m)
+        for m in prompt.messages
+    ]
+
+
+def versao_prompts(
+    construtor_grafo,
+    medicos: Dict[str, MedicoLLM],
+    painel: Optional[PainelMedicosLLM] = None,
+    fundido: Optional[GrafoFundidoLLM] = None,
+) -> str:
+    """
+    Identificador da configuração de prompts/modelos, gravado em cada linha
+    do histórico. Por omissão é um hash dos templates, modelos,
+    temperaturas e do critério de avaliação, por isso muda sozinho quando
+    um prompt é alterado e um caso avaliado com outro critério não é
+    saltado ao retomar.
+    """
+    if config.VERSAO_PROMPT:
+        return config.VERSAO_PROMPT
+    partes = [construtor_grafo.cliente.model_name, str(construtor_grafo.cliente.temperature)]
+    partes += ["criterio", config.CRITERIO_AVALIACAO]
+    partes += _textos_prompt(construtor_grafo.prompt)
+    if fundido is not None:
+        partes += ["fundido", fundido.medico.medico_id] + _textos_prompt(fundido.prompt)
+    if painel is not None:
+        partes += ["painel", painel.cliente.model_name, str(painel.cliente.temperature)]
+        partes += _textos_prompt(painel.prompt)
+    else:
+        for mid, medico in medicos.items():
+            partes += [mid, medico.cliente.model_name, str(medico.cliente.temperature), medico.layout]
+            partes += _textos_prompt(medico.prompt)
+    return hashlib.sha256("\x1f".join(partes).encode("utf-8")).hexdigest()[:12]
+
+
+def preparar_ficheiro_historico(path_csv: str):
+    """
+    Cria ficheiro de histórico com cabeçalho se ainda não existir.
+    Se existir mas tiver um cabeçalho antigo (menos colunas), acrescenta as
+    colunas novas ao cabeçalho e deixa-as vazias nas linhas já gravadas.
+    """
+    os.makedirs(os.path.dirname(path_csv), exist_ok=True)
+    if not os.path.exists(path_csv):
+        with open(path_csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(CABECALHO_HISTORICO)
+        return
+
+    with open(path_csv, "r", newline="", encoding="utf-8") as f:
+        linhas = list(csv.reader(f))
+    if not linhas or linhas[0] == CABECALHO_HISTORICO:
+        return
+
+    antigo = linhas[0]
+    if antigo != CABECALHO_HISTORICO[: len(antigo)]:
+        raise ValueError(
+            f"Cabeçalho inesperado em {path_csv}; move o ficheiro antigo antes de continuar."
+        )
+    extra = len(CABECALHO_HISTORICO) - len(antigo)
+    print(f"A atualizar cabeçalho do histórico ({extra} colunas novas)...")
+    with open(path_csv, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(CABECALHO_HISTORICO)
+        for linha in linhas[1:]:
+            writer.writerow(linha + [""] * extra)
+
+
+def chave_caso(iteracao, subject_id, hadm_id) -> str:
+    """Identificador do caso nos eventos de reputação (iteração, SUBJECT_ID e HADM_ID)."""
+    return f"{iteracao}:{subject_id}-{hadm_id}"
+
+
+def confirmar_reputacao(gestor_rep: GestorReputacao) -> Callable[[List[List[Any]]], None]:
+    """
+    Callback para HistoricoCSV(ao_gravar=...): quando as linhas ficam em
+    disco, os eventos de reputação dos seus casos podem ser gravados
+    (GestorReputacao com aguardar_confirmacao=True).
+    """
+    i_it, i_subj, i_hadm = (CABECALHO_HISTORICO.index(c) for c in ("iteracao", "subject_id", "hadm_id"))
+
+    def confirmar(linhas: List[List[Any]]):
+        gestor_rep.confirmar(chave_caso(l[i_it], l[i_subj], l[i_hadm]) for l in linhas)
+
+    return confirmar
+
+
+def tem_diagnostico_valido(diag):
+    """Devolve True se o diagnóstico verdadeiro for uma string não vazia."""
+    if diag is None:
+        return False
+    if isinstance(diag, float) and math.isnan(diag):
+        return False
+    s = str(diag).strip()
+    return len(s) > 0
+
+
+def _len_nota(caso) -> int:
+    """Comprimento da nota; os casos do armazém binário trazem-no já no índice."""
+    n = caso.get("len_nota")
+    if n is not None:
+        return int(n)
+    return len(str(caso["descricao"]))
+
+
+def imprimir_cabecalho_caso(it: int, idx: int, caso: Dict[str, Any]):
+    print(
+        f"\n=== Iteração {it} | SUBJECT {caso['subject_id']} "
+        f"HADM {caso['hadm_id']} (idx {idx}) ==="
+    )
+
+
+def avaliar_caso(
+    proc: CasoProcessado,
+    gestor_rep: GestorReputacao,
+    t_total_fim: Optional[float] = None,
+) -> List[Any]:
+    """
+    Avalia os diagnósticos de cada médico, atualiza a reputação e calcula
+    a discordância. Devolve a linha pronta a escrever no histórico.
+
+    A reputação é atualizada pela ordem dos médicos em proc.resultados;
+    quem chama é responsável por avaliar os casos pela ordem das iterações
+    (o pipeline assíncrono reordena antes de chamar esta função).
+    """
+    caso = proc.caso
+    diag_verdadeiro = caso.get("diagnostico_verdadeiro")
+
+    print(f"Grafo criado em: {proc.grafo_res.html_path or proc.grafo_res.json_path}")
+    print(f"Número de componentes desconectadas no grafo: {proc.grafo_res.num_componentes}")
+
+    nomes_diags_por_medico = {}
+    acertou_por_medico = {"A": None, "B": None}
+    reputacao_por_medico = {"A": None, "B": None}
+
+    for mid, res_med in proc.resultados.items():
+        nomes_diags = [d.get("name", "") for d in res_med.diagnoses]
+        nomes_diags_por_medico[mid] = nomes_diags
+
+        print(f"\nMédico {mid}: {nomes_diags}")
+
+        with span("avaliacao", medico=mid, diagnosticos=len(nomes_diags)) as s:
+            correto = avaliar_diagnosticos(
+                nomes_diags, diag_verdadeiro, codigo_verdadeiro=caso.get("icd9_verdadeiro")
+            )
+            s.definir(correto=correto)
+        acertou_por_medico[mid] = correto
+        with span("reputacao", medico=mid):
+            gestor_rep.atualizar(
+                mid, correto, caso=chave_caso(proc.iteracao, caso["subject_id"], caso["hadm_id"])
+            )
+            rep = gestor_rep.obter_reputacao(mid)
+        reputacao_por_medico[mid] = rep
+        print(f"  -> {'ACERTOU' if correto else 'FALHOU'} (reputação = {rep:.2f})")
+
+    # Discordância entre médicos
+    if "A" in proc.resultados and "B" in proc.resultados:
+        with span("discordancia"):
+            discordancia = calcular_discordancia(
+                proc.resultados["A"].diagnoses,
+                proc.resultados["B"].diagnoses,
+            )
+    else:
+        discordancia = 0.0
+
+    print(f"\nDiscordância entre médicos (Jaccard-based): {discordancia:.2f}")
+
+    if t_total_fim is None:
+        t_total_fim = time.perf_counter()
+    tempo_total = t_total_fim - proc.t_total_ini
+
+    print(f"\nTempo grafo: {proc.tempo_grafo:.2f} s")
+    print(f"Tempo médicos: {proc.tempo_medicos:.2f} s")
+    print(f"Tempo total por caso: {tempo_total:.2f} s")
+
+    # tokens do prompt servidos pela cache de prompts da API (prefixo partilhado)
+    uso = [
+        f"{mid}={r.resposta.tokens_cache}/{r.resposta.tokens_prompt}"
+        for mid, r in proc.resultados.items()
+        if r.resposta is not None and r.resposta.tokens_prompt
+    ]
+    if uso:
+        print(f"Tokens do prompt em cache (API): {', '.join(uso)}")
+
+    # chamadas servidas pela cache em disco neste caso (grafo + médicos)
+    resultados = list(proc.resultados.values())
+    if proc.modo_medicos == "painel":
+        resultados = resultados[:1]  # um só pedido para todos os médicos
+    if proc.modo_grafo == "fundido":
+        # o médico fundido veio no pedido do grafo
+        resultados = [r for r in resultados if r.medico_id != config.MEDICO_FUNDIDO]
+    flags_cache = [proc.grafo_res.em_cache] + [r.em_cache for r in resultados]
+    cache_hits = sum(1 for f in flags_cache if f)
+    cache_misses = len(flags_cache) - cache_hits
+
+    respostas = [proc.grafo_res.resposta] + [r.resposta for r in proc.resultados.values()]
+    respostas = [r for r in respostas if r is not None]
+    coberturas = sum(1 for r in respostas if r.cobertura)
+    coberturas_vencidas = sum(1 for r in respostas if r.cobertura_venceu)
+    if coberturas:
+        print(f"Pedidos de cobertura: {coberturas} ({coberturas_vencidas} com a resposta usada)")
+
+    return [
+        proc.iteracao,
+        proc.idx,
+        caso["subject_id"],
+        caso["hadm_id"],
+        _len_nota(caso),
+        diag_verdadeiro,
+        "|".join(nomes_diags_por_medico.get("A", [])),
+        "|".join(nomes_diags_por_medico.get("B", [])),
+        acertou_por_medico["A"],
+        acertou_por_medico["B"],
+        reputacao_por_medico["A"],
+        reputacao_por_medico["B"],
+        discordancia,
+        proc.grafo_res.num_componentes,
+        tempo_total,
+        proc.tempo_grafo,
+        proc.tempo_medicos,
+        cache_hits,
+        cache_misses,
+        proc.versao_prompt,
+        *metricas_resposta(proc.grafo_res.resposta),
+        *(
+            valor
+            for mid in ("A", "B")
+            for valor in metricas_resposta(
+                proc.resultados[mid].resposta if mid in proc.resultados else None
+            )
+        ),
+        proc.modo_medicos,
+        proc.modo_grafo,
+        coberturas,
+        coberturas_vencidas,
+        config.CRITERIO_AVALIACAO,
+    ]
+
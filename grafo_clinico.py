@@ -0,0 +1,221 @@
+# grafo_clinico.py
+#
+# Representação compacta do grafo devolvido pelo LLM ({"nodes": [...],
+# "edges": [...]}), construída uma vez a partir do JSON já interpretado.
+#
+#   - ids dos nós internados: cada id passa a um inteiro 0..n-1;
+#   - tipo de cada nó num array int8 (TipoNo);
+#   - arestas em arrays paralelos (origem, destino, código da relação),
+#     com as relações também internadas.
+#
+# Sobre esta estrutura: componentes ligadas (union-find), histogramas de
+# graus e de tipos, e que diagnósticos são alcançáveis a partir do doente.
+# para_json() devolve o mesmo formato de entrada, por isso o MedicoLLM e o
+# HTML pyvis continuam a receber um dicionário.
+
+from enum import IntEnum
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+class TipoNo(IntEnum):
+    OTHER = 0
+    PATIENT = 1
+    DEMOGRAPHIC = 2
+    SYMPTOM = 3
+    SIGN = 4
+    RISK_FACTOR = 5
+    HABIT = 6
+    COMORBIDITY = 7
+    TEST = 8
+    TREATMENT = 9
+    INTERMEDIATE_HYPOTHESIS = 10
+    DIAGNOSIS = 11
+
+    @classmethod
+    def de_texto(cls, tipo: Optional[str]) -> "TipoNo":
+        """Tipo do prompt (ex.: "risk_factor") -> TipoNo; desconhecidos -> OTHER."""
+        if not tipo:
+            return cls.OTHER
+        return cls.__members__.get(str(tipo).strip().upper(), cls.OTHER)
+
+
+_CHAVES_NO = ("id", "label", "type")
+_CHAVES_ARESTA = ("source", "target", "relation")
+
+
+class GrafoClinico:
+    def __init__(self):
+        self.ids: List[str] = []
+        self.labels: List[Optional[str]] = []
+        self.tipos = np.empty(0, dtype=np.int8)
+        self.tipos_texto: List[Optional[str]] = []  # texto original (para o round-trip)
+        self.origem = np.empty(0, dtype=np.int32)
+        self.destino = np.empty(0, dtype=np.int32)
+        self.relacao = np.empty(0, dtype=np.int16)
+        self.relacoes: List[str] = []  # código -> texto da relação
+
+        self._posicao: Dict[str, int] = {}
+        # campos extra de nós/arestas e arestas para nós inexistentes: só
+        # guardados para para_json() devolver o que veio do LLM
+        self._extras_nos: Dict[int, Dict[str, Any]] = {}
+        self._extras_arestas: Dict[int, Dict[str, Any]] = {}
+        self._arestas_soltas: List[Dict[str, Any]] = []
+        self._componentes: Optional[np.ndarray] = None
+
+    # ---------------------- construção / JSON -------------------------
+
+    @classmethod
+    def de_json(cls, grafo_json: Dict[str, Any]) -> "GrafoClinico":
+        g = cls()
+        tipos = []
+        for node in grafo_json.get("nodes", []) or []:
+            nid = node.get("id")
+            if nid is None or nid in g._posicao:
+                continue  # sem id ou repetido: o primeiro prevalece
+            g._posicao[nid] = len(g.ids)
+            g.ids.append(nid)
+            g.labels.append(node.get("label"))
+            g.tipos_texto.append(node.get("type"))
+            tipos.append(TipoNo.de_texto(node.get("type")))
+            extra = {k: v for k, v in node.items() if k not in _CHAVES_NO}
+            if extra:
+                g._extras_nos[len(g.ids) - 1] = extra
+        g.tipos = np.array(tipos, dtype=np.int8)
+
+        codigos_rel: Dict[str, int] = {}
+        origem, destino, relacao = [], [], []
+        for edge in grafo_json.get("edges", []) or []:
+            s = g._posicao.get(edge.get("source"))
+            t = g._posicao.get(edge.get("target"))
+            if s is None or t is None:
+                g._arestas_soltas.append(edge)
+                continue
+            rel = edge.get("relation", "")
+            if rel not in codigos_rel:
+                codigos_rel[rel] = len(g.relacoes)
+                g.relacoes.append(rel)
+            origem.append(s)
+            destino.append(t)
+            relacao.append(codigos_rel[rel])
+            extra = {k: v for k, v in edge.items() if k not in _CHAVES_ARESTA}
+            if extra:
+                g._extras_arestas[len(origem) - 1] = extra
+        g.origem = np.array(origem, dtype=np.int32)
+        g.destino = np.array(destino, dtype=np.int32)
+        g.relacao = np.array(relacao, dtype=np.int16)
+        return g
+
+    def para_json(self) -> Dict[str, Any]:
+        nodes = []
+        for i, nid in enumerate(self.ids):
+            node = {"id": nid}
+            if self.labels[i] is not None:
+                node["label"] = self.labels[i]
+            if self.tipos_texto[i] is not None:
+                node["type"] = self.tipos_texto[i]
+            node.update(self._extras_nos.get(i, {}))
+            nodes.append(node)
+        edges = []
+        for k in range(len(self.origem)):
+            edge = {
+                "source": self.ids[self.origem[k]],
+                "target": self.ids[self.destino[k]],
+                "relation": self.relacoes[self.relacao[k]],
+            }
+            edge.update(self._extras_arestas.get(k, {}))
+            edges.append(edge)
+        edges.extend(self._arestas_soltas)
+        return {"nodes": nodes, "edges": edges}
+
+    # ---------------------- consultas -------------------------
+
+    @property
+    def num_nos(self) -> int:
+        return len(self.ids)
+
+    @property
+    def num_arestas(self) -> int:
+        return len(self.origem)
+
+    def posicao(self, nid: str) -> Optional[int]:
+        return self._posicao.get(nid)
+
+    def componentes(self) -> np.ndarray:
+        """Etiqueta da componente (não dirigida) de cada nó, 0..k-1 por ordem de aparecimento."""
+        if self._componentes is not None:
+            return self._componentes
+        pai = list(range(self.num_nos))
+
+        def raiz(x: int) -> int:
+            while pai[x] != x:
+                pai[x] = pai[pai[x]]  # compressão de caminho (halving)
+                x = pai[x]
+            return x
+
+        for s, t in zip(self.origem.tolist(), self.destino.tolist()):
+            rs, rt = raiz(s), raiz(t)
+            if rs != rt:
+                # unir à raiz com menor índice: etiquetas estáveis
+                if rs < rt:
+                    pai[rt] = rs
+                else:
+                    pai[rs] = rt
+        raizes = np.array([raiz(i) for i in range(self.num_nos)], dtype=np.int32)
+        _, etiquetas = np.unique(raizes, return_inverse=True)
+        self._componentes = etiquetas.astype(np.int32)
+        return self._componentes
+
+    def num_componentes(self) -> int:
+        if self.num_nos == 0:
+            return 0
+        return int(self.componentes().max()) + 1
+
+    def graus(self) -> np.ndarray:
+        """Grau total (entrada + saída) de cada nó."""
+        return np.bincount(
+            np.concatenate([self.origem, self.destino]), minlength=self.num_nos
+        )
+
+    def histograma_graus(self) -> np.ndarray:
+        """h[g] = nº de nós com grau g."""
+        return np.bincount(self.graus()) if self.num_nos else np.zeros(1, dtype=np.int64)
+
+    def histograma_tipos(self) -> Dict[TipoNo, int]:
+        contagens = np.bincount(self.tipos, minlength=len(TipoNo))
+        return {t: int(contagens[t]) for t in TipoNo if contagens[t]}
+
+    def nos_do_tipo(self, tipo: TipoNo) -> np.ndarray:
+        return np.flatnonzero(self.tipos == tipo)
+
+    def alcancaveis(self, inicio: np.ndarray, dirigido: bool = False) -> np.ndarray:
+        """Máscara booleana dos nós alcançáveis a partir de `inicio` (BFS por fronteiras)."""
+        visitado = np.zeros(self.num_nos, dtype=bool)
+        fronteira = np.asarray(inicio, dtype=np.int32)
+        visitado[fronteira] = True
+        if dirigido:
+            origem, destino = self.origem, self.destino
+        else:
+            origem = np.concatenate([self.origem, self.destino])
+            destino = np.concatenate([self.destino, self.origem])
+        while len(fronteira):
+            na_fronteira = np.zeros(self.num_nos, dtype=bool)
+            na_fronteira[fronteira] = True
+            vizinhos = destino[na_fronteira[origem]]
+            novos = np.unique(vizinhos[~visitado[vizinhos]])
+            visitado[novos] = True
+            fronteira = novos
+        return visitado
+
+    def diagnosticos_alcancaveis(self, dirigido: bool = False) -> List[str]:
+        """Ids dos nós "diagnosis" ligados ao(s) nó(s) "patient"."""
+        doentes = self.nos_do_tipo(TipoNo.PATIENT)
+        if len(doentes) == 0:
+            return []
+        mascara = self.alcancaveis(doentes, dirigido=dirigido)
+        diags = self.nos_do_tipo(TipoNo.DIAGNOSIS)
+        return [self.ids[i] for i in diags if mascara[i]]
+
+    def diagnostico_alcancavel(self, nid: str, dirigido: bool = False) -> bool:
+        return nid in self.diagnosticos_alcancaveis(dirigido=dirigido)
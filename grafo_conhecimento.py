@@ -1,15 +1,26 @@
 # grafo_conhecimento.py
 
 from dataclasses import dataclass
-from typing import Dict, Any, List
+from typing import Dict, Any, Callable, List, Optional
+import argparse
+import atexit
 import json
 import os
-from collections import deque
+import asyncio
+import queue
+import shutil
+import threading
 
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from pyvis.network import Network
 
+from cliente_llm import ClienteLLM, RespostaLLM
+from cobertura import Prazo
+from grafo_clinico import GrafoClinico
+from json_incremental import carregar_json, preparar_parser
+from rastreio import span
+import config
+
 
 PROMPT_GRAFO = """
 You are a medical knowledge extraction and reasoning assistant.
@@ -89,13 +100,105 @@ OUTPUT
 @dataclass
 class GrafoResultado:
     grafo_json: Dict[str, Any]
-    html_path: str
+    html_path: Optional[str]  # None no modo "diferido" (HTML só a pedido)
     num_componentes: int = 1  # para análise posterior
+    em_cache: bool = False  # resposta do LLM veio da cache em disco
+    json_path: Optional[str] = None
+    grafo: Optional[GrafoClinico] = None  # estrutura compacta (grafo_clinico.py)
+    resposta: Optional[RespostaLLM] = None  # métricas da chamada (None no modo em lote)
+
+
+# ---------------------- HTML fora do caminho crítico -------------------------
+#
+# config.MODO_HTML:
+#   "sincrono" - o HTML pyvis é escrito dentro de construir() (modo original);
+#   "fundo"    - o HTML é escrito por uma thread em segundo plano;
+#   "diferido" - só se grava o JSON; o HTML é gerado a pedido
+#                (python grafo_conhecimento.py NOME ... / --todos) ou o grafo é
+#                aberto no visualizador estático (visualizador_grafos.html).
+# Em todos os modos o JSON do grafo fica em <output_dir>/json/<nome_base>.json
+# e o nome é acrescentado a <output_dir>/json/indice.txt (lista do visualizador).
+
+VISUALIZADOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "visualizador_grafos.html")
+
+
+class _RenderizadorFundo:
+    """Uma thread que escreve os HTML pyvis pela ordem em que são pedidos."""
+
+    def __init__(self):
+        self._fila: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._trabalhar, daemon=True, name="html")
+        self._thread.start()
+        # no fim do processo, acabar os HTML que ainda estão na fila
+        atexit.register(self.esperar)
+
+    def agendar(self, funcao, *args):
+        self._fila.put((funcao, args))
+
+    def _trabalhar(self):
+        while True:
+            funcao, args = self._fila.get()
+            try:
+                funcao(*args)
+            except Exception as exc:  # um HTML falhado não deve parar o pipeline
+                print(f"[grafos] erro ao escrever HTML: {exc}")
+            finally:
+                self._fila.task_done()
+
+    def esperar(self):
+        self._fila.join()
+
+
+_renderizador: Optional[_RenderizadorFundo] = None
+_lock_renderizador = threading.Lock()
+
+
+def _obter_renderizador() -> _RenderizadorFundo:
+    global _renderizador
+    with _lock_renderizador:
+        if _renderizador is None:
+            _renderizador = _RenderizadorFundo()
+        return _renderizador
+
+
+def gravar_grafo_json(grafo_json: Dict[str, Any], output_dir: str, nome_base: str) -> str:
+    """Grava o grafo em JSON compacto e regista-o no índice do visualizador."""
+    dir_json = os.path.join(output_dir, "json")
+    os.makedirs(dir_json, exist_ok=True)
+    path = os.path.join(dir_json, f"{nome_base}.json")
+    novo = not os.path.exists(path)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(grafo_json, f, ensure_ascii=False, separators=(",", ":"))
+    if novo:
+        with open(os.path.join(dir_json, "indice.txt"), "a", encoding="utf-8") as f:
+            f.write(nome_base + "\n")
+    _copiar_visualizador(output_dir)
+    return path
+
+
+def _copiar_visualizador(output_dir: str):
+    destino = os.path.join(output_dir, os.path.basename(VISUALIZADOR))
+    if not os.path.exists(destino) or os.path.getmtime(destino) < os.path.getmtime(VISUALIZADOR):
+        shutil.copyfile(VISUALIZADOR, destino)
+
+
+_CHAVES_GRAFO = ("nodes", "edges")
+
+
+def _grafo_valido(dados: Dict[str, Any]) -> Dict[str, Any]:
+    """Garante as listas "nodes" e "edges"; uma resposta ilegível dá um grafo vazio."""
+    if not isinstance(dados.get("nodes"), list):
+        print("[grafo] resposta sem lista de nós: a usar grafo vazio")
+        dados["nodes"] = []
+    if not isinstance(dados.get("edges"), list):
+        dados["edges"] = []
+    return dados
 
 
 class ConstrutorGrafoLLM:
     def __init__(self, model_name: str = "gpt-4o-mini"):
-        self.model = ChatOpenAI(model=model_name, temperature=0)
+        # todas as chamadas passam pelo limitador de taxa partilhado
+        self.cliente = ClienteLLM(model_name=model_name, temperature=0, etapa="grafo")
         self.prompt = ChatPromptTemplate.from_messages(
             [
                 ("system", PROMPT_GRAFO),
@@ -103,68 +206,106 @@ class ConstrutorGrafoLLM:
             ]
         )
 
-    def construir(self, nota: str, output_dir: str, nome_base: str = "grafo") -> GrafoResultado:
-        os.makedirs(output_dir, exist_ok=True)
-
-        chain = self.prompt | self.model
-        response = chain.invoke({"nota": nota})
-        raw_text = response.content
-
-        grafo_json = self._parse_json(raw_text)
+    def mensagens(self, nota: str):
+        """Mensagens (system + user) já renderizadas para a nota."""
+        return self.prompt.format_messages(nota=nota)
+
+    def construir(
+        self,
+        nota: str,
+        output_dir: str,
+        nome_base: str = "grafo",
+        ao_item: Optional[Callable[[str, Any], None]] = None,
+        prazo: Optional[Prazo] = None,
+    ) -> GrafoResultado:
+        """
+        ao_item("nodes" | "edges", objeto) é chamado à medida que cada nó e
+        aresta chega (com config.STREAMING_JSON). `prazo` é o prazo do caso
+        (cobertura.py).
+        """
+        mensagens = self.mensagens(nota)
+        ao_pedaco, parser = preparar_parser(_CHAVES_GRAFO, _grafo_valido, ao_item)
+        resposta = self.cliente.invocar(mensagens, parser=parser, ao_pedaco=ao_pedaco, prazo=prazo)
+        return self._processar_grafo(resposta.dados, output_dir, nome_base, resposta)
+
+    async def aconstruir(
+        self,
+        nota: str,
+        output_dir: str,
+        nome_base: str = "grafo",
+        ao_item: Optional[Callable[[str, Any], None]] = None,
+        prazo: Optional[Prazo] = None,
+    ) -> GrafoResultado:
+        """
+        Versão assíncrona de construir() (usa ainvoke), usada pelo pipeline
+        em pipeline_async.py. O parsing e a escrita do HTML correm numa
+        thread para não bloquear o event loop.
+        """
+        mensagens = self.mensagens(nota)
+        ao_pedaco, parser = preparar_parser(_CHAVES_GRAFO, _grafo_valido, ao_item)
+        resposta = await self.cliente.ainvocar(
+            mensagens, parser=parser, ao_pedaco=ao_pedaco, prazo=prazo
+        )
+        return await asyncio.to_thread(
+            self._processar_grafo, resposta.dados, output_dir, nome_base, resposta
+        )
 
-        # só analisamos quantas componentes há, não mexemos nas arestas
-        num_comp = self._count_components(grafo_json)
+    # ---------------------- helpers internos -------------------------
 
-        html_path = self._criar_html(grafo_json, output_dir, nome_base)
+    def _processar_resposta(self, raw_text: str, output_dir: str, nome_base: str) -> GrafoResultado:
+        return self._processar_grafo(self._parse_json(raw_text), output_dir, nome_base)
 
-        return GrafoResultado(grafo_json=grafo_json, html_path=html_path, num_componentes=num_comp)
+    def _processar_grafo(
+        self,
+        grafo_json: Dict[str, Any],
+        output_dir: str,
+        nome_base: str,
+        resposta: Optional[RespostaLLM] = None,
+    ) -> GrafoResultado:
+        os.makedirs(output_dir, exist_ok=True)
 
-    # ---------------------- helpers internos -------------------------
+        # estrutura compacta construída uma vez; o JSON segue intacto para os médicos
+        with span("componentes") as s:
+            grafo = GrafoClinico.de_json(grafo_json)
+            num_comp = grafo.num_componentes()
+            s.definir(nos=grafo.num_nos, arestas=grafo.num_arestas, componentes=num_comp)
+
+        with span("gravar_json"):
+            json_path = gravar_grafo_json(grafo_json, output_dir, nome_base)
+
+        modo = config.MODO_HTML
+        if modo == "sincrono":
+            html_path = self._criar_html(grafo_json, output_dir, nome_base)
+        elif modo == "fundo":
+            html_path = os.path.join(output_dir, f"{nome_base}.html")
+            _obter_renderizador().agendar(self._criar_html, grafo_json, output_dir, nome_base)
+        elif modo == "diferido":
+            html_path = None
+        else:
+            raise ValueError(f"MODO_HTML desconhecido: {modo}")
+
+        return GrafoResultado(
+            grafo_json=grafo_json,
+            html_path=html_path,
+            num_componentes=num_comp,
+            em_cache=resposta is not None and resposta.em_cache,
+            json_path=json_path,
+            grafo=grafo,
+            resposta=resposta,
+        )
 
     def _parse_json(self, raw_text: str) -> Dict[str, Any]:
-        try:
-            return json.loads(raw_text)
-        except json.JSONDecodeError:
-            inicio = raw_text.find("{")
-            fim = raw_text.rfind("}") + 1
-            json_text = raw_text[inicio:fim]
-            return json.loads(json_text)
+        return _grafo_valido(carregar_json(raw_text, _CHAVES_GRAFO))
 
     def _count_components(self, grafo_json: Dict[str, Any]) -> int:
-        nodes: List[Dict[str, Any]] = grafo_json.get("nodes", []) or []
-        edges: List[Dict[str, Any]] = grafo_json.get("edges", []) or []
-
-        node_ids = [n.get("id") for n in nodes if n.get("id") is not None]
-        if not node_ids:
-            return 0
-
-        adj = {nid: set() for nid in node_ids}
-        for e in edges:
-            s = e.get("source")
-            t = e.get("target")
-            if s in adj and t in adj:
-                adj[s].add(t)
-                adj[t].add(s)
-
-        visited = set()
-        comp_count = 0
-
-        for nid in node_ids:
-            if nid in visited:
-                continue
-            comp_count += 1
-            q = deque([nid])
-            visited.add(nid)
-            while q:
-                u = q.popleft()
-                for v in adj.get(u, []):
-                    if v not in visited:
-                        visited.add(v)
-                        q.append(v)
-
-        return comp_count
+        return GrafoClinico.de_json(grafo_json).num_componentes()
 
     def _criar_html(self, grafo_json: Dict[str, Any], output_dir: str, nome_base: str) -> str:
+        # no modo "fundo" corre na thread do renderizador (pista própria no rastreio)
+        with span("html", ficheiro=nome_base):
+            return self._escrever_html(grafo_json, output_dir, nome_base)
+
+    def _escrever_html(self, grafo_json: Dict[str, Any], output_dir: str, nome_base: str) -> str:
         net = Network(height="700px", width="100%", directed=True)
 
         for node in grafo_json.get("nodes", []):
@@ -199,3 +340,41 @@ class ConstrutorGrafoLLM:
         if "diagnosis" in tipo:
             return "red"
         return "gray"
+
+
+def renderizar_html(nomes: List[str], output_dir: str = None) -> List[str]:
+    """Gera (a pedido) o HTML pyvis de grafos já gravados em <output_dir>/json."""
+    if output_dir is None:
+        output_dir = config.DIR_GRAFOS
+    dir_json = os.path.join(output_dir, "json")
+    construtor = ConstrutorGrafoLLM.__new__(ConstrutorGrafoLLM)  # não precisa do cliente LLM
+    paths = []
+    for nome in nomes:
+        with open(os.path.join(dir_json, f"{nome}.json"), "r", encoding="utf-8") as f:
+            grafo_json = json.load(f)
+        paths.append(construtor._criar_html(grafo_json, output_dir, nome))
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera o HTML pyvis de grafos gravados em JSON.")
+    parser.add_argument("nomes", nargs="*", help="nomes base (ex.: grafo_123_456)")
+    parser.add_argument("--todos", action="store_true", help="todos os grafos sem HTML")
+    parser.add_argument("--dir", default=config.DIR_GRAFOS)
+    args = parser.parse_args()
+
+    nomes = list(args.nomes)
+    if args.todos:
+        dir_json = os.path.join(args.dir, "json")
+        nomes += [
+            n[:-5]
+            for n in sorted(os.listdir(dir_json))
+            if n.endswith(".json") and not os.path.exists(os.path.join(args.dir, n[:-5] + ".html"))
+        ]
+    for path in renderizar_html(nomes, args.dir):
+        print(path)
+    print(f"{len(nomes)} grafos. Visualizador: {os.path.join(args.dir, os.path.basename(VISUALIZADOR))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# grafo_fundido.py
+#
+# Modo experimental config.MODO_GRAFO = "fundido": um só pedido devolve o
+# grafo de conhecimento e os diagnósticos de um dos médicos
+# (config.MEDICO_FUNDIDO), em vez de um pedido para o grafo seguido de um
+# pedido por médico.
+#
+#   {"nodes": [...], "edges": [...], "diagnoses": [...]}
+#
+# O grafo segue o caminho normal (JSON, componentes, HTML) e é enviado aos
+# restantes médicos. Por caso fica um pedido sequencial a menos no caminho
+# crítico; as colunas modo_grafo, tempo_grafo e acertou_* do histórico
+# permitem comparar com o modo "separado".
+
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+
+from langchain_core.prompts import ChatPromptTemplate
+
+from cliente_llm import ClienteLLM, RespostaLLM
+from cobertura import Prazo
+from json_incremental import preparar_parser
+from grafo_conhecimento import ConstrutorGrafoLLM, GrafoResultado, PROMPT_GRAFO, _grafo_valido
+from medicos import MedicoLLM, ResultadoMedico, _lista_diagnosticos
+import config
+
+
+PROMPT_FUNDIDO = """
+SECOND TASK: DIAGNOSIS
+After building the knowledge graph, act as the doctor described below. Reason
+over the clinical note and the graph you have just built (the graph is the
+"knowledge graph" input mentioned below).
+{medico}
+COMBINED OUTPUT (this replaces the output instructions above)
+Return ONLY a single JSON object with exactly three top-level keys, in this order:
+"nodes" and "edges" (the knowledge graph, as specified in the first task) and
+"diagnoses" (the list of diagnoses, as specified for the doctor).
+"""
+
+
+_CHAVES = ("nodes", "edges", "diagnoses")
+
+
+class GrafoFundidoLLM:
+    """Grafo + diagnósticos de um médico num só pedido ao LLM."""
+
+    def __init__(self, construtor: ConstrutorGrafoLLM, medico: MedicoLLM):
+        self.construtor = construtor
+        self.medico = medico
+        # mesma temperatura do construtor do grafo (0): o grafo tem de ser estável
+        self.cliente = ClienteLLM(
+            model_name=construtor.cliente.model_name, temperature=0, etapa="fundido"
+        )
+        texto_medico = medico.prompt_sistema + (medico.perfil or "")
+        self.prompt = ChatPromptTemplate.from_messages(
+            [
+                ("system", PROMPT_GRAFO),
+                ("system", PROMPT_FUNDIDO.format(medico=texto_medico)),
+                ("user", "Clinical note:\n{nota}\n\nReturn ONLY the JSON object."),
+            ]
+        )
+
+    def mensagens(self, nota: str):
+        return self.prompt.format_messages(nota=nota)
+
+    def construir(
+        self,
+        nota: str,
+        output_dir: str,
+        nome_base: str = "grafo",
+        prazo: Optional[Prazo] = None,
+    ) -> Tuple[GrafoResultado, ResultadoMedico]:
+        ao_pedaco, parser = preparar_parser(_CHAVES, self._separar)
+        resposta = self.cliente.invocar(
+            self.mensagens(nota), parser=parser, ao_pedaco=ao_pedaco, prazo=prazo
+        )
+        return self._resultados(resposta, output_dir, nome_base)
+
+    async def aconstruir(
+        self,
+        nota: str,
+        output_dir: str,
+        nome_base: str = "grafo",
+        prazo: Optional[Prazo] = None,
+    ) -> Tuple[GrafoResultado, ResultadoMedico]:
+        """Versão assíncrona de construir(); o processamento do grafo corre numa thread."""
+        ao_pedaco, parser = preparar_parser(_CHAVES, self._separar)
+        resposta = await self.cliente.ainvocar(
+            self.mensagens(nota), parser=parser, ao_pedaco=ao_pedaco, prazo=prazo
+        )
+        return await asyncio.to_thread(self._resultados, resposta, output_dir, nome_base)
+
+    def _separar(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        grafo = _grafo_valido({"nodes": data.get("nodes"), "edges": data.get("edges")})
+        return {"grafo": grafo, "diagnoses": _lista_diagnosticos(data)}
+
+    def _resultados(
+        self, resposta: RespostaLLM, output_dir: str, nome_base: str
+    ) -> Tuple[GrafoResultado, ResultadoMedico]:
+        # as métricas da chamada ficam no grafo (colunas grafo_*), não no médico
+        grafo_res = self.construtor._processar_grafo(
+            resposta.dados["grafo"], output_dir, nome_base, resposta
+        )
+        resultado = ResultadoMedico(
+            medico_id=self.medico.medico_id,
+            diagnoses=resposta.dados["diagnoses"],
+            em_cache=resposta.em_cache,
+        )
+        return grafo_res, resultado
+
+
+def criar_grafo_fundido(
+    construtor: ConstrutorGrafoLLM, medicos: Dict[str, MedicoLLM]
+) -> Optional[GrafoFundidoLLM]:
+    """GrafoFundidoLLM para config.MEDICO_FUNDIDO, ou None no modo "separado"."""
+    if config.MODO_GRAFO == "separado":
+        return None
+    if config.MODO_GRAFO != "fundido":
+        raise ValueError(f"MODO_GRAFO desconhecido: {config.MODO_GRAFO}")
+    if config.MODO_MEDICOS == "painel":
+        raise ValueError('MODO_GRAFO = "fundido" não pode ser combinado com MODO_MEDICOS = "painel"')
+    return GrafoFundidoLLM(construtor, medicos[config.MEDICO_FUNDIDO])
@@ -0,0 +1,165 @@
+# historico.py
+#
+# Escrita do output/historico_experimentos.csv.
+#
+# As linhas ficam num buffer e são gravadas (com flush + fsync) quando o
+# buffer chega a max_linhas, quando passam max_segundos desde a última
+# gravação, ou no fecho. Assim o ficheiro não é reaberto a cada caso e, se
+# o processo morrer, perdem-se no máximo as linhas do buffer.
+#
+# Ao abrir, lê as chaves (subject_id, hadm_id, versao_prompt) já gravadas:
+# uma nova execução com os mesmos prompts salta esses casos e continua onde
+# a anterior parou, sem repetir as chamadas ao modelo.
+#
+# ao_gravar(linhas) é chamado depois de cada gravação durável (ex.:
+# etapas.confirmar_reputacao, para a reputação só contar casos que já estão
+# no histórico).
+
+from typing import Any, Callable, List, Optional, Set, Tuple
+import atexit
+import csv
+import os
+import threading
+import time
+
+from etapas import CABECALHO_HISTORICO, preparar_ficheiro_historico
+from rastreio import span
+import config
+
+
+Chave = Tuple[str, str, str]
+
+
+def _reparar_ultima_linha(path_csv: str):
+    """Corta uma última linha incompleta (escrita interrompida a meio)."""
+    with open(path_csv, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        tamanho = f.tell()
+        if tamanho == 0:
+            return
+        f.seek(tamanho - 1)
+        if f.read(1) == b"\n":
+            return
+        # recuar até ao último fim de linha
+        bloco = 4096
+        pos = tamanho
+        while pos > 0:
+            ini = max(0, pos - bloco)
+            f.seek(ini)
+            dados = f.read(pos - ini)
+            i = dados.rfind(b"\n")
+            if i >= 0:
+                f.truncate(ini + i + 1)
+                print(f"[historico] linha incompleta removida do fim de {path_csv}")
+                return
+            pos = ini
+
+
+class HistoricoCSV:
+    """Sink do histórico com buffer, gravação durável e índice de casos concluídos."""
+
+    def __init__(
+        self,
+        path_csv: str,
+        versao_prompt: str = "",
+        max_linhas: Optional[int] = None,
+        max_segundos: Optional[float] = None,
+        ao_gravar: Optional[Callable[[List[List[Any]]], None]] = None,
+    ):
+        self.path_csv = path_csv
+        self.ao_gravar = ao_gravar
+        self.versao_prompt = versao_prompt
+        self.max_linhas = max_linhas or config.HISTORICO_MAX_LINHAS_BUFFER
+        self.max_segundos = max_segundos if max_segundos is not None else config.HISTORICO_MAX_SEGUNDOS_BUFFER
+
+        preparar_ficheiro_historico(path_csv)
+        _reparar_ultima_linha(path_csv)
+        self.concluidos: Set[Chave] = self._ler_concluidos()
+
+        self._buffer: List[List[Any]] = []
+        self._lock = threading.Lock()
+        self._ultima_gravacao = time.monotonic()
+        self._fechado = False
+
+        # gravação por tempo mesmo quando não chegam linhas novas
+        self._parar = threading.Event()
+        self._vigia = None
+        if self.max_segundos:
+            self._vigia = threading.Thread(target=self._vigiar, daemon=True)
+            self._vigia.start()
+        atexit.register(self.fechar)
+
+    # ---------------------- casos concluídos -------------------------
+
+    @staticmethod
+    def chave(subject_id, hadm_id, versao_prompt: str) -> Chave:
+        return (str(subject_id), str(hadm_id), str(versao_prompt))
+
+    def _ler_concluidos(self) -> Set[Chave]:
+        i_subj = CABECALHO_HISTORICO.index("subject_id")
+        i_hadm = CABECALHO_HISTORICO.index("hadm_id")
+        i_ver = CABECALHO_HISTORICO.index("versao_prompt")
+        concluidos = set()
+        with open(self.path_csv, "r", newline="", encoding="utf-8") as f:
+            leitor = csv.reader(f)
+            next(leitor, None)
+            for linha in leitor:
+                if len(linha) > i_ver:
+                    concluidos.add(self.chave(linha[i_subj], linha[i_hadm], linha[i_ver]))
+        return concluidos
+
+    def ja_concluido(self, caso) -> bool:
+        return self.chave(caso["subject_id"], caso["hadm_id"], self.versao_prompt) in self.concluidos
+
+    # ---------------------- escrita -------------------------
+
+    def acrescentar(self, linha: List[Any]):
+        i_subj = CABECALHO_HISTORICO.index("subject_id")
+        i_hadm = CABECALHO_HISTORICO.index("hadm_id")
+        with self._lock:
+            self._buffer.append(linha)
+            self.concluidos.add(self.chave(linha[i_subj], linha[i_hadm], self.versao_prompt))
+            gravar = (
+                len(self._buffer) >= self.max_linhas
+                or time.monotonic() - self._ultima_gravacao >= self.max_segundos
+            )
+            if gravar:
+                self._gravar()
+
+    def _gravar(self):
+        """Chamar com o lock adquirido."""
+        self._ultima_gravacao = time.monotonic()
+        if not self._buffer:
+            return
+        with span("gravar_historico", linhas=len(self._buffer)), open(
+            self.path_csv, "a", newline="", encoding="utf-8"
+        ) as f:
+            csv.writer(f).writerows(self._buffer)
+            f.flush()
+            os.fsync(f.fileno())
+        linhas, self._buffer = self._buffer, []
+        if self.ao_gravar is not None:
+            self.ao_gravar(linhas)
+
+    def descarregar(self):
+        with self._lock:
+            self._gravar()
+
+    def _vigiar(self):
+        while not self._parar.wait(self.max_segundos):
+            with self._lock:
+                if self._buffer and time.monotonic() - self._ultima_gravacao >= self.max_segundos:
+                    self._gravar()
+
+    def fechar(self):
+        if self._fechado:
+            return
+        self._fechado = True
+        self._parar.set()
+        self.descarregar()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
@@ -0,0 +1,147 @@
+# indice_icd.py
+#
+# Índice do vocabulário ICD-9 (D_ICD_DIAGNOSES_filtred.csv) para passar de
+# um nome de diagnóstico em texto livre (como o devolvido pelos médicos)
+# para os códigos ICD-9 mais prováveis.
+#
+# Cada código é representado pelo vetor TF-IDF (vetorizacao.py) de
+# SHORT_TITLE + LONG_TITLE. O índice é invertido (dimensão -> códigos), por
+# isso uma consulta só toca nos códigos que partilham n-gramas com o texto.
+# As consultas repetidas (o mesmo nome aparece em muitos casos) ficam em
+# memória com lru_cache.
+
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+import threading
+
+import numpy as np
+import pandas as pd
+
+from vetorizacao import VetorizadorHash
+import config
+
+
+def categoria_icd9(codigo: str) -> str:
+    """Categoria de 3 dígitos (4 caracteres nos códigos E, ex.: E8889 -> E888)."""
+    codigo = str(codigo).replace(".", "").strip().upper()
+    return codigo[:4] if codigo.startswith("E") else codigo[:3]
+
+
+def codigos_equivalentes(a: Optional[str], b: Optional[str], criterio: str = "categoria") -> bool:
+    """Compara dois códigos ICD-9 por código exato ("codigo") ou pela categoria ("categoria")."""
+    if not a or not b:
+        return False
+    if criterio == "codigo":
+        return str(a).replace(".", "").upper() == str(b).replace(".", "").upper()
+    if criterio == "categoria":
+        return categoria_icd9(a) == categoria_icd9(b)
+    raise ValueError(f"critério desconhecido: {criterio}")
+
+
+class IndiceICD:
+    def __init__(
+        self,
+        codigos: List[str],
+        titulos_curtos: List[str],
+        titulos_longos: List[str],
+        dim: int = 1 << 18,
+        n: int = 3,
+        tamanho_memo: int = 4096,
+    ):
+        self.codigos = np.asarray(codigos, dtype=object)
+        self.titulos = list(titulos_longos)
+        documentos = [f"{c} {l}" for c, l in zip(titulos_curtos, titulos_longos)]
+
+        self.vetorizador = VetorizadorHash(dim=dim, n=n).ajustar(documentos)
+
+        # índice invertido: triplos (dimensão, código, peso) ordenados por dimensão
+        dims, docs, pesos = [], [], []
+        for i, doc in enumerate(documentos):
+            ids, p = self.vetorizador.transformar(doc)
+            dims.append(ids)
+            docs.append(np.full(len(ids), i, dtype=np.int32))
+            pesos.append(p)
+        dims = np.concatenate(dims) if dims else np.empty(0, np.int64)
+        ordem = np.argsort(dims, kind="stable")
+        self._dims = dims[ordem]
+        self._docs = np.concatenate(docs)[ordem] if docs else np.empty(0, np.int32)
+        self._pesos = np.concatenate(pesos)[ordem] if pesos else np.empty(0, np.float32)
+
+        # títulos exatos -> código (os rótulos do MIMIC são LONG_TITLE)
+        self._por_titulo: Dict[str, str] = {}
+        for codigo, curto, longo in zip(codigos, titulos_curtos, titulos_longos):
+            self._por_titulo.setdefault(str(curto).strip().lower(), codigo)
+            self._por_titulo[str(longo).strip().lower()] = codigo
+
+        self._resolver_memo = lru_cache(maxsize=tamanho_memo)(self._resolver)
+
+    @classmethod
+    def de_csv(cls, path: str = None, **kwargs) -> "IndiceICD":
+        if path is None:
+            path = config.CAMINHO_D_ICD_DIAGNOSES
+        df = pd.read_csv(path, dtype=str, usecols=["ICD9_CODE", "SHORT_TITLE", "LONG_TITLE"])
+        df = df.dropna(subset=["ICD9_CODE"]).fillna("")
+        return cls(
+            df["ICD9_CODE"].tolist(),
+            df["SHORT_TITLE"].tolist(),
+            df["LONG_TITLE"].tolist(),
+            **kwargs,
+        )
+
+    def __len__(self) -> int:
+        return len(self.codigos)
+
+    # ---------------------- consultas -------------------------
+
+    def pontuacoes(self, texto: str) -> np.ndarray:
+        """Similaridade (cosseno) do texto com todos os códigos do vocabulário."""
+        q_ids, q_pesos = self.vetorizador.transformar(texto)
+        ini = np.searchsorted(self._dims, q_ids, side="left")
+        fim = np.searchsorted(self._dims, q_ids, side="right")
+        tamanhos = fim - ini
+        total = int(tamanhos.sum())
+        if total == 0:
+            return np.zeros(len(self.codigos), dtype=np.float32)
+        # posições de todas as entradas das listas invertidas tocadas, sem ciclo Python
+        base = np.repeat(ini - (np.cumsum(tamanhos) - tamanhos), tamanhos)
+        pos = base + np.arange(total)
+        q_rep = np.repeat(q_pesos, tamanhos)
+        return np.bincount(
+            self._docs[pos], weights=self._pesos[pos] * q_rep, minlength=len(self.codigos)
+        )
+
+    def _resolver(self, texto: str, k: int) -> Tuple[Tuple[str, float], ...]:
+        s = self.pontuacoes(texto)
+        k = min(k, len(s))
+        if k <= 0:
+            return ()
+        top = np.argpartition(-s, k - 1)[:k]
+        top = top[np.argsort(-s[top], kind="stable")]
+        return tuple((self.codigos[i], float(s[i])) for i in top if s[i] > 0)
+
+    def resolver(self, texto: str, k: int = 5) -> Tuple[Tuple[str, float], ...]:
+        """Top-k (código, similaridade) para um diagnóstico em texto livre."""
+        return self._resolver_memo(str(texto or "").strip().lower(), k)
+
+    def codigo_do_rotulo(self, rotulo: str) -> Optional[str]:
+        """Código de um rótulo do MIMIC (título exato; senão o código mais parecido)."""
+        if not rotulo:
+            return None
+        chave = str(rotulo).strip().lower()
+        if chave in self._por_titulo:
+            return self._por_titulo[chave]
+        top = self.resolver(chave, k=1)
+        return top[0][0] if top else None
+
+
+_indice_global: Optional[IndiceICD] = None
+_lock_global = threading.Lock()
+
+
+def obter_indice_icd() -> IndiceICD:
+    """Índice único do processo, construído a partir do config.py na primeira chamada."""
+    global _indice_global
+    with _lock_global:
+        if _indice_global is None:
+            _indice_global = IndiceICD.de_csv(config.CAMINHO_D_ICD_DIAGNOSES)
+        return _indice_global
@@ -0,0 +1,266 @@
+# json_incremental.py
+#
+# Parsing incremental do JSON devolvido pelo LLM.
+#
+# O texto chega aos pedaços (streaming, ver ClienteLLM.invocar(ao_pedaco=...))
+# e é percorrido uma única vez:
+#   - cada objeto de uma lista com chave em `chaves` (ex.: "diagnoses",
+#     "nodes", "edges") é entregue a `ao_item` assim que fecha;
+#   - guarda-se o último ponto em que o texto recebido forma um prefixo
+#     válido (fim de um valor completo) e os contentores ainda abertos; dentro
+#     dos itens dessas listas só conta o item completo.
+#
+# concluir() devolve o objeto de topo. Se a resposta vier truncada (limite de
+# tokens, ligação cortada) ou com lixo no fim, o JSON é reparado a partir do
+# que chegou: corta-se no último valor completo e fecham-se as listas e os
+# objetos abertos. Texto antes do primeiro "{" (ex.: ```json) é ignorado.
+#
+# preparar_parser() devolve o par (ao_pedaco, parser) para ClienteLLM.invocar;
+# com config.STREAMING_JSON = False a resposta só é lida no fim (com a mesma
+# reparação). Respostas reparadas não ficam na cache em disco.
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import json
+import time
+
+import config
+
+
+class _Contentor:
+    __slots__ = ("abre", "chave", "inicio", "espera_chave", "chave_pendente")
+
+    def __init__(self, abre: str, chave: Optional[str], inicio: int):
+        self.abre = abre  # "{" ou "["
+        self.chave = chave  # chave deste contentor no objeto pai (None em listas)
+        self.inicio = inicio
+        self.espera_chave = abre == "{"
+        self.chave_pendente: Optional[str] = None
+
+
+_FECHA = {"{": "}", "[": "]"}
+
+
+class ParserJSONIncremental:
+    def __init__(
+        self,
+        chaves: Sequence[str] = (),
+        ao_item: Optional[Callable[[str, Any], None]] = None,
+    ):
+        self.chaves = set(chaves)
+        self.ao_item = ao_item
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self.texto = ""
+        self.itens: Dict[str, List[Any]] = {c: [] for c in self.chaves}
+        self.reparado = False
+        self.instante_primeiro_item: Optional[float] = None
+        self._pos = 0
+        self._raiz = -1  # índice do "{" de topo
+        self._fim = -1  # índice a seguir ao "}" de topo
+        self._pilha: List[_Contentor] = []
+        self._em_string = False
+        self._escape = False
+        self._inicio_string = 0
+        self._dentro_item = 0  # nº de objetos abertos dentro de itens de `chaves`
+        # último prefixo válido: (posição de corte, fechos a acrescentar)
+        self._corte: Tuple[int, str] = (-1, "")
+
+    # ---------------------- leitura -------------------------
+
+    @property
+    def completo(self) -> bool:
+        return self._fim >= 0
+
+    def alimentar(self, pedaco: str):
+        if not pedaco:
+            return
+        self.texto += pedaco
+        if self.completo:
+            return
+        texto = self.texto
+        i = self._pos
+        n = len(texto)
+        while i < n:
+            c = texto[i]
+            if self._em_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._em_string = False
+                    self._fim_string(texto, i)
+            elif self._raiz < 0:
+                if c == "{":
+                    self._raiz = i
+                    self._abrir(c, i)
+            elif c == '"':
+                self._em_string = True
+                self._inicio_string = i
+            elif c in "{[":
+                self._abrir(c, i)
+            elif c in "}]":
+                if self._fechar(texto, i):
+                    self._fim = i + 1
+                    break
+            elif c == ",":
+                topo = self._pilha[-1]
+                self._marcar_corte(i)
+                if topo.abre == "{":
+                    topo.espera_chave = True
+            elif c == ":":
+                self._pilha[-1].espera_chave = False
+            i += 1
+        self._pos = i
+
+    def _abrir(self, c: str, i: int):
+        chave = None
+        if self._pilha:
+            pai = self._pilha[-1]
+            if pai.abre == "{":
+                chave, pai.chave_pendente = pai.chave_pendente, None
+        if self._dentro_item or (c == "{" and self._e_item()):
+            self._dentro_item += 1
+        self._pilha.append(_Contentor(c, chave, i))
+        self._marcar_corte(i + 1)
+
+    def _fechar(self, texto: str, i: int) -> bool:
+        """Fecha o contentor do topo; devolve True quando fecha o objeto de topo."""
+        contentor = self._pilha.pop()
+        if not self._pilha:
+            return True
+        if self._dentro_item:
+            self._dentro_item -= 1
+        pai = self._pilha[-1]
+        if contentor.abre == "{" and pai.abre == "[" and pai.chave in self.chaves:
+            self._emitir(pai.chave, texto[contentor.inicio : i + 1])
+        self._marcar_corte(i + 1)
+        return False
+
+    def _fim_string(self, texto: str, i: int):
+        topo = self._pilha[-1]
+        if topo.abre == "{" and topo.espera_chave:
+            try:
+                topo.chave_pendente = json.loads(texto[self._inicio_string : i + 1])
+            except json.JSONDecodeError:
+                topo.chave_pendente = None
+        else:
+            self._marcar_corte(i + 1)
+
+    def _e_item(self) -> bool:
+        """O próximo valor é um item de uma lista com chave em `chaves`."""
+        return bool(self._pilha) and self._pilha[-1].abre == "[" and self._pilha[-1].chave in self.chaves
+
+    def _marcar_corte(self, pos: int):
+        # dentro de um item (nó, aresta, diagnóstico) só conta o item inteiro:
+        # um item truncado é descartado em vez de ficar a meio
+        if self._dentro_item:
+            return
+        fechos = "".join(_FECHA[c.abre] for c in reversed(self._pilha))
+        self._corte = (pos, fechos)
+
+    def _emitir(self, chave: str, texto_item: str):
+        try:
+            item = json.loads(texto_item)
+        except json.JSONDecodeError:
+            return
+        if self.instante_primeiro_item is None:
+            self.instante_primeiro_item = time.perf_counter()
+        self.itens[chave].append(item)
+        if self.ao_item is not None:
+            self.ao_item(chave, item)
+
+    # ---------------------- resultado -------------------------
+
+    def concluir(self, texto_final: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Objeto de topo da resposta (reparado se vier incompleto; {} se não
+        houver nenhum "{"). Se `texto_final` for diferente do texto recebido
+        (nova tentativa, resposta da cache), é lido de novo.
+        """
+        if texto_final is not None and texto_final != self.texto:
+            self._reiniciar()
+            self.alimentar(texto_final)
+        if self._raiz < 0:
+            self.reparado = True  # nenhum objeto na resposta
+            return {}
+        if self.completo:
+            try:
+                return json.loads(self.texto[self._raiz : self._fim])
+            except json.JSONDecodeError:
+                pass  # ex.: vírgula a mais; segue para a reparação
+        pos, fechos = self._corte
+        self.reparado = True
+        try:
+            return json.loads(self.texto[self._raiz : pos] + fechos)
+        except json.JSONDecodeError:
+            return {}
+
+
+def _avisar_reparacao(parser: ParserJSONIncremental, dados: Any):
+    if parser.reparado and dados:
+        print("[json] resposta incompleta ou com texto a mais: JSON reparado")
+
+
+def _ler_json(texto: str, chaves: Sequence[str] = ()) -> Tuple[Dict[str, Any], bool]:
+    """(objeto de topo, True se foi preciso reparar o texto)."""
+    try:
+        dados = json.loads(texto)
+        if isinstance(dados, dict):
+            return dados, False
+    except (json.JSONDecodeError, TypeError):
+        pass
+    parser = ParserJSONIncremental(chaves)
+    dados = parser.concluir(str(texto))
+    _avisar_reparacao(parser, dados)
+    return (dados if isinstance(dados, dict) else {}), parser.reparado
+
+
+def carregar_json(texto: str, chaves: Sequence[str] = ()) -> Dict[str, Any]:
+    """json.loads tolerante: ignora texto à volta e repara respostas truncadas."""
+    return _ler_json(texto, chaves)[0]
+
+
+class ParserResposta:
+    """
+    Parser devolvido por preparar_parser. Depois de cada chamada, `reparado`
+    indica se a resposta teve de ser reparada (o ClienteLLM não a guarda na
+    cache em disco).
+    """
+
+    def __init__(
+        self,
+        chaves: Sequence[str],
+        converter: Callable[[Dict[str, Any]], Any],
+        incremental: Optional[ParserJSONIncremental] = None,
+    ):
+        self.chaves = chaves
+        self.converter = converter
+        self.incremental = incremental
+        self.reparado = False
+
+    def __call__(self, texto: str) -> Any:
+        if self.incremental is None:
+            dados, self.reparado = _ler_json(texto, self.chaves)
+            return self.converter(dados)
+        dados = self.incremental.concluir(texto)
+        self.reparado = self.incremental.reparado
+        _avisar_reparacao(self.incremental, dados)
+        return self.converter(dados if isinstance(dados, dict) else {})
+
+
+def preparar_parser(
+    chaves: Sequence[str],
+    converter: Callable[[Dict[str, Any]], Any],
+    ao_item: Optional[Callable[[str, Any], None]] = None,
+) -> Tuple[Optional[Callable[[str], None]], ParserResposta]:
+    """
+    (ao_pedaco, parser) para ClienteLLM.invocar/ainvocar. `converter` recebe
+    o objeto de topo já reparado. Um par por pedido: o parser incremental
+    guarda o estado da resposta.
+    """
+    if not config.STREAMING_JSON:
+        return None, ParserResposta(chaves, converter)
+    incremental = ParserJSONIncremental(chaves, ao_item)
+    return incremental.alimentar, ParserResposta(chaves, converter, incremental)
@@ -0,0 +1,186 @@
+# limitador.py
+#
+# Limitador de taxa partilhado por todas as chamadas ao modelo
+# (ConstrutorGrafoLLM e MedicoLLM, através do ClienteLLM).
+#
+# Usa dois "token buckets":
+#   - pedidos por minuto (RPM)
+#   - tokens por minuto (TPM), com uma estimativa do tamanho do pedido
+#
+# Quando a API responde 429, o limitador bloqueia todos os pedidos durante
+# o tempo indicado em Retry-After e reduz temporariamente o ritmo
+# (diminuição multiplicativa), voltando a subir aos poucos a cada sucesso.
+
+from typing import Optional
+import asyncio
+import threading
+import time
+
+import config
+
+
+class _Balde:
+    """Token bucket simples: capacidade máxima e reposição contínua por segundo."""
+
+    def __init__(self, capacidade: float):
+        self.capacidade = float(capacidade)
+        self.disponivel = float(capacidade)
+
+    def repor(self, segundos: float, fator: float):
+        taxa = self.capacidade / 60.0 * fator
+        self.disponivel = min(self.capacidade, self.disponivel + segundos * taxa)
+
+    def espera_para(self, quantidade: float, fator: float) -> float:
+        """Segundos até haver `quantidade` disponível (0 se já houver)."""
+        falta = quantidade - self.disponivel
+        if falta <= 0:
+            return 0.0
+        taxa = self.capacidade / 60.0 * fator
+        return falta / taxa
+
+
+class LimitadorTaxa:
+    """
+    Limitador RPM + TPM seguro entre threads e utilizável em código
+    síncrono (adquirir) e assíncrono (aadquirir).
+    """
+
+    def __init__(
+        self,
+        rpm: float,
+        tpm: Optional[float] = None,
+        fator_minimo: float = 0.25,
+    ):
+        self.rpm = float(rpm)
+        self.tpm = float(tpm) if tpm else None
+        self.fator_minimo = fator_minimo
+
+        self._pedidos = _Balde(self.rpm)
+        self._tokens = _Balde(self.tpm) if self.tpm else None
+        self._fator = 1.0  # 1.0 = ritmo configurado; < 1.0 depois de 429s
+        self._bloqueado_ate = 0.0
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    # ---------------------- reserva de capacidade -------------------------
+
+    def _atualizar(self, agora: float):
+        decorrido = agora - self._ultimo
+        self._ultimo = agora
+        if decorrido > 0:
+            self._pedidos.repor(decorrido, self._fator)
+            if self._tokens is not None:
+                self._tokens.repor(decorrido, self._fator)
+
+    def _tentar_reservar(self, tokens: int) -> float:
+        """
+        Tenta reservar 1 pedido + `tokens`. Devolve 0.0 se conseguiu, ou o
+        número de segundos a esperar antes de voltar a tentar.
+        """
+        with self._lock:
+            agora = time.monotonic()
+            self._atualizar(agora)
+
+            if agora < self._bloqueado_ate:
+                return self._bloqueado_ate - agora
+
+            # um pedido maior que o balde inteiro nunca caberia: limitar à capacidade
+            if self._tokens is not None:
+                tokens = min(tokens, self._tokens.capacidade)
+
+            espera = self._pedidos.espera_para(1.0, self._fator)
+            if self._tokens is not None:
+                espera = max(espera, self._tokens.espera_para(tokens, self._fator))
+            if espera > 0:
+                return espera
+
+            self._pedidos.disponivel -= 1.0
+            if self._tokens is not None:
+                self._tokens.disponivel -= tokens
+            return 0.0
+
+    def adquirir(self, tokens_estimados: int = 0) -> float:
+        """Bloqueia até haver orçamento. Devolve o tempo total de espera (s)."""
+        total = 0.0
+        while True:
+            espera = self._tentar_reservar(tokens_estimados)
+            if espera <= 0:
+                return total
+            time.sleep(espera)
+            total += espera
+
+    async def aadquirir(self, tokens_estimados: int = 0) -> float:
+        """Versão assíncrona de adquirir()."""
+        total = 0.0
+        while True:
+            espera = self._tentar_reservar(tokens_estimados)
+            if espera <= 0:
+                return total
+            await asyncio.sleep(espera)
+            total += espera
+
+    def tentar_adquirir(self, tokens_estimados: int = 0) -> bool:
+        """
+        Reserva sem esperar, só se houver orçamento livre neste instante (e o
+        ritmo não estiver reduzido por 429s). Usado pelos pedidos de
+        cobertura, que nunca devem atrasar os pedidos normais.
+        """
+        if self._fator < 1.0:
+            return False
+        return self._tentar_reservar(tokens_estimados) <= 0
+
+    # ---------------------- feedback da API -------------------------
+
+    def ajustar_tokens(self, estimados: int, reais: int):
+        """Corrige o balde de tokens com o consumo real devolvido pela API."""
+        if self._tokens is None or not reais:
+            return
+        with self._lock:
+            self._tokens.disponivel -= reais - estimados
+
+    def registar_sucesso(self):
+        """Recuperação aditiva do ritmo depois de 429s."""
+        if self._fator >= 1.0:
+            return
+        with self._lock:
+            self._fator = min(1.0, self._fator + 0.05)
+
+    def registar_limite_excedido(self, retry_after: Optional[float] = None):
+        """
+        Chamado quando a API devolve 429: pausa todos os pedidos durante
+        retry_after segundos (ou até haver um pedido disponível ao ritmo
+        reduzido) e corta o ritmo para metade.
+        """
+        with self._lock:
+            agora = time.monotonic()
+            self._fator = max(self.fator_minimo, self._fator * 0.5)
+            if retry_after is None:
+                retry_after = 60.0 / (self.rpm * self._fator)
+            self._bloqueado_ate = max(self._bloqueado_ate, agora + retry_after)
+            # o pedido que falhou já gastou capacidade do lado da API
+            self._pedidos.disponivel = min(self._pedidos.disponivel, 0.0)
+
+    @property
+    def fator(self) -> float:
+        return self._fator
+
+
+_limitador_global: Optional[LimitadorTaxa] = None
+_lock_global = threading.Lock()
+
+
+def obter_limitador() -> LimitadorTaxa:
+    """Devolve o limitador único do processo (criado a partir do config.py)."""
+    global _limitador_global
+    with _lock_global:
+        if _limitador_global is None:
+            _limitador_global = LimitadorTaxa(
+                rpm=config.LIMITE_RPM,
+                tpm=config.LIMITE_TPM,
+            )
+        return _limitador_global
+
+
+def estimar_tokens(texto: str) -> int:
+    """Estimativa grosseira (~4 caracteres por token em inglês)."""
+    return len(texto) // 4 + 1
@@ -0,0 +1,442 @@
+# llm_falso.py
+#
+# Modelo de chat falso, usado no lugar do ChatOpenAI com config.LLM_FALSO
+# (ver cliente_llm.criar_modelo_chat). Não precisa de chave nem de rede:
+# serve para testar e medir a orquestração (main.py, pipeline_async.py)
+# com resultados repetíveis (analise/benchmark_pipeline.py).
+#
+#   - O tipo de pedido (grafo, médico, painel, grafo + médico) é reconhecido
+#     pelos prompts. A resposta é JSON no esquema pedido, derivado da nota:
+#     os termos do LEXICO presentes no texto dão os nós e as arestas, e as
+#     REGRAS com mais termos presentes dão os diagnósticos.
+#   - Latência: lognormal (LLM_FALSO_MEDIANA_S, LLM_FALSO_SIGMA) até ao
+#     primeiro token, mais LLM_FALSO_S_POR_TOKEN por token de resposta.
+#   - usage_metadata com tokens de prompt e de resposta, e uma cache de
+#     prompts simulada (prefixos de pelo menos 1024 tokens já vistos, em
+#     blocos de 128 tokens, como na API).
+#   - Com as probabilidades configuradas: 429 com Retry-After, e JSON
+#     malformado (truncado ou com texto à volta).
+#
+# Os sorteios dependem da semente, das mensagens e do nº de vezes que o
+# mesmo pedido já foi feito: duas execuções iguais dão os mesmos resultados.
+#
+# casos_sinteticos() gera notas com termos do léxico e o diagnóstico
+# verdadeiro correspondente (as notas MIMIC não estão no repositório).
+
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+
+import numpy as np
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from limitador import estimar_tokens
+import config
+
+
+# termo na nota -> (tipo do nó, rótulo)
+LEXICO: Dict[str, Tuple[str, str]] = {
+    "fever": ("symptom", "fever"),
+    "cough": ("symptom", "productive cough"),
+    "dyspnea": ("symptom", "dyspnea"),
+    "chest pain": ("symptom", "chest pain"),
+    "dysuria": ("symptom", "dysuria"),
+    "confusion": ("symptom", "confusion"),
+    "edema": ("sign", "peripheral edema"),
+    "hypotension": ("sign", "hypotension"),
+    "tachycardia": ("sign", "tachycardia"),
+    "irregular rhythm": ("sign", "irregular heart rhythm"),
+    "melena": ("sign", "melena"),
+    "oliguria": ("sign", "oliguria"),
+    "smoker": ("habit", "smoking"),
+    "alcohol": ("habit", "alcohol use"),
+    "diabetes": ("comorbidity", "diabetes mellitus"),
+    "hypertension": ("comorbidity", "hypertension"),
+    "copd": ("comorbidity", "COPD"),
+    "elevated troponin": ("test", "elevated troponin"),
+    "elevated creatinine": ("test", "elevated creatinine"),
+    "infiltrate": ("test", "infiltrate on chest x-ray"),
+    "positive blood cultures": ("test", "positive blood cultures"),
+    "antibiotics": ("treatment", "antibiotics"),
+    "diuretics": ("treatment", "diuretics"),
+}
+
+# (diagnóstico = LONG_TITLE, código ICD-9, hipótese intermédia, termos que o suportam)
+REGRAS: List[Tuple[str, str, str, Tuple[str, ...]]] = [
+    ("Unspecified septicemia", "0389", "systemic infection",
+     ("fever", "hypotension", "positive blood cultures")),
+    ("Pneumonia, organism unspecified", "486", "respiratory infection",
+     ("cough", "fever", "infiltrate")),
+    ("Congestive heart failure, unspecified", "4280", "cardiac decompensation",
+     ("dyspnea", "edema", "diuretics")),
+    ("Subendocardial infarction, initial episode of care", "41071", "acute coronary syndrome",
+     ("chest pain", "elevated troponin", "smoker")),
+    ("Acute kidney failure, unspecified", "5849", "renal dysfunction",
+     ("oliguria", "elevated creatinine", "diabetes")),
+    ("Atrial fibrillation", "42731", "arrhythmia",
+     ("irregular rhythm", "tachycardia", "hypertension")),
+    ("Obstructive chronic bronchitis with (acute) exacerbation", "49121", "airway obstruction",
+     ("copd", "dyspnea", "cough")),
+    ("Hemorrhage of gastrointestinal tract, unspecified", "5789", "gastrointestinal bleeding",
+     ("melena", "tachycardia", "alcohol")),
+    ("Urinary tract infection, site not specified", "5990", "urinary infection",
+     ("dysuria", "fever", "antibiotics")),
+]
+
+_RELACAO_DOENTE = {
+    "symptom": "has_symptom",
+    "sign": "has_sign",
+    "habit": "has_risk_factor",
+    "comorbidity": "has_comorbidity",
+    "test": "received_test",
+    "treatment": "received_treatment",
+}
+
+# a cache de prompts da API começa nos 1024 tokens e cresce em blocos de 128
+_TOKENS_MIN_CACHE = 1024
+_TOKENS_BLOCO_CACHE = 128
+_CARACTERES_POR_TOKEN = 4  # mesma aproximação que limitador.estimar_tokens
+_RETRY_AFTER_S = 1.0
+_TOKENS_POR_PEDACO = 16  # tamanho de cada pedaço em streaming
+
+_RE_NOTA = re.compile(r"Clinical note:\n(.*?)(?:\n\nKnowledge graph|\n\nReturn ONLY|\Z)", re.S)
+_RE_IDS_PAINEL = re.compile(r"doctor ids \(([^)]*)\)")
+
+
+class ErroLimiteFalso(Exception):
+    """429 simulado, com os atributos que o cliente_llm lê (status_code, code, headers)."""
+
+    status_code = 429
+    code = "rate_limit_exceeded"
+
+    def __init__(self, retry_after: float):
+        super().__init__("Rate limit reached (simulado)")
+        self.response = SimpleNamespace(headers={"retry-after-ms": str(int(retry_after * 1000))})
+
+
+@dataclass
+class EstatisticasFalso:
+    """Contagens de todos os modelos falsos do processo."""
+    pedidos: int = 0
+    erros_429: int = 0
+    json_malformado: int = 0
+    tokens_prompt: int = 0
+    tokens_resposta: int = 0
+    tokens_cache: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def registar(self, pedido: "_Pedido"):
+        with self._lock:
+            self.pedidos += 1
+            if pedido.erro is not None:
+                self.erros_429 += 1
+                return
+            self.json_malformado += int(pedido.malformado)
+            self.tokens_prompt += pedido.uso["input_tokens"]
+            self.tokens_resposta += pedido.uso["output_tokens"]
+            self.tokens_cache += pedido.uso["input_token_details"]["cache_read"]
+
+    def como_dict(self) -> Dict[str, int]:
+        return {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
+
+
+estatisticas = EstatisticasFalso()
+
+# prefixos de prompt já vistos (a cache de prompts da API é partilhada pela conta)
+_prefixos_vistos = set()
+_lock_prefixos = threading.Lock()
+
+
+# ---------------------- conteúdo das respostas -------------------------
+
+
+def termos_da_nota(nota: str) -> List[str]:
+    """Termos do LEXICO presentes na nota, pela ordem do léxico."""
+    texto = nota.lower()
+    return [termo for termo in LEXICO if termo in texto]
+
+
+def _regras_ativas(termos: List[str]) -> List[Tuple[float, int]]:
+    """(fração dos termos presentes, índice da regra), da mais para a menos suportada."""
+    presentes = set(termos)
+    ativas = []
+    for i, (_, _, _, suporte) in enumerate(REGRAS):
+        fracao = sum(1 for t in suporte if t in presentes) / len(suporte)
+        if fracao > 0:
+            ativas.append((fracao, i))
+    ativas.sort(key=lambda x: (-x[0], x[1]))
+    return ativas
+
+
+def grafo_da_nota(nota: str) -> Dict[str, Any]:
+    termos = termos_da_nota(nota)
+    nodes = [{"id": "n0", "label": "patient", "type": "patient"}]
+    edges = []
+    id_termo = {}
+    for termo in termos:
+        tipo, rotulo = LEXICO[termo]
+        id_termo[termo] = f"n{len(nodes)}"
+        nodes.append({"id": id_termo[termo], "label": rotulo, "type": tipo})
+        edges.append({"source": "n0", "target": id_termo[termo], "relation": _RELACAO_DOENTE[tipo]})
+    for _, i in _regras_ativas(termos):
+        nome, _, hipotese, suporte = REGRAS[i]
+        id_hip, id_diag = f"h{i}", f"d{i}"
+        nodes.append({"id": id_hip, "label": hipotese, "type": "intermediate_hypothesis"})
+        nodes.append({"id": id_diag, "label": nome, "type": "diagnosis"})
+        for termo in suporte:
+            if termo in id_termo:
+                edges.append(
+                    {"source": id_termo[termo], "target": id_hip, "relation": "suggests_hypothesis"}
+                )
+        edges.append({"source": id_hip, "target": id_diag, "relation": "supports_diagnosis"})
+    return {"nodes": nodes, "edges": edges}
+
+
+def diagnosticos_da_nota(nota: str, explorador: bool = False) -> List[Dict[str, Any]]:
+    """Até 2 diagnósticos (5 no perfil explorador), com probabilidade pela fração de termos."""
+    termos = termos_da_nota(nota)
+    ativas = _regras_ativas(termos)[: 5 if explorador else 2]
+    if not ativas:
+        ativas = [(0.0, 0)]  # nota sem termos conhecidos: o diagnóstico mais comum
+    diagnoses = []
+    for fracao, i in ativas:
+        nome, _, hipotese, suporte = REGRAS[i]
+        presentes = [t for t in suporte if t in termos]
+        diagnoses.append(
+            {
+                "name": nome,
+                "probability": round(0.1 + 0.8 * fracao, 2),
+                "justification": f"{hipotese} supported by {', '.join(presentes) or 'no specific findings'}",
+            }
+        )
+    return diagnoses
+
+
+def _tipo_pedido(texto: str) -> str:
+    if "PANEL MODE" in texto:
+        return "painel"
+    if "SECOND TASK: DIAGNOSIS" in texto:
+        return "fundido"
+    if "knowledge extraction" in texto:
+        return "grafo"
+    return "medico"
+
+
+def resposta_para(mensagens: List[Any]) -> Dict[str, Any]:
+    """Objeto JSON (válido) que responde às mensagens."""
+    texto = "\n".join(str(m.content) for m in mensagens)
+    notas = _RE_NOTA.findall(texto)
+    nota = notas[-1] if notas else texto
+    tipo = _tipo_pedido(texto)
+    if tipo == "grafo":
+        return grafo_da_nota(nota)
+    if tipo == "fundido":
+        return {**grafo_da_nota(nota), "diagnoses": diagnosticos_da_nota(nota, "EXPLORATORY" in texto)}
+    if tipo == "painel":
+        encontrados = _RE_IDS_PAINEL.findall(texto)
+        ids = re.findall(r'"([^"]+)"', encontrados[0]) if encontrados else ["A", "B"]
+        # no painel os perfis vêm pela ordem dos médicos: o primeiro é o conservador
+        return {
+            mid: {"diagnoses": diagnosticos_da_nota(nota, explorador=k > 0)}
+            for k, mid in enumerate(ids)
+        }
+    return {"diagnoses": diagnosticos_da_nota(nota, "EXPLORATORY" in texto)}
+
+
+# ---------------------- simulação do pedido -------------------------
+
+
+@dataclass
+class _Pedido:
+    texto: str = ""
+    ttft: float = 0.0
+    geracao: float = 0.0
+    uso: Dict[str, Any] = field(default_factory=dict)
+    malformado: bool = False
+    erro: Optional[Exception] = None
+
+    @property
+    def latencia(self) -> float:
+        return self.ttft + self.geracao
+
+
+def _tokens_em_cache(mensagens: List[Any]) -> int:
+    """Tokens do maior prefixo já visto (>= 1024 tokens, em blocos de 128)."""
+    texto = "".join(f"<{m.type}>{m.content}" for m in mensagens).encode("utf-8")
+    passo = _TOKENS_BLOCO_CACHE * _CARACTERES_POR_TOKEN
+    inicio = _TOKENS_MIN_CACHE * _CARACTERES_POR_TOKEN
+    if len(texto) < inicio:
+        return 0
+    h = hashlib.sha256(texto[:inicio])
+    prefixos = [h.copy().hexdigest()]
+    for pos in range(inicio, len(texto) - passo + 1, passo):
+        h.update(texto[pos : pos + passo])
+        prefixos.append(h.copy().hexdigest())
+    with _lock_prefixos:
+        vistos = 0
+        for p in prefixos:
+            if p not in _prefixos_vistos:
+                break
+            vistos += 1
+        _prefixos_vistos.update(prefixos)
+    if vistos == 0:
+        return 0
+    return _TOKENS_MIN_CACHE + (vistos - 1) * _TOKENS_BLOCO_CACHE
+
+
+def _malformar(texto: str, rng: np.random.Generator) -> str:
+    if rng.random() < 0.5:
+        # truncado (limite de tokens, ligação cortada)
+        return texto[: int(len(texto) * rng.uniform(0.5, 0.95))]
+    return f"```json\n{texto}\n```\nLet me know if you need anything else."
+
+
+class ModeloFalso:
+    """Substituto do ChatOpenAI (invoke/ainvoke/stream/astream) para testes e benchmarks."""
+
+    def __init__(self, model: str = "falso", temperature: float = 0.0, **_):
+        self.model_name = model
+        self.temperature = temperature
+        self._vezes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _rng(self, mensagens: List[Any]) -> np.random.Generator:
+        partes = [str(config.LLM_FALSO_SEMENTE), self.model_name, str(self.temperature)]
+        partes += [f"{m.type}:{m.content}" for m in mensagens]
+        chave = hashlib.sha256("\x1f".join(partes).encode("utf-8")).hexdigest()
+        with self._lock:
+            vez = self._vezes.get(chave, 0)
+            self._vezes[chave] = vez + 1
+        return np.random.default_rng([int(chave[:15], 16), vez])
+
+    def _preparar(self, mensagens: List[Any]) -> _Pedido:
+        rng = self._rng(mensagens)
+        pedido = _Pedido()
+        if rng.random() < config.LLM_FALSO_PROB_429:
+            pedido.erro = ErroLimiteFalso(_RETRY_AFTER_S)
+            estatisticas.registar(pedido)
+            return pedido
+
+        texto = json.dumps(resposta_para(mensagens), ensure_ascii=False)
+        if rng.random() < config.LLM_FALSO_PROB_JSON_INVALIDO:
+            texto = _malformar(texto, rng)
+            pedido.malformado = True
+        tokens_prompt = sum(estimar_tokens(str(m.content)) for m in mensagens)
+        tokens_resposta = estimar_tokens(texto)
+        pedido.texto = texto
+        pedido.ttft = config.LLM_FALSO_MEDIANA_S * float(np.exp(config.LLM_FALSO_SIGMA * rng.standard_normal()))
+        pedido.geracao = config.LLM_FALSO_S_POR_TOKEN * tokens_resposta
+        pedido.uso = {
+            "input_tokens": tokens_prompt,
+            "output_tokens": tokens_resposta,
+            "total_tokens": tokens_prompt + tokens_resposta,
+            "input_token_details": {"cache_read": min(tokens_prompt, _tokens_em_cache(mensagens))},
+        }
+        estatisticas.registar(pedido)
+        return pedido
+
+    @staticmethod
+    def _pedacos(pedido: _Pedido) -> List[Tuple[float, str]]:
+        """(espera antes do pedaço, texto) em streaming; o 1.º chega no ttft."""
+        tamanho = _TOKENS_POR_PEDACO * _CARACTERES_POR_TOKEN
+        textos = [pedido.texto[i : i + tamanho] for i in range(0, len(pedido.texto), tamanho)] or [""]
+        resto = pedido.geracao / max(1, len(textos) - 1)
+        return [(pedido.ttft if i == 0 else resto, t) for i, t in enumerate(textos)]
+
+    def _mensagem(self, pedido: _Pedido) -> AIMessage:
+        return AIMessage(content=pedido.texto, usage_metadata=pedido.uso)
+
+    # ---------------------- interface do ChatOpenAI -------------------------
+
+    def invoke(self, mensagens: List[Any], timeout: Optional[float] = None, **_) -> AIMessage:
+        pedido = self._preparar(mensagens)
+        if pedido.erro is not None:
+            raise pedido.erro
+        if timeout is not None and pedido.latencia > timeout:
+            time.sleep(timeout)
+            raise TimeoutError("pedido excedeu o timeout (simulado)")
+        time.sleep(pedido.latencia)
+        return self._mensagem(pedido)
+
+    async def ainvoke(self, mensagens: List[Any], **_) -> AIMessage:
+        pedido = self._preparar(mensagens)
+        if pedido.erro is not None:
+            raise pedido.erro
+        await asyncio.sleep(pedido.latencia)
+        return self._mensagem(pedido)
+
+    def stream(self, mensagens: List[Any], timeout: Optional[float] = None, **_):
+        pedido = self._preparar(mensagens)
+        if pedido.erro is not None:
+            raise pedido.erro
+        decorrido = 0.0
+        for espera, texto in self._pedacos(pedido):
+            if timeout is not None and decorrido + espera > timeout:
+                time.sleep(max(0.0, timeout - decorrido))
+                raise TimeoutError("pedido excedeu o timeout (simulado)")
+            time.sleep(espera)
+            decorrido += espera
+            yield AIMessageChunk(content=texto)
+        yield AIMessageChunk(content="", usage_metadata=pedido.uso)
+
+    async def astream(self, mensagens: List[Any], **_):
+        pedido = self._preparar(mensagens)
+        if pedido.erro is not None:
+            raise pedido.erro
+        for espera, texto in self._pedacos(pedido):
+            await asyncio.sleep(espera)
+            yield AIMessageChunk(content=texto)
+        yield AIMessageChunk(content="", usage_metadata=pedido.uso)
+
+
+# ---------------------- casos sintéticos -------------------------
+
+_FRASES_ENCHIMENTO = [
+    "Patient was seen by the admitting team and the plan was discussed with the family.",
+    "Vital signs were recorded every four hours overnight.",
+    "Nursing notes describe the patient as cooperative and oriented.",
+    "Medication reconciliation was completed on admission.",
+    "Physical therapy was consulted for mobility assessment.",
+    "The patient tolerated a regular diet without difficulty.",
+    "Social work followed for discharge planning.",
+    "Laboratory results were reviewed with the attending physician.",
+]
+
+
+def casos_sinteticos(n: int, semente: int = 0) -> List[Dict[str, Any]]:
+    """
+    n casos no formato de carregar_casos_mimic: cada nota tem parte dos termos
+    de uma regra (o diagnóstico verdadeiro), alguns termos de outras e texto
+    de enchimento com comprimento variável.
+    """
+    termos = list(LEXICO)
+    casos = []
+    for i in range(n):
+        rng = np.random.default_rng([semente, i])
+        nome, codigo, _, suporte = REGRAS[int(rng.integers(len(REGRAS)))]
+        # nem sempre todos os achados da doença verdadeira estão na nota
+        achados = [suporte[0]] + [t for t in suporte[1:] if rng.random() < 0.6]
+        outros = [t for t in termos if t not in suporte]
+        achados += list(rng.choice(outros, size=int(rng.integers(1, 4)), replace=False))
+        rng.shuffle(achados)
+        idade = int(rng.integers(25, 90))
+        sexo = "male" if rng.random() < 0.5 else "female"
+        frases = [f"{idade} year old {sexo} admitted to the hospital."]
+        frases += [f"On evaluation there was {t}." for t in achados]
+        frases += list(rng.choice(_FRASES_ENCHIMENTO, size=int(rng.integers(5, 60))))
+        casos.append(
+            {
+                "subject_id": str(10000 + i),
+                "hadm_id": str(100000 + i),
+                "descricao": " ".join(frases),
+                "diagnostico_verdadeiro": nome,
+                "icd9_verdadeiro": codigo,
+            }
+        )
+    return casos
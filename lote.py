@@ -0,0 +1,346 @@
+# lote.py
+#
+# Modo offline com a Batch API da OpenAI (preço de lote, sem limite por minuto).
+#
+# O fluxo tem duas fases de pedidos, porque os médicos precisam do grafo:
+#
+#   1) python lote.py emitir-grafos
+#        -> output/lote/pedidos_grafos.jsonl  (1 pedido por caso)
+#   2) python lote.py emitir-medicos --grafos RESULTADOS_GRAFOS.jsonl
+#        -> output/lote/pedidos_medicos.jsonl (1 pedido por caso e por médico,
+#           ou 1 por caso com MODO_MEDICOS = "painel")
+#   3) python lote.py ingerir --grafos RESULTADOS_GRAFOS.jsonl --medicos RESULTADOS_MEDICOS.jsonl
+#        -> parsing, componentes, HTML, avaliação, reputação e CSV de histórico
+#
+# Os ficheiros de pedidos estão no formato da Batch API ("custom_id",
+# "method", "url", "body"). Podem ser submetidos no site da OpenAI ou com:
+#
+#   python lote.py submeter output/lote/pedidos_grafos.jsonl
+#   python lote.py descarregar BATCH_ID output/lote/resultados_grafos.jsonl
+#
+# Para testar o fluxo sem API basta escrever à mão um ficheiro de resultados
+# com linhas {"custom_id": ..., "response": {"status_code": 200, "body":
+# {"choices": [{"message": {"content": "..."}}]}}}.
+
+from typing import Dict, Any, List, Tuple
+import argparse
+import json
+import os
+
+from dados_mimic import carregar_casos_mimic
+from grafo_conhecimento import ConstrutorGrafoLLM
+from medicos import verificar_prefixo_comum
+from reputacao import GestorReputacao
+from etapas import (
+    CasoProcessado,
+    criar_medicos,
+    criar_painel,
+    versao_prompts,
+    tem_diagnostico_valido,
+    imprimir_cabecalho_caso,
+    avaliar_caso,
+    confirmar_reputacao,
+)
+from historico import HistoricoCSV
+import config
+
+
+DIR_LOTE = os.path.join(config.OUTPUT_DIR, "lote")
+URL_CHAT = "/v1/chat/completions"
+
+_PAPEIS = {"system": "system", "human": "user", "ai": "assistant"}
+
+
+# ---------------------- casos e ids -------------------------
+
+def _selecionar_casos() -> List[Tuple[int, int, Dict[str, Any]]]:
+    """
+    Mesmos casos e mesma ordem que o main.py: devolve (iteracao, idx, caso)
+    apenas para os casos com diagnóstico verdadeiro.
+    """
+    casos = carregar_casos_mimic(
+        path=config.CAMINHO_CASOS,
+        n_max=config.NUM_CASOS or None,
+    )
+    num_iter = min(config.NUM_ITERACOES, len(casos))
+    selecionados = []
+    for it in range(1, num_iter + 1):
+        idx = it - 1
+        caso = casos[idx]
+        if tem_diagnostico_valido(caso.get("diagnostico_verdadeiro")):
+            selecionados.append((it, idx, caso))
+    return selecionados
+
+
+def _id_caso(it: int, caso: Dict[str, Any]) -> str:
+    return f"{it}-{caso['subject_id']}-{caso['hadm_id']}"
+
+
+def _id_grafo(it: int, caso: Dict[str, Any]) -> str:
+    return f"grafo-{_id_caso(it, caso)}"
+
+
+def _id_medico(mid: str, it: int, caso: Dict[str, Any]) -> str:
+    return f"medico{mid}-{_id_caso(it, caso)}"
+
+
+def _id_painel(it: int, caso: Dict[str, Any]) -> str:
+    return f"painel-{_id_caso(it, caso)}"
+
+
+# ---------------------- formato da Batch API -------------------------
+
+def _pedido(custom_id: str, model_name: str, temperature: float, mensagens) -> Dict[str, Any]:
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": URL_CHAT,
+        "body": {
+            "model": model_name,
+            "temperature": temperature,
+            "messages": [
+                {"role": _PAPEIS.get(m.type, "user"), "content": str(m.content)}
+                for m in mensagens
+            ],
+        },
+    }
+
+
+def _escrever_jsonl(path: str, linhas: List[Dict[str, Any]]):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for linha in linhas:
+            f.write(json.dumps(linha, ensure_ascii=False) + "\n")
+
+
+def ler_resultados(path: str) -> Dict[str, str]:
+    """
+    Lê um ficheiro de resultados da Batch API e devolve custom_id -> texto
+    da resposta. Pedidos com erro são reportados e ficam de fora.
+    """
+    respostas: Dict[str, str] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for n, linha in enumerate(f, start=1):
+            linha = linha.strip()
+            if not linha:
+                continue
+            item = json.loads(linha)
+            custom_id = item.get("custom_id")
+            resp = item.get("response") or {}
+            if item.get("error") or resp.get("status_code") != 200:
+                print(f"[lote] pedido {custom_id} falhou (linha {n}): {item.get('error') or resp}")
+                continue
+            body = resp.get("body") or {}
+            try:
+                respostas[custom_id] = body["choices"][0]["message"]["content"]
+            except (KeyError, IndexError, TypeError):
+                print(f"[lote] resposta sem conteúdo para {custom_id} (linha {n})")
+    return respostas
+
+
+# ---------------------- fases -------------------------
+
+def _exigir_grafo_separado():
+    # os pedidos em lote seguem sempre o fluxo grafo -> médicos
+    if config.MODO_GRAFO != "separado":
+        raise ValueError('lote.py só suporta MODO_GRAFO = "separado"')
+
+
+def emitir_grafos(destino: str):
+    _exigir_grafo_separado()
+    construtor = ConstrutorGrafoLLM(model_name=config.MODEL_NAME)
+    pedidos = [
+        _pedido(
+            _id_grafo(it, caso),
+            construtor.cliente.model_name,
+            construtor.cliente.temperature,
+            construtor.mensagens(caso["descricao"]),
+        )
+        for it, _, caso in _selecionar_casos()
+    ]
+    _escrever_jsonl(destino, pedidos)
+    print(f"{len(pedidos)} pedidos de grafo escritos em {destino}")
+
+
+def _grafos_dos_resultados(construtor: ConstrutorGrafoLLM, path_grafos: str):
+    """Devolve (iteracao, idx, caso, grafo_json) para os casos com grafo válido."""
+    respostas = ler_resultados(path_grafos)
+    for it, idx, caso in _selecionar_casos():
+        cid = _id_grafo(it, caso)
+        if cid not in respostas:
+            print(f"[lote] sem resultado de grafo para {cid}; caso ignorado")
+            continue
+        grafo_json = construtor._parse_json(respostas[cid])
+        if not grafo_json["nodes"]:
+            print(f"[lote] grafo inválido em {cid}; caso ignorado")
+            continue
+        yield it, idx, caso, grafo_json
+
+
+def emitir_medicos(path_grafos: str, destino: str):
+    _exigir_grafo_separado()
+    construtor = ConstrutorGrafoLLM(model_name=config.MODEL_NAME)
+    medicos = criar_medicos()
+    painel = criar_painel(medicos)
+    pedidos = []
+    for it, _, caso, grafo_json in _grafos_dos_resultados(construtor, path_grafos):
+        if painel is not None:
+            pedidos.append(
+                _pedido(
+                    _id_painel(it, caso),
+                    painel.cliente.model_name,
+                    painel.cliente.temperature,
+                    painel.mensagens(caso["descricao"], grafo_json),
+                )
+            )
+            continue
+        if not pedidos:
+            verificar_prefixo_comum(medicos, caso["descricao"], grafo_json)
+        for mid, medico in medicos.items():
+            pedidos.append(
+                _pedido(
+                    _id_medico(mid, it, caso),
+                    medico.cliente.model_name,
+                    medico.cliente.temperature,
+                    medico.mensagens(caso["descricao"], grafo_json),
+                )
+            )
+    _escrever_jsonl(destino, pedidos)
+    print(f"{len(pedidos)} pedidos de médicos escritos em {destino}")
+
+
+def ingerir(path_grafos: str, path_medicos: str):
+    """Continua o pipeline (componentes, HTML, avaliação, reputação, CSV) a partir dos resultados."""
+    _exigir_grafo_separado()
+    construtor = ConstrutorGrafoLLM(model_name=config.MODEL_NAME)
+    medicos = criar_medicos()
+    painel = criar_painel(medicos)
+    gestor_rep = GestorReputacao(medicos.keys(), aguardar_confirmacao=True)
+
+    historico_csv = os.path.join(config.OUTPUT_DIR, "historico_experimentos.csv")
+    historico = HistoricoCSV(
+        historico_csv,
+        versao_prompt=versao_prompts(construtor, medicos, painel),
+        ao_gravar=confirmar_reputacao(gestor_rep),
+    )
+
+    respostas_med = ler_resultados(path_medicos)
+    n = 0
+    for it, idx, caso, grafo_json in _grafos_dos_resultados(construtor, path_grafos):
+        if painel is not None:
+            ids = {"painel": _id_painel(it, caso)}
+        else:
+            ids = {mid: _id_medico(mid, it, caso) for mid in medicos}
+        em_falta = [cid for cid in ids.values() if cid not in respostas_med]
+        if em_falta:
+            print(f"[lote] sem resultado de médicos para {em_falta}; caso ignorado")
+            continue
+        if historico.ja_concluido(caso):
+            print(f"[lote] {_id_caso(it, caso)} já está no histórico; caso ignorado")
+            continue
+
+        grafo_res = construtor._processar_grafo(
+            grafo_json,
+            output_dir=config.DIR_GRAFOS,
+            nome_base=f"grafo_{caso['subject_id']}_{caso['hadm_id']}",
+        )
+        if painel is not None:
+            resultados = painel._interpretar_resposta(respostas_med[ids["painel"]])
+        else:
+            resultados = {
+                mid: medicos[mid]._interpretar_resposta(respostas_med[cid])
+                for mid, cid in ids.items()
+            }
+
+        imprimir_cabecalho_caso(it, idx, caso)
+        print(f"Diagnóstico verdadeiro (MIMIC): {caso.get('diagnostico_verdadeiro')}")
+        # em lote não há latência por caso: tempos ficam NaN no histórico
+        proc = CasoProcessado(
+            iteracao=it,
+            idx=idx,
+            caso=caso,
+            grafo_res=grafo_res,
+            resultados=resultados,
+            tempo_grafo=float("nan"),
+            tempo_medicos=float("nan"),
+            t_total_ini=float("nan"),
+            versao_prompt=historico.versao_prompt,
+            modo_medicos=config.MODO_MEDICOS,
+        )
+        linha = avaliar_caso(proc, gestor_rep, t_total_fim=float("nan"))
+        historico.acrescentar(linha)
+        n += 1
+
+    historico.fechar()
+    gestor_rep.fechar()
+    print(f"\n{n} casos ingeridos. Histórico em: {historico_csv}")
+
+
+# ---------------------- submissão (opcional) -------------------------
+
+def submeter(path_pedidos: str):
+    from openai import OpenAI
+
+    cliente = OpenAI()
+    with open(path_pedidos, "rb") as f:
+        ficheiro = cliente.files.create(file=f, purpose="batch")
+    lote = cliente.batches.create(
+        input_file_id=ficheiro.id,
+        endpoint=URL_CHAT,
+        completion_window="24h",
+    )
+    print(f"Lote submetido: {lote.id} (estado: {lote.status})")
+
+
+def descarregar(batch_id: str, destino: str):
+    from openai import OpenAI
+
+    cliente = OpenAI()
+    lote = cliente.batches.retrieve(batch_id)
+    if lote.status != "completed" or not lote.output_file_id:
+        print(f"Lote {batch_id} ainda não terminou (estado: {lote.status})")
+        return
+    conteudo = cliente.files.content(lote.output_file_id)
+    os.makedirs(os.path.dirname(destino) or ".", exist_ok=True)
+    with open(destino, "wb") as f:
+        f.write(conteudo.read())
+    print(f"Resultados gravados em {destino}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Modo offline com a Batch API.")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("emitir-grafos")
+    p.add_argument("--saida", default=os.path.join(DIR_LOTE, "pedidos_grafos.jsonl"))
+
+    p = sub.add_parser("emitir-medicos")
+    p.add_argument("--grafos", required=True, help="resultados do lote de grafos")
+    p.add_argument("--saida", default=os.path.join(DIR_LOTE, "pedidos_medicos.jsonl"))
+
+    p = sub.add_parser("ingerir")
+    p.add_argument("--grafos", required=True, help="resultados do lote de grafos")
+    p.add_argument("--medicos", required=True, help="resultados do lote de médicos")
+
+    p = sub.add_parser("submeter")
+    p.add_argument("pedidos")
+
+    p = sub.add_parser("descarregar")
+    p.add_argument("batch_id")
+    p.add_argument("destino")
+
+    args = parser.parse_args()
+    if args.comando == "emitir-grafos":
+        emitir_grafos(args.saida)
+    elif args.comando == "emitir-medicos":
+        emitir_medicos(args.grafos, args.saida)
+    elif args.comando == "ingerir":
+        ingerir(args.grafos, args.medicos)
+    elif args.comando == "submeter":
+        submeter(args.pedidos)
+    elif args.comando == "descarregar":
+        descarregar(args.batch_id, args.destino)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,42 @@
 # main.py
 
 import os
-import csv
 import time
-import math  # <-- para testar NaN
+import asyncio
 
 from dados_mimic import carregar_casos_mimic
 from grafo_conhecimento import ConstrutorGrafoLLM
-from medicos import MedicoLLM, PROMPT_MEDICO_CONSERVADOR, PROMPT_MEDICO_EXPLORADOR
+from grafo_fundido import criar_grafo_fundido
+from medicos import verificar_prefixo_comum
 from reputacao import GestorReputacao
-from avaliacao import diagnostico_correto
-from active_learning import calcular_discordancia
+from active_learning import SeletorDiscordancia, criar_seletor, escolher_proximo_caso_random
+from etapas import (
+    CABECALHO_HISTORICO,
+    CasoProcessado,
+    criar_medicos,
+    criar_painel,
+    versao_prompts,
+    tem_diagnostico_valido,
+    imprimir_cabecalho_caso,
+    avaliar_caso,
+    confirmar_reputacao,
+)
+from historico import HistoricoCSV
+from pipeline_async import executar_pipeline_async
+from cache_llm import obter_cache
+from cobertura import PrazoExcedido, obter_percentis, prazo_caso
+from rastreio import fechar_rastreio, obter_rastreio, span
 import config
 
 
-def _preparar_ficheiro_historico(path_csv: str):
-    """Cria ficheiro de histórico com cabeçalho se ainda não existir."""
-    os.makedirs(os.path.dirname(path_csv), exist_ok=True)
-    if not os.path.exists(path_csv):
-        with open(path_csv, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(
-                [
-                    "iteracao",
-                    "idx",
-                    "subject_id",
-                    "hadm_id",
-                    "len_nota",
-                    "diagnostico_verdadeiro",
-                    "diag_A",
-                    "diag_B",
-                    "acertou_A",
-                    "acertou_B",
-                    "reputacao_A",
-                    "reputacao_B",
-                    "discordancia",
-                    "num_componentes",
-                    "tempo_total",
-                    "tempo_grafo",
-                    "tempo_medicos",
-                ]
-            )
-
-
-def _tem_diagnostico_valido(diag):
-    """Devolve True se o diagnóstico verdadeiro for uma string não vazia."""
-    if diag is None:
-        return False
-    if isinstance(diag, float) and math.isnan(diag):
-        return False
-    s = str(diag).strip()
-    return len(s) > 0
-
-
-def main():
-    # 1) Carregar casos (já com diagnostico_verdadeiro se houver)
-    casos = carregar_casos_mimic(
-        path=config.CAMINHO_CASOS,
-        n_max=config.NUM_CASOS or None,
-    )
+def main(casos=None):
+    # 1) Carregar casos (já com diagnostico_verdadeiro se houver);
+    #    os benchmarks passam casos sintéticos (llm_falso.casos_sinteticos)
+    if casos is None:
+        casos = carregar_casos_mimic(
+            path=config.CAMINHO_CASOS,
+            n_max=config.NUM_CASOS or None,
+        )
 
     if not casos:
         print("Nenhum caso carregado. Verifica os ficheiros filtrados.")
@@ -67,155 +45,189 @@ def main():
     # 2) Preparar construtor de grafo e médicos
     construtor_grafo = ConstrutorGrafoLLM(model_name=config.MODEL_NAME)
 
-    medicos = {
-        "A": MedicoLLM(
-            "A",
-            PROMPT_MEDICO_CONSERVADOR,
-            model_name=config.MODEL_NAME,
-            temperature=0.0,  # conservador, determinístico
-        ),
-        "B": MedicoLLM(
-            "B",
-            PROMPT_MEDICO_EXPLORADOR,
-            model_name=config.MODEL_NAME,
-            temperature=0.4,  # explorador, mais variabilidade
-        ),
-    }
-
-    gestor_rep = GestorReputacao(medicos.keys())
-
-    # 3) Preparar histórico em CSV
+    medicos = criar_medicos()
+    painel = criar_painel(medicos)  # None no modo "separado"
+    fundido = criar_grafo_fundido(construtor_grafo, medicos)  # None no modo "separado"
+
+    # a reputação de cada caso só é gravada quando a sua linha do histórico estiver em disco
+    gestor_rep = GestorReputacao(medicos.keys(), aguardar_confirmacao=True)
+
+    # 3) Preparar histórico em CSV (com as chaves dos casos já concluídos)
     historico_csv = os.path.join(config.OUTPUT_DIR, "historico_experimentos.csv")
-    _preparar_ficheiro_historico(historico_csv)
+    historico = HistoricoCSV(
+        historico_csv,
+        versao_prompt=versao_prompts(construtor_grafo, medicos, painel, fundido),
+        ao_gravar=confirmar_reputacao(gestor_rep),
+    )
 
-    # 4) Iterar sobre casos (por agora em ordem; se quiseres usas active learning depois)
+    # 4) Iterar sobre casos (em série: por ordem, ao acaso ou por active learning,
+    #    ver config.ESTRATEGIA_SELECAO; o modo assíncrono segue a ordem)
     indices_restantes = list(range(len(casos)))
     num_iter = min(config.NUM_ITERACOES, len(indices_restantes))
 
+    if config.MODO_ASSINCRONO:
+        # pipeline com filas: grafo do caso i+1 em paralelo com os médicos do caso i
+        asyncio.run(
+            executar_pipeline_async(
+                casos,
+                construtor_grafo,
+                medicos,
+                gestor_rep,
+                historico,
+                num_iter,
+                max_casos_em_voo=config.MAX_CASOS_EM_VOO,
+                tamanho_filas=config.TAMANHO_FILAS_PIPELINE,
+                painel=painel,
+                fundido=fundido,
+            )
+        )
+        _terminar(historico, gestor_rep)
+        return
+
+    seletor = None
+    if config.ESTRATEGIA_SELECAO == "discordancia":
+        # matriz TF-IDF das notas calculada uma vez; os casos do histórico já contam
+        seletor = criar_seletor(casos, historico.path_csv, historico.versao_prompt)
+        num_iter = min(num_iter, len(seletor))
+
+    prefixo_verificado = False
     for it in range(1, num_iter + 1):
-        idx = indices_restantes.pop(0)
+        idx = _proximo_indice(indices_restantes, seletor)
         caso = casos[idx]
         nota = caso["descricao"]
         diag_verdadeiro = caso.get("diagnostico_verdadeiro")
 
         # Verificar se existe diagnóstico verdadeiro válido; se não, saltar caso
-        if not _tem_diagnostico_valido(diag_verdadeiro):
-            print(
-                f"\n=== Iteração {it} | SUBJECT {caso['subject_id']} "
-                f"HADM {caso['hadm_id']} (idx {idx}) ==="
-            )
+        if not tem_diagnostico_valido(diag_verdadeiro):
+            imprimir_cabecalho_caso(it, idx, caso)
             print("Sem diagnóstico verdadeiro (MIMIC). Caso ignorado na avaliação.\n")
             # não construímos grafo, não chamamos médicos, não registamos no CSV
             # também não fazemos sleep porque não houve chamadas ao modelo nesta iteração
             continue
 
-        print(
-            f"\n=== Iteração {it} | SUBJECT {caso['subject_id']} "
-            f"HADM {caso['hadm_id']} (idx {idx}) ==="
-        )
-        print(f"Diagnóstico verdadeiro (MIMIC): {diag_verdadeiro}")
-
-        # ------ início do timer total ------
-        t_total_ini = time.perf_counter()
-
-        # 4.1) Construir grafo (medir tempo do grafo)
-        t_grafo_ini = time.perf_counter()
-        grafo_res = construtor_grafo.construir(
-            nota,
-            output_dir=config.DIR_GRAFOS,
-            nome_base=f"grafo_{caso['subject_id']}_{caso['hadm_id']}",
-        )
-        t_grafo_fim = time.perf_counter()
-        tempo_grafo = t_grafo_fim - t_grafo_ini
-
-        print(f"Grafo criado em: {grafo_res.html_path}")
-        print(f"Número de componentes desconectadas no grafo: {grafo_res.num_componentes}")
-
-        # 4.2) Diagnósticos dos médicos + reputação (medir tempo dos médicos)
-        t_med_ini = time.perf_counter()
-
-        resultados = {}
-        nomes_diags_por_medico = {}
-        acertou_por_medico = {"A": None, "B": None}
-        reputacao_por_medico = {"A": None, "B": None}
-
-        for mid, medico in medicos.items():
-            res_med = medico.diagnosticar(nota, grafo_res.grafo_json)
-            resultados[mid] = res_med
-
-            nomes_diags = [d.get("name", "") for d in res_med.diagnoses]
-            nomes_diags_por_medico[mid] = nomes_diags
-
-            print(f"\nMédico {mid}: {nomes_diags}")
-
-            correto = diagnostico_correto(nomes_diags, diag_verdadeiro)
-            acertou_por_medico[mid] = correto
-            gestor_rep.atualizar(mid, correto)
-            rep = gestor_rep.obter_reputacao(mid)
-            reputacao_por_medico[mid] = rep
-            print(f"  -> {'ACERTOU' if correto else 'FALHOU'} (reputação = {rep:.2f})")
-
-        t_med_fim = time.perf_counter()
-        tempo_medicos = t_med_fim - t_med_ini
+        # Retomar: caso já avaliado numa execução anterior com os mesmos prompts
+        if config.RETOMAR_EXECUCAO and historico.ja_concluido(caso):
+            imprimir_cabecalho_caso(it, idx, caso)
+            print("Caso já presente no histórico (mesma versão dos prompts). A saltar.\n")
+            continue
 
-        # 4.3) Discordância entre médicos
-        if "A" in resultados and "B" in resultados:
-            discordancia = calcular_discordancia(
-                resultados["A"].diagnoses,
-                resultados["B"].diagnoses,
-            )
-        else:
-            discordancia = 0.0
-
-        print(f"\nDiscordância entre médicos (Jaccard-based): {discordancia:.2f}")
-
-        # fim do timer total
-        t_total_fim = time.perf_counter()
-        tempo_total = t_total_fim - t_total_ini
-
-        print(f"\nTempo grafo: {tempo_grafo:.2f} s")
-        print(f"Tempo médicos: {tempo_medicos:.2f} s")
-        print(f"Tempo total por caso: {tempo_total:.2f} s")
-
-        # 4.4) Guardar no CSV de histórico (apenas para casos com ground truth válido)
-        len_nota = len(str(nota))
-        diag_A_str = "|".join(nomes_diags_por_medico.get("A", []))
-        diag_B_str = "|".join(nomes_diags_por_medico.get("B", []))
-
-        with open(historico_csv, "a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(
-                [
-                    it,
-                    idx,
-                    caso["subject_id"],
-                    caso["hadm_id"],
-                    len_nota,
-                    diag_verdadeiro,
-                    diag_A_str,
-                    diag_B_str,
-                    acertou_por_medico["A"],
-                    acertou_por_medico["B"],
-                    reputacao_por_medico["A"],
-                    reputacao_por_medico["B"],
-                    discordancia,
-                    grafo_res.num_componentes,
-                    tempo_total,
-                    tempo_grafo,
-                    tempo_medicos,
-                ]
+        # spans do caso numa linha própria do rastreio (rastreio.py)
+        atributos_caso = {"iteracao": it, "idx": idx, "hadm_id": caso["hadm_id"], "len_nota": len(str(nota))}
+        with span("caso", pista=f"caso {it}", **atributos_caso):
+            imprimir_cabecalho_caso(it, idx, caso)
+            print(f"Diagnóstico verdadeiro (MIMIC): {diag_verdadeiro}")
+
+            # ------ início do timer total ------
+            t_total_ini = time.perf_counter()
+            prazo = prazo_caso()  # passado a todas as chamadas ao LLM deste caso
+
+            try:
+                # 4.1) Construir grafo (medir tempo do grafo)
+                #      (no modo "fundido" o mesmo pedido traz os diagnósticos de um médico)
+                t_grafo_ini = time.perf_counter()
+                resultados = {}
+                with span("grafo", modo=config.MODO_GRAFO):
+                    if fundido is not None:
+                        grafo_res, res_fundido = fundido.construir(
+                            nota,
+                            output_dir=config.DIR_GRAFOS,
+                            nome_base=f"grafo_{caso['subject_id']}_{caso['hadm_id']}",
+                            prazo=prazo,
+                        )
+                        resultados[res_fundido.medico_id] = res_fundido
+                    else:
+                        grafo_res = construtor_grafo.construir(
+                            nota,
+                            output_dir=config.DIR_GRAFOS,
+                            nome_base=f"grafo_{caso['subject_id']}_{caso['hadm_id']}",
+                            prazo=prazo,
+                        )
+                t_grafo_fim = time.perf_counter()
+                tempo_grafo = t_grafo_fim - t_grafo_ini
+
+                # 4.2) Diagnósticos dos médicos (medir tempo dos médicos)
+                t_med_ini = time.perf_counter()
+
+                with span("medicos", modo=config.MODO_MEDICOS):
+                    if painel is not None:
+                        # um só pedido devolve os diagnósticos de todos os perfis
+                        resultados = painel.diagnosticar(nota, grafo_res.grafo_json, prazo=prazo)
+                    else:
+                        if not prefixo_verificado and fundido is None:
+                            # o prefixo partilhado pelos médicos tem de ser idêntico (cache de prompts)
+                            verificar_prefixo_comum(medicos, nota, grafo_res.grafo_json)
+                            prefixo_verificado = True
+
+                        for mid, medico in medicos.items():
+                            if mid not in resultados:
+                                with span(f"medico_{mid}"):
+                                    resultados[mid] = medico.diagnosticar(nota, grafo_res.grafo_json, prazo=prazo)
+                        # manter a ordem dos médicos (A, B) para a atualização da reputação
+                        resultados = {mid: resultados[mid] for mid in medicos}
+
+                t_med_fim = time.perf_counter()
+                tempo_medicos = t_med_fim - t_med_ini
+            except PrazoExcedido as exc:
+                # fica fora do histórico: é repetido numa próxima execução
+                print(f"{exc}. Caso não avaliado.\n")
+                continue
+
+            # 4.3) Avaliação, reputação e discordância entre médicos
+            proc = CasoProcessado(
+                iteracao=it,
+                idx=idx,
+                caso=caso,
+                grafo_res=grafo_res,
+                resultados=resultados,
+                tempo_grafo=tempo_grafo,
+                tempo_medicos=tempo_medicos,
+                t_total_ini=t_total_ini,
+                versao_prompt=historico.versao_prompt,
+                modo_medicos=config.MODO_MEDICOS,
+                modo_grafo=config.MODO_GRAFO,
+                prazo=prazo,
             )
-
-        # 4.5) Pausa para não ultrapassar os 3 RPM (3 pedidos/iteração)
-        if it < num_iter:
-            alvo_segundos = 60.0  # queremos ~1 iteração por minuto
-            espera = max(0.0, alvo_segundos - tempo_total)
-            if espera > 0:
-                print(f"A aguardar {espera:.1f} segundos para respeitar limite de RPM...\n")
-                time.sleep(espera)
-
+            with span("avaliar"):
+                linha = avaliar_caso(proc, gestor_rep)
+
+            # 4.4) Guardar no CSV de histórico (apenas para casos com ground truth válido)
+            with span("historico"):
+                historico.acrescentar(linha)
+            if seletor is not None:
+                seletor.registar(idx, linha[CABECALHO_HISTORICO.index("discordancia")])
+
+            # 4.5) Sem pausa fixa: o limite de RPM/TPM é respeitado pelo limitador
+            # partilhado (limitador.py) em cada chamada ao modelo.
+
+    _terminar(historico, gestor_rep)
+
+
+def _proximo_indice(indices_restantes, seletor: SeletorDiscordancia = None) -> int:
+    if seletor is not None:
+        idx = seletor.escolher()
+        seletor.marcar_usado(idx)
+        return idx
+    if config.ESTRATEGIA_SELECAO == "aleatoria":
+        idx = escolher_proximo_caso_random(indices_restantes)
+        indices_restantes.remove(idx)
+        return idx
+    if config.ESTRATEGIA_SELECAO == "ordem":
+        return indices_restantes.pop(0)
+    raise ValueError(f"ESTRATEGIA_SELECAO desconhecida: {config.ESTRATEGIA_SELECAO}")
+
+
+def _terminar(historico: HistoricoCSV, gestor_rep: GestorReputacao):
+    historico.fechar()  # grava as linhas ainda no buffer
+    gestor_rep.fechar()  # grava os eventos de reputação ainda pendentes
     print("\nFim da simulação.")
-    print(f"Histórico de experiências guardado em: {historico_csv}")
+    print(f"Histórico de experiências guardado em: {historico.path_csv}")
+    if obter_rastreio() is not None:
+        fechar_rastreio()
+        print(f"Rastreio guardado em: {config.CAMINHO_RASTREIO} (resumo: python rastreio.py)")
+    cache = obter_cache()
+    if cache is not None:
+        print(f"Cache LLM: {cache.hits} hits, {cache.misses} misses ({cache.diretorio})")
+    obter_percentis().imprimir()
 
 
 if __name__ == "__main__":
@@ -1,12 +1,18 @@
 # medicos.py
 
 from dataclasses import dataclass
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional
 import json
 
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 
+from cliente_llm import ClienteLLM, RespostaLLM
+from cobertura import Prazo
+from codificacao_grafo import codificar_grafo, explicacao
+from json_incremental import carregar_json, preparar_parser
+from limitador import estimar_tokens
+import config
+
 
 # -------------------------------------------------------------------
 # PROMPTS DOS MÉDICOS
@@ -78,7 +84,9 @@ Do not include any text outside the JSON object.
 """
 
 
-PROMPT_MEDICO_CONSERVADOR = PROMPT_MEDICO_BASE + """
+# Perfis comportamentais. Com config.LAYOUT_PROMPT_MEDICOS = "prefixo" o perfil
+# vai no fim do pedido, depois da nota e do grafo (ver MedicoLLM).
+PERFIL_MEDICO_CONSERVADOR = """
 Behavioural profile:
 - You are CONSERVATIVE.
 - You strongly prefer common, well-supported diagnoses.
@@ -89,7 +97,7 @@ Behavioural profile:
 """
 
 
-PROMPT_MEDICO_EXPLORADOR = PROMPT_MEDICO_BASE + """
+PERFIL_MEDICO_EXPLORADOR = """
 Behavioural profile:
 - You are EXPLORATORY.
 - In addition to common diagnoses, you also consider less frequent but plausible
@@ -100,6 +108,29 @@ Behavioural profile:
 """
 
 
+PROMPT_MEDICO_CONSERVADOR = PROMPT_MEDICO_BASE + PERFIL_MEDICO_CONSERVADOR
+
+PROMPT_MEDICO_EXPLORADOR = PROMPT_MEDICO_BASE + PERFIL_MEDICO_EXPLORADOR
+
+_INSTRUCAO_FINAL = "Return ONLY the JSON object with the 'diagnoses' list."
+
+# a cache de prompts da OpenAI só se aplica a prefixos com pelo menos 1024 tokens
+MIN_TOKENS_CACHE_PROMPT = 1024
+
+
+# Modo "painel" (PainelMedicosLLM): um só pedido com todos os perfis
+PROMPT_PAINEL = """
+PANEL MODE
+You answer as a panel of {n} doctors who reason INDEPENDENTLY about the same
+patient. Each doctor has the behavioural profile given below and must not be
+influenced by the other doctors' answers.
+{perfis}
+Return ONLY a JSON object whose top-level keys are the doctor ids ({ids}).
+The value for each id is an object with the key "diagnoses", in the format
+described above, e.g. {exemplo}.
+"""
+
+
 # -------------------------------------------------------------------
 # ESTRUTURA DE RESULTADO
 # -------------------------------------------------------------------
@@ -108,6 +139,8 @@ Behavioural profile:
 class ResultadoMedico:
     medico_id: str
     diagnoses: List[Dict[str, Any]]
+    em_cache: bool = False  # resposta do LLM veio da cache em disco
+    resposta: Optional[RespostaLLM] = None  # métricas da chamada (None no modo em lote)
 
 
 # -------------------------------------------------------------------
@@ -117,6 +150,13 @@ class ResultadoMedico:
 class MedicoLLM:
     """
     Wrapper para um 'médico virtual' baseado em LLM.
+
+    Se `perfil` for dado, `prompt_sistema` é a parte comum a todos os médicos
+    e o perfil é colocado conforme config.LAYOUT_PROMPT_MEDICOS:
+      "original" - perfil no fim do prompt de sistema (system + user);
+      "prefixo"  - system (base) + user (nota e grafo) + system (perfil): as
+                   duas primeiras mensagens são iguais para todos os médicos,
+                   e a API pode reutilizar esse prefixo da cache de prompts.
     """
 
     def __init__(
@@ -125,53 +165,271 @@ class MedicoLLM:
         prompt_sistema: str,
         model_name: str = "gpt-4o-mini",
         temperature: float = 0.0,
+        usar_cache: bool = True,
+        codificacao_grafo: str = None,
+        podar_grafo: bool = None,
+        perfil: Optional[str] = None,
+        layout: Optional[str] = None,
     ):
         self.medico_id = medico_id
-        self.model = ChatOpenAI(model=model_name, temperature=temperature)
+        self.prompt_sistema = prompt_sistema
+        self.perfil = perfil
+        self.layout = layout or config.LAYOUT_PROMPT_MEDICOS
+        if self.layout not in ("original", "prefixo"):
+            raise ValueError(f"LAYOUT_PROMPT_MEDICOS desconhecido: {self.layout}")
+        self.codificacao_grafo = codificacao_grafo or config.CODIFICACAO_GRAFO
+        self.podar_grafo = config.PODAR_GRAFO if podar_grafo is None else podar_grafo
+        # todas as chamadas passam pelo limitador de taxa partilhado;
+        # usar_cache=False para perfis não determinísticos (temperature > 0)
+        self.cliente = ClienteLLM(
+            model_name=model_name,
+            temperature=temperature,
+            usar_cache=usar_cache,
+            etapa=f"medico_{medico_id}",
+        )
 
-        # Prompt com placeholders para a nota e o grafo em JSON
-        self.prompt = ChatPromptTemplate.from_messages(
-            [
-                ("system", prompt_sistema),
-                (
-                    "user",
-                    "Clinical note:\n{nota}\n\n"
-                    "Knowledge graph (JSON):\n{grafo_json}\n\n"
-                    "Return ONLY the JSON object with the 'diagnoses' list."
-                ),
+        # Prompt com placeholders para a nota e o grafo; nos formatos compactos
+        # a codificação do grafo é explicada uma vez no prompt de sistema
+        dados = _template_dados(self.codificacao_grafo)
+        # só com um perfil separado há prefixo partilhado a verificar
+        self.perfil_no_fim = perfil is not None and self.layout == "prefixo"
+        if self.perfil_no_fim:
+            mensagens = [
+                ("system", prompt_sistema + explicacao(self.codificacao_grafo)),
+                ("user", dados),
+                ("system", perfil + "\n" + _INSTRUCAO_FINAL),
             ]
-        )
+        else:
+            mensagens = [
+                ("system", prompt_sistema + (perfil or "") + explicacao(self.codificacao_grafo)),
+                ("user", dados + "\n\n" + _INSTRUCAO_FINAL),
+            ]
+        self.prompt = ChatPromptTemplate.from_messages(mensagens)
+
+    def mensagens(self, nota: str, grafo_json: Dict[str, Any]):
+        """Mensagens (system + user) já renderizadas para a nota e o grafo."""
+        grafo_str = codificar_grafo(grafo_json, self.codificacao_grafo, self.podar_grafo)
+        return self.prompt.format_messages(nota=nota, grafo_json=grafo_str)
+
+    def prefixo(self, nota: str, grafo_json: Dict[str, Any]) -> str:
+        """Texto que precede o perfil do médico (no layout "prefixo": system + user)."""
+        msgs = self.mensagens(nota, grafo_json)
+        if self.perfil_no_fim:
+            msgs = msgs[:-1]
+        return "".join(f"<{m.type}>{m.content}" for m in msgs)
 
-    def diagnosticar(self, nota: str, grafo_json: Dict[str, Any]) -> ResultadoMedico:
+    def diagnosticar(
+        self,
+        nota: str,
+        grafo_json: Dict[str, Any],
+        ao_diagnostico: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+        prazo: Optional[Prazo] = None,
+    ) -> ResultadoMedico:
         """
         Envia a nota clínica + grafo para o LLM e devolve um ResultadoMedico
         com a lista de diagnósticos (cada um com name, probability, justification).
+        Com config.STREAMING_JSON, ao_diagnostico("diagnoses", diag) é chamado
+        assim que cada diagnóstico chega.
         """
-        grafo_str = json.dumps(grafo_json, ensure_ascii=False)
-
-        chain = self.prompt | self.model
-        response = chain.invoke({"nota": nota, "grafo_json": grafo_str})
-
-        raw = response.content
-
-        # Parsing robusto do JSON de saída
-        try:
-            data = json.loads(raw)
-        except json.JSONDecodeError:
-            text = str(raw).strip()
-            inicio = text.find("{")
-            fim = text.rfind("}") + 1
-            if inicio == -1 or fim <= inicio:
-                data = {}
-            else:
-                json_text = text[inicio:fim]
-                try:
-                    data = json.loads(json_text)
-                except json.JSONDecodeError:
-                    data = {}
-
-        diagnoses = data.get("diagnoses", [])
-        if not isinstance(diagnoses, list):
-            diagnoses = []
-
-        return ResultadoMedico(medico_id=self.medico_id, diagnoses=diagnoses)
+        mensagens = self.mensagens(nota, grafo_json)
+        ao_pedaco, parser = preparar_parser(("diagnoses",), _lista_diagnosticos, ao_diagnostico)
+        resposta = self.cliente.invocar(mensagens, parser=parser, ao_pedaco=ao_pedaco, prazo=prazo)
+
+        return ResultadoMedico(
+            medico_id=self.medico_id,
+            diagnoses=resposta.dados,
+            em_cache=resposta.em_cache,
+            resposta=resposta,
+        )
+
+    async def adiagnosticar(
+        self,
+        nota: str,
+        grafo_json: Dict[str, Any],
+        ao_diagnostico: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+        prazo: Optional[Prazo] = None,
+    ) -> ResultadoMedico:
+        """Versão assíncrona de diagnosticar() (usa ainvoke)."""
+        mensagens = self.mensagens(nota, grafo_json)
+        ao_pedaco, parser = preparar_parser(("diagnoses",), _lista_diagnosticos, ao_diagnostico)
+        resposta = await self.cliente.ainvocar(
+            mensagens, parser=parser, ao_pedaco=ao_pedaco, prazo=prazo
+        )
+
+        return ResultadoMedico(
+            medico_id=self.medico_id,
+            diagnoses=resposta.dados,
+            em_cache=resposta.em_cache,
+            resposta=resposta,
+        )
+
+    def _interpretar_resposta(self, raw) -> ResultadoMedico:
+        return ResultadoMedico(
+            medico_id=self.medico_id,
+            diagnoses=self._extrair_diagnosticos(raw),
+        )
+
+    @staticmethod
+    def _extrair_diagnosticos(raw) -> List[Dict[str, Any]]:
+        return _lista_diagnosticos(_json_da_resposta(raw))
+
+
+def _template_dados(codificacao_grafo: str) -> str:
+    """Mensagem do utilizador com a nota e o grafo (placeholders {nota} e {grafo_json})."""
+    formato = "JSON" if codificacao_grafo.startswith("json") else "compact encoding"
+    return (
+        "Clinical note:\n{nota}\n\n"
+        f"Knowledge graph ({formato}):\n{{grafo_json}}"
+    )
+
+
+def _json_da_resposta(raw) -> Dict[str, Any]:
+    # Parsing robusto do JSON de saída (repara respostas truncadas)
+    return carregar_json(raw, ("diagnoses",))
+
+
+def _lista_diagnosticos(data) -> List[Dict[str, Any]]:
+    diagnoses = data.get("diagnoses", []) if isinstance(data, dict) else data
+    if not isinstance(diagnoses, list):
+        diagnoses = []
+    return diagnoses
+
+
+# -------------------------------------------------------------------
+# PAINEL: TODOS OS MÉDICOS NUM SÓ PEDIDO
+# -------------------------------------------------------------------
+
+class PainelMedicosLLM:
+    """
+    Pede ao modelo, numa única chamada, a resposta de cada perfil
+    ({"A": {"diagnoses": [...]}, "B": {...}}) e separa-a em ResultadoMedico
+    por médico, para a reputação, a discordância e o histórico não mudarem.
+    Metade dos pedidos e dos tokens de entrada por caso em relação aos médicos
+    separados; a temperatura é uma só para todos (config.TEMPERATURA_PAINEL).
+
+    Usa o prompt base, a codificação do grafo e os perfis dos médicos dados
+    (têm de ter sido criados com `perfil`).
+    """
+
+    def __init__(
+        self,
+        medicos: Dict[str, MedicoLLM],
+        model_name: Optional[str] = None,
+        temperature: Optional[float] = None,
+        usar_cache: bool = True,
+    ):
+        sem_perfil = [mid for mid, m in medicos.items() if m.perfil is None]
+        if sem_perfil:
+            raise ValueError(f"Médicos sem perfil separado não podem formar um painel: {sem_perfil}")
+        self.medicos = medicos
+        base = next(iter(medicos.values()))
+        self.cliente = ClienteLLM(
+            model_name=model_name or base.cliente.model_name,
+            temperature=config.TEMPERATURA_PAINEL if temperature is None else temperature,
+            usar_cache=usar_cache,
+            etapa="painel",
+        )
+        self.codificacao_grafo = base.codificacao_grafo
+        self.podar_grafo = base.podar_grafo
+
+        ids = list(medicos)
+        perfis = "".join(
+            f"\nDoctor {mid}:{m.perfil.replace('Behavioural profile:', '', 1)}"
+            for mid, m in medicos.items()
+        )
+        exemplo = json.dumps({mid: {"diagnoses": ["..."]} for mid in ids})
+        painel = PROMPT_PAINEL.format(
+            n=len(ids), perfis=perfis, ids=", ".join(f'"{mid}"' for mid in ids), exemplo=exemplo
+        )
+        # mesmo prefixo (base + nota + grafo) que os médicos no layout "prefixo"
+        self.prompt = ChatPromptTemplate.from_messages(
+            [
+                ("system", base.prompt_sistema + explicacao(self.codificacao_grafo)),
+                ("user", _template_dados(self.codificacao_grafo)),
+                ("system", painel.replace("{", "{{").replace("}", "}}")),
+            ]
+        )
+
+    def mensagens(self, nota: str, grafo_json: Dict[str, Any]):
+        grafo_str = codificar_grafo(grafo_json, self.codificacao_grafo, self.podar_grafo)
+        return self.prompt.format_messages(nota=nota, grafo_json=grafo_str)
+
+    def diagnosticar(
+        self, nota: str, grafo_json: Dict[str, Any], prazo: Optional[Prazo] = None
+    ) -> Dict[str, ResultadoMedico]:
+        mensagens = self.mensagens(nota, grafo_json)
+        ao_pedaco, parser = preparar_parser(("diagnoses",), self._diagnosticos_por_medico)
+        resposta = self.cliente.invocar(mensagens, parser=parser, ao_pedaco=ao_pedaco, prazo=prazo)
+        return self._resultados(resposta.dados, resposta)
+
+    async def adiagnosticar(
+        self, nota: str, grafo_json: Dict[str, Any], prazo: Optional[Prazo] = None
+    ) -> Dict[str, ResultadoMedico]:
+        mensagens = self.mensagens(nota, grafo_json)
+        ao_pedaco, parser = preparar_parser(("diagnoses",), self._diagnosticos_por_medico)
+        resposta = await self.cliente.ainvocar(
+            mensagens, parser=parser, ao_pedaco=ao_pedaco, prazo=prazo
+        )
+        return self._resultados(resposta.dados, resposta)
+
+    def _interpretar_resposta(self, raw) -> Dict[str, ResultadoMedico]:
+        return self._resultados(self._extrair_painel(raw))
+
+    def _extrair_painel(self, raw) -> Dict[str, List[Dict[str, Any]]]:
+        return self._diagnosticos_por_medico(_json_da_resposta(raw))
+
+    def _diagnosticos_por_medico(self, data: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+        return {mid: _lista_diagnosticos(data.get(mid, [])) for mid in self.medicos}
+
+    def _resultados(
+        self, dados: Dict[str, List[Dict[str, Any]]], resposta: Optional[RespostaLLM] = None
+    ) -> Dict[str, ResultadoMedico]:
+        # as métricas da chamada ficam só no primeiro médico, para os tokens
+        # e a latência não contarem duas vezes no histórico
+        resultados = {}
+        for i, mid in enumerate(self.medicos):
+            resultados[mid] = ResultadoMedico(
+                medico_id=mid,
+                diagnoses=dados.get(mid, []),
+                em_cache=resposta is not None and resposta.em_cache,
+                resposta=resposta if i == 0 else None,
+            )
+        return resultados
+
+
+# -------------------------------------------------------------------
+# VERIFICAÇÃO DO PREFIXO PARTILHADO
+# -------------------------------------------------------------------
+
+def verificar_prefixo_comum(
+    medicos: Dict[str, MedicoLLM], nota: str, grafo_json: Dict[str, Any]
+) -> int:
+    """
+    Confirma que, no layout "prefixo", todos os médicos enviam exatamente o
+    mesmo prefixo (mesmos bytes) para a nota e o grafo dados. Devolve o nº
+    estimado de tokens do prefixo comum (0 se algum médico não usar esse layout).
+    Os tokens efetivamente servidos pela cache aparecem nas colunas
+    medico_*_tokens_cache do histórico.
+    """
+    if not all(m.perfil_no_fim for m in medicos.values()):
+        return 0
+    prefixos = {mid: m.prefixo(nota, grafo_json).encode("utf-8") for mid, m in medicos.items()}
+    referencia = next(iter(prefixos.values()))
+    for mid, prefixo in prefixos.items():
+        if prefixo != referencia:
+            n = next(
+                (i for i, (a, b) in enumerate(zip(prefixo, referencia)) if a != b),
+                min(len(prefixo), len(referencia)),
+            )
+            raise ValueError(
+                f"O prefixo do médico {mid} difere dos restantes a partir do byte {n}; "
+                "verifica CODIFICACAO_GRAFO/PODAR_GRAFO e os prompts de sistema."
+            )
+    tokens = estimar_tokens(referencia.decode("utf-8"))
+    print(f"[medicos] prefixo comum aos {len(medicos)} médicos: ~{tokens} tokens")
+    if tokens < MIN_TOKENS_CACHE_PROMPT:
+        print(
+            f"[medicos] aviso: prefixo abaixo de {MIN_TOKENS_CACHE_PROMPT} tokens, "
+            "a API não o guarda na cache de prompts"
+        )
+    return tokens
@@ -0,0 +1,320 @@
+# pipeline_async.py
+#
+# Modo de execução assíncrono do main.py.
+#
+# Em vez de processar um caso de cada vez (grafo -> médico A -> médico B),
+# os casos passam por um pipeline com filas limitadas entre etapas:
+#
+#   carregar -> grafo -> médicos -> avaliar -> guardar
+#
+# Assim a construção do grafo do caso i+1 sobrepõe-se às chamadas aos
+# médicos do caso i. As etapas com LLM usam ainvoke.
+#
+# A etapa de avaliação reordena os casos pela ordem das iterações antes de
+# atualizar a reputação, para que as linhas do historico_experimentos.csv e
+# a evolução da reputação sejam iguais às de uma execução em série.
+#
+# Um caso que passe o prazo (cobertura.py) segue pelas etapas como
+# _CasoExpirado: não é avaliado nem gravado, mas mantém a ordem (seq) e
+# liberta o seu lugar entre os casos em voo.
+#
+# No rastreio (rastreio.py) cada caso tem a sua pista ("caso N"): as etapas
+# abrem os seus spans nela e o span "caso" é registado no fim da avaliação,
+# de t_total_ini até aí. Os médicos em paralelo ficam em pistas próprias.
+
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional
+import asyncio
+import time
+
+from grafo_conhecimento import ConstrutorGrafoLLM
+from grafo_fundido import GrafoFundidoLLM
+from medicos import MedicoLLM, PainelMedicosLLM, verificar_prefixo_comum
+from reputacao import GestorReputacao
+from historico import HistoricoCSV
+from cobertura import PrazoExcedido, prazo_caso
+from rastreio import registar_span, span
+from etapas import (
+    CasoProcessado,
+    tem_diagnostico_valido,
+    imprimir_cabecalho_caso,
+    avaliar_caso,
+)
+import config
+
+
+_FIM = object()  # sentinela de fim de fila
+_SALTAR = object()  # caso sem linha no histórico (só liberta o lugar em voo)
+
+
+@dataclass
+class _CasoExpirado:
+    """Caso cujo prazo acabou numa das etapas com LLM."""
+    iteracao: int
+    idx: int
+    caso: Dict[str, Any]
+    motivo: str
+
+
+async def _etapa_carregar(
+    casos: List[Dict[str, Any]],
+    num_iter: int,
+    historico: HistoricoCSV,
+    fila_saida: asyncio.Queue,
+    em_voo: asyncio.Semaphore,
+):
+    """Escolhe os casos pela mesma ordem do ciclo em série e põe-nos na fila."""
+    indices_restantes = list(range(len(casos)))
+    seq = 0
+    for it in range(1, num_iter + 1):
+        idx = indices_restantes.pop(0)
+        caso = casos[idx]
+
+        if not tem_diagnostico_valido(caso.get("diagnostico_verdadeiro")):
+            imprimir_cabecalho_caso(it, idx, caso)
+            print("Sem diagnóstico verdadeiro (MIMIC). Caso ignorado na avaliação.\n")
+            continue
+        if config.RETOMAR_EXECUCAO and historico.ja_concluido(caso):
+            imprimir_cabecalho_caso(it, idx, caso)
+            print("Caso já presente no histórico (mesma versão dos prompts). A saltar.\n")
+            continue
+
+        # limita o número de casos em simultâneo dentro do pipeline
+        await em_voo.acquire()
+        await fila_saida.put((seq, it, idx, caso))
+        seq += 1
+
+    await fila_saida.put(_FIM)
+
+
+async def _etapa_grafo(
+    construtor: ConstrutorGrafoLLM,
+    fundido: Optional[GrafoFundidoLLM],
+    versao_prompt: str,
+    fila_entrada: asyncio.Queue,
+    fila_saida: asyncio.Queue,
+):
+    while True:
+        item = await fila_entrada.get()
+        if item is _FIM:
+            # devolver a sentinela para os outros trabalhadores desta etapa
+            await fila_entrada.put(_FIM)
+            return
+        seq, it, idx, caso = item
+
+        t_total_ini = time.perf_counter()
+        prazo = prazo_caso()
+        nome_base = f"grafo_{caso['subject_id']}_{caso['hadm_id']}"
+        resultados = {}
+        try:
+            with span("grafo", pista=f"caso {it}", modo="separado" if fundido is None else "fundido"):
+                if fundido is not None:
+                    # o mesmo pedido traz os diagnósticos de um dos médicos
+                    grafo_res, res_fundido = await fundido.aconstruir(
+                        caso["descricao"], output_dir=config.DIR_GRAFOS, nome_base=nome_base, prazo=prazo
+                    )
+                    resultados[res_fundido.medico_id] = res_fundido
+                else:
+                    grafo_res = await construtor.aconstruir(
+                        caso["descricao"], output_dir=config.DIR_GRAFOS, nome_base=nome_base, prazo=prazo
+                    )
+        except PrazoExcedido as exc:
+            await fila_saida.put((seq, _CasoExpirado(it, idx, caso, str(exc))))
+            continue
+        tempo_grafo = time.perf_counter() - t_total_ini
+
+        proc = CasoProcessado(
+            iteracao=it,
+            idx=idx,
+            caso=caso,
+            grafo_res=grafo_res,
+            resultados=resultados,
+            tempo_grafo=tempo_grafo,
+            t_total_ini=t_total_ini,
+            versao_prompt=versao_prompt,
+            modo_grafo="separado" if fundido is None else "fundido",
+            prazo=prazo,
+        )
+        await fila_saida.put((seq, proc))
+
+
+async def _etapa_medicos(
+    medicos: Dict[str, MedicoLLM],
+    painel: Optional[PainelMedicosLLM],
+    fila_entrada: asyncio.Queue,
+    fila_saida: asyncio.Queue,
+):
+    while True:
+        item = await fila_entrada.get()
+        if item is _FIM:
+            await fila_entrada.put(_FIM)
+            # cada trabalhador avisa a etapa seguinte que terminou
+            await fila_saida.put(_FIM)
+            return
+        seq, proc = item
+        if isinstance(proc, _CasoExpirado):
+            await fila_saida.put((seq, proc))
+            continue
+
+        nota = proc.caso["descricao"]
+        grafo_json = proc.grafo_res.grafo_json
+        if seq == 0 and painel is None and not proc.resultados:
+            verificar_prefixo_comum(medicos, nota, grafo_json)
+        t_med_ini = time.perf_counter()
+        pista = f"caso {proc.iteracao}"
+        try:
+            with span("medicos", pista=pista, modo="separado" if painel is None else "painel"):
+                if painel is not None:
+                    # um só pedido com todos os perfis; já vem na ordem dos médicos
+                    proc.resultados = await painel.adiagnosticar(nota, grafo_json, prazo=proc.prazo)
+                else:
+                    # os médicos são independentes entre si: pedidos em paralelo
+                    # (no modo "fundido" um deles já veio com o grafo)
+                    pendentes = [mid for mid in medicos if mid not in proc.resultados]
+                    res = await asyncio.gather(
+                        *(
+                            _diagnosticar(medicos[mid], f"{pista} · {mid}", nota, grafo_json, proc.prazo)
+                            for mid in pendentes
+                        )
+                    )
+                    proc.resultados.update(zip(pendentes, res))
+                    # manter a ordem dos médicos (A, B) para a atualização da reputação
+                    proc.resultados = {mid: proc.resultados[mid] for mid in medicos}
+        except PrazoExcedido as exc:
+            await fila_saida.put((seq, _CasoExpirado(proc.iteracao, proc.idx, proc.caso, str(exc))))
+            continue
+        proc.tempo_medicos = time.perf_counter() - t_med_ini
+        proc.modo_medicos = "separado" if painel is None else "painel"
+
+        await fila_saida.put((seq, proc))
+
+
+async def _diagnosticar(medico: MedicoLLM, pista: str, nota: str, grafo_json, prazo):
+    """adiagnosticar num span com pista própria (os médicos correm em paralelo)."""
+    with span(f"medico_{medico.medico_id}", pista=pista):
+        return await medico.adiagnosticar(nota, grafo_json, prazo=prazo)
+
+
+async def _etapa_avaliar(
+    gestor_rep: GestorReputacao,
+    n_trabalhadores_medicos: int,
+    fila_entrada: asyncio.Queue,
+    fila_saida: asyncio.Queue,
+):
+    """Avalia os casos pela ordem original (seq), usando um buffer de reordenação."""
+    pendentes: Dict[int, Any] = {}  # CasoProcessado ou _CasoExpirado
+    proximo = 0
+    fins = 0
+    while fins < n_trabalhadores_medicos:
+        item = await fila_entrada.get()
+        if item is _FIM:
+            fins += 1
+            continue
+        seq, proc = item
+        pendentes[seq] = proc
+
+        while proximo in pendentes:
+            proc = pendentes.pop(proximo)
+            proximo += 1
+            imprimir_cabecalho_caso(proc.iteracao, proc.idx, proc.caso)
+            if isinstance(proc, _CasoExpirado):
+                # fica fora do histórico: é repetido numa próxima execução
+                print(f"{proc.motivo}. Caso não avaliado.\n")
+                await fila_saida.put(_SALTAR)
+                continue
+            print(f"Diagnóstico verdadeiro (MIMIC): {proc.caso.get('diagnostico_verdadeiro')}")
+            pista = f"caso {proc.iteracao}"
+            with span("avaliar", pista=pista):
+                linha = avaliar_caso(proc, gestor_rep)
+            registar_span(
+                "caso",
+                proc.t_total_ini,
+                pista=pista,
+                iteracao=proc.iteracao,
+                idx=proc.idx,
+                hadm_id=proc.caso["hadm_id"],
+                len_nota=len(str(proc.caso["descricao"])),
+            )
+            await fila_saida.put(linha)
+
+    await fila_saida.put(_FIM)
+
+
+async def _etapa_guardar(
+    historico: HistoricoCSV,
+    fila_entrada: asyncio.Queue,
+    em_voo: asyncio.Semaphore,
+):
+    while True:
+        linha = await fila_entrada.get()
+        if linha is _FIM:
+            return
+        if linha is _SALTAR:
+            em_voo.release()
+            continue
+        # normalmente só vai para o buffer; quando grava, faz fsync fora do event loop
+        with span("historico", pista=f"caso {linha[0]}"):
+            await asyncio.to_thread(historico.acrescentar, linha)
+        em_voo.release()
+
+
+async def executar_pipeline_async(
+    casos: List[Dict[str, Any]],
+    construtor_grafo: ConstrutorGrafoLLM,
+    medicos: Dict[str, MedicoLLM],
+    gestor_rep: GestorReputacao,
+    historico: HistoricoCSV,
+    num_iter: int,
+    max_casos_em_voo: int = 2,
+    tamanho_filas: int = 2,
+    painel: Optional[PainelMedicosLLM] = None,
+    fundido: Optional[GrafoFundidoLLM] = None,
+):
+    """
+    Corre as num_iter iterações através do pipeline assíncrono.
+
+    - max_casos_em_voo: nº máximo de casos entre o carregamento e a escrita
+      no CSV (também é o nº de trabalhadores nas etapas com LLM);
+    - tamanho_filas: capacidade de cada fila entre etapas.
+    """
+    max_casos_em_voo = max(1, int(max_casos_em_voo))
+    tamanho_filas = max(1, int(tamanho_filas))
+
+    em_voo = asyncio.Semaphore(max_casos_em_voo)
+    fila_grafo: asyncio.Queue = asyncio.Queue(maxsize=tamanho_filas)
+    fila_medicos: asyncio.Queue = asyncio.Queue(maxsize=tamanho_filas)
+    fila_avaliar: asyncio.Queue = asyncio.Queue(maxsize=tamanho_filas)
+    # a fila de escrita não precisa de limite: o semáforo já limita os casos em voo
+    fila_guardar: asyncio.Queue = asyncio.Queue()
+
+    async def _trabalhadores_grafo():
+        await asyncio.gather(
+            *(
+                _etapa_grafo(
+                    construtor_grafo, fundido, historico.versao_prompt, fila_grafo, fila_medicos
+                )
+                for _ in range(max_casos_em_voo)
+            )
+        )
+        await fila_medicos.put(_FIM)
+
+    tarefas = [
+        asyncio.create_task(_etapa_carregar(casos, num_iter, historico, fila_grafo, em_voo)),
+        asyncio.create_task(_trabalhadores_grafo()),
+        *(
+            asyncio.create_task(_etapa_medicos(medicos, painel, fila_medicos, fila_avaliar))
+            for _ in range(max_casos_em_voo)
+        ),
+        asyncio.create_task(
+            _etapa_avaliar(gestor_rep, max_casos_em_voo, fila_avaliar, fila_guardar)
+        ),
+        asyncio.create_task(_etapa_guardar(historico, fila_guardar, em_voo)),
+    ]
+
+    try:
+        await asyncio.gather(*tarefas)
+    finally:
+        # se uma etapa falhar, cancelar as restantes em vez de ficarem bloqueadas
+        for t in tarefas:
+            if not t.done():
+                t.cancel()
@@ -1,6 +1,13 @@
 import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 
+from armazem_notas import gravar_armazem_notas, chave_composta
+
 
 # Diretórios
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -23,6 +30,18 @@ def norm_hadm(x):
         return None
 
 
+def norm_hadm_vetorizado(serie: pd.Series) -> np.ndarray:
+    """
+    Versão vetorizada de norm_hadm: devolve um array int64 com o HADM_ID
+    inteiro ("174105.0" -> 174105) e -1 quando é vazio ou inválido.
+    """
+    valores = pd.to_numeric(serie, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+    out = np.full(len(valores), -1, dtype=np.int64)
+    ok = np.isfinite(valores)
+    out[ok] = np.trunc(valores[ok]).astype(np.int64)
+    return out
+
+
 def main():
     # ----------------- Ler ficheiros -----------------
     print("A ler NOTEEVENTS_random_separado.csv...")
@@ -88,11 +107,195 @@ def main():
     diag_filt.to_csv(out_diag, index=False)
     dic_filt.to_csv(out_dic, index=False)
 
+    # ----------------- Armazém binário das notas -----------------
+    # notas num ficheiro binário + índice (offsets), para acesso a uma nota de cada vez
+    base_armazem = os.path.join(DATA_OUT, "NOTEEVENTS_filtred_notas")
+    n_armazem = gravar_armazem_notas(out_notes, base_armazem)
+
+    print("\nFicheiros filtrados gravados em:")
+    print(" -", out_notes)
+    print(" -", out_diag)
+    print(" -", out_dic)
+    print(f" - {base_armazem}.bin / .idx.npy ({n_armazem} notas)")
+
+
+
+# -------------------------------------------------------------------
+# MODO STREAMING (tabelas MIMIC-III completas)
+# -------------------------------------------------------------------
+#
+# Em vez de ler os três CSV inteiros e normalizar HADM_ID linha a linha,
+# este modo:
+#   - lê os ficheiros por blocos (memória limitada pelo tamanho do bloco);
+#   - normaliza HADM_ID de forma vetorizada;
+#   - usa uma chave inteira (SUBJECT_ID, HADM_ID) -> int64 em vez de strings;
+#   - filtra os blocos de notas num conjunto de processos.
+# As saídas são os mesmos ficheiros *_filtred.csv do modo normal.
+
+def _chaves_do_bloco(df: pd.DataFrame) -> np.ndarray:
+    """Chave inteira por linha; -1 nas linhas sem SUBJECT_ID/HADM_ID válidos."""
+    subj = pd.to_numeric(df["SUBJECT_ID"], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+    hadm = norm_hadm_vetorizado(df["HADM_ID"])
+    valido = np.isfinite(subj) & (hadm >= 0)
+    chaves = np.full(len(df), -1, dtype=np.int64)
+    chaves[valido] = chave_composta(subj[valido].astype(np.int64), hadm[valido])
+    return chaves
+
+
+def _contem(ordenadas: np.ndarray, chaves: np.ndarray) -> np.ndarray:
+    """Máscara chaves ∈ ordenadas (array já ordenado), por pesquisa binária."""
+    if len(ordenadas) == 0:
+        return np.zeros(len(chaves), dtype=bool)
+    pos = np.searchsorted(ordenadas, chaves)
+    pos[pos == len(ordenadas)] = 0
+    return (ordenadas[pos] == chaves) & (chaves >= 0)
+
+
+def _chaves_unicas(path: str, chunksize: int):
+    """1ª passagem: chaves distintas de um ficheiro (lê só SUBJECT_ID e HADM_ID)."""
+    unicas = []
+    total = validas = 0
+    for chunk in pd.read_csv(path, dtype=str, usecols=["SUBJECT_ID", "HADM_ID"], chunksize=chunksize):
+        chaves = _chaves_do_bloco(chunk)
+        total += len(chaves)
+        chaves = chaves[chaves >= 0]
+        validas += len(chaves)
+        unicas.append(np.unique(chaves))
+    if not unicas:
+        return np.empty(0, dtype=np.int64), total, validas
+    return np.unique(np.concatenate(unicas)), total, validas
+
+
+_CHAVES_COMUNS = None  # definido em cada processo pelo initializer
+
+
+def _iniciar_trabalhador(chaves_comuns: np.ndarray):
+    global _CHAVES_COMUNS
+    _CHAVES_COMUNS = chaves_comuns
+
+
+def _filtrar_bloco(df: pd.DataFrame) -> pd.DataFrame:
+    """Executado nos processos: mantém só as linhas de admissões em comum."""
+    return df[_contem(_CHAVES_COMUNS, _chaves_do_bloco(df))]
+
+
+def _escrever_bloco(df: pd.DataFrame, path: str, primeiro: bool):
+    df.to_csv(path, mode="w" if primeiro else "a", header=primeiro, index=False)
+
+
+def main_streaming(chunksize: int = 50000, processos: int = None):
+    tempos = {}
+    contagens = {}
+    os.makedirs(DATA_OUT, exist_ok=True)
+    out_notes = os.path.join(DATA_OUT, "NOTEEVENTS_random_separado_filtred.csv")
+    out_diag = os.path.join(DATA_OUT, "DIAGNOSES_ICD_random_filtred.csv")
+    out_dic = os.path.join(DATA_OUT, "D_ICD_DIAGNOSES_filtred.csv")
+
+    # ----------------- 1) Chaves das notas e dos diagnósticos -----------------
+    t0 = time.perf_counter()
+    chaves_notas, contagens["notas_total"], contagens["notas_validas"] = _chaves_unicas(PATH_NOTES, chunksize)
+    tempos["chaves_notas"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    chaves_diag, contagens["diag_total"], contagens["diag_validos"] = _chaves_unicas(PATH_DIAG, chunksize)
+    tempos["chaves_diagnosticos"] = time.perf_counter() - t0
+
+    comuns = np.intersect1d(chaves_notas, chaves_diag, assume_unique=True)
+    contagens["admissoes_comuns"] = len(comuns)
+    del chaves_notas, chaves_diag
+    print(f"Notas válidas: {contagens['notas_validas']} / {contagens['notas_total']}")
+    print(f"Diagnósticos válidos: {contagens['diag_validos']} / {contagens['diag_total']}")
+    print(f"Admissões em comum entre notas e diagnósticos: {len(comuns)}")
+
+    # ----------------- 2) Filtrar notas num conjunto de processos -----------------
+    t0 = time.perf_counter()
+    n_notas = 0
+    max_processos = processos or os.cpu_count() or 1
+    with ProcessPoolExecutor(
+        max_workers=max_processos,
+        initializer=_iniciar_trabalhador,
+        initargs=(comuns,),
+    ) as pool:
+        pendentes = []
+        primeiro = True
+        for chunk in pd.read_csv(PATH_NOTES, dtype=str, chunksize=chunksize):
+            pendentes.append(pool.submit(_filtrar_bloco, chunk))
+            # no máximo 2 blocos por processo em memória; escrita pela ordem original
+            while len(pendentes) >= 2 * max_processos:
+                bloco = pendentes.pop(0).result()
+                _escrever_bloco(bloco, out_notes, primeiro)
+                primeiro = False
+                n_notas += len(bloco)
+        for fut in pendentes:
+            bloco = fut.result()
+            _escrever_bloco(bloco, out_notes, primeiro)
+            primeiro = False
+            n_notas += len(bloco)
+    contagens["notas_filtradas"] = n_notas
+    tempos["filtrar_notas"] = time.perf_counter() - t0
+    print(f"Notas depois do filtro: {n_notas}")
+
+    # ----------------- 3) Filtrar diagnósticos -----------------
+    t0 = time.perf_counter()
+    n_diag = 0
+    codigos_usados = set()
+    primeiro = True
+    for chunk in pd.read_csv(PATH_DIAG, dtype=str, chunksize=chunksize):
+        bloco = chunk[_contem(comuns, _chaves_do_bloco(chunk))]
+        codigos_usados.update(bloco["ICD9_CODE"].dropna().unique())
+        _escrever_bloco(bloco, out_diag, primeiro)
+        primeiro = False
+        n_diag += len(bloco)
+    contagens["diag_filtrados"] = n_diag
+    tempos["filtrar_diagnosticos"] = time.perf_counter() - t0
+    print(f"Diagnósticos depois do filtro: {n_diag}")
+
+    # ----------------- 4) Filtrar dicionário ICD -----------------
+    t0 = time.perf_counter()
+    dic_icd = pd.read_csv(PATH_DIC, dtype=str)
+    dic_filt = dic_icd[dic_icd["ICD9_CODE"].isin(codigos_usados)]
+    dic_filt.to_csv(out_dic, index=False)
+    contagens["codigos_icd"] = len(codigos_usados)
+    contagens["dicionario_filtrado"] = len(dic_filt)
+    tempos["filtrar_dicionario"] = time.perf_counter() - t0
+    print(f"Códigos ICD usados: {len(codigos_usados)}")
+    print(f"Entradas no dicionário depois do filtro: {len(dic_filt)}")
+
+    # ----------------- 5) Armazém binário das notas -----------------
+    t0 = time.perf_counter()
+    base_armazem = os.path.join(DATA_OUT, "NOTEEVENTS_filtred_notas")
+    contagens["armazem_notas"] = gravar_armazem_notas(out_notes, base_armazem, chunksize=chunksize)
+    tempos["armazem_notas"] = time.perf_counter() - t0
+
+    # ----------------- Resumo por fase -----------------
+    print("\nTempos por fase:")
+    for fase, t in tempos.items():
+        print(f"  {fase:<22} {t:8.2f} s")
+    print(f"  {'total':<22} {sum(tempos.values()):8.2f} s")
+    print("Contagens:")
+    for nome, n in contagens.items():
+        print(f"  {nome:<22} {n}")
+
     print("\nFicheiros filtrados gravados em:")
     print(" -", out_notes)
     print(" -", out_diag)
     print(" -", out_dic)
+    print(f" - {base_armazem}.bin / .idx.npy")
+    return tempos, contagens
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Filtra as tabelas MIMIC-III usadas pelo projeto.")
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="processa por blocos e em vários processos (tabelas completas)",
+    )
+    parser.add_argument("--chunksize", type=int, default=50000)
+    parser.add_argument("--processos", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.streaming:
+        main_streaming(chunksize=args.chunksize, processos=args.processos)
+    else:
+        main()
@@ -0,0 +1,247 @@
+# rastreio.py
+#
+# Rastreio leve do tempo gasto por caso e por etapa (spans encaixados), para
+# separar a latência do LLM do resto: parsing do JSON, componentes do grafo,
+# HTML do pyvis, avaliação, reputação e escrita do histórico.
+#
+#   with span("grafo", nos=12) as s:
+#       ...
+#       s.definir(arestas=30)
+#
+# Cada span regista início, duração, o span pai e atributos (comprimento da
+# nota, nº de nós/arestas, tokens, ...). O pai é seguido por contextvars, por
+# isso funciona em threads e em tarefas asyncio. Spans com `pista` abrem uma
+# linha própria no visualizador (ex.: "caso 3"); os filhos herdam-na.
+#
+# Os eventos vão para config.CAMINHO_RASTREIO no formato Chrome trace (um
+# evento JSON por linha, dentro de uma lista que não precisa de ser fechada),
+# que abre diretamente em https://ui.perfetto.dev ou chrome://tracing.
+# `python rastreio.py [ficheiro]` resume o tempo total e próprio por span.
+#
+# Com config.RASTREIO_ATIVO = False, span() devolve sempre o mesmo objeto
+# vazio: o custo é uma verificação do config por span.
+
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import atexit
+import itertools
+import json
+import os
+import threading
+import time
+
+import config
+
+
+_ORIGEM = time.perf_counter()  # t = 0 do rastreio (os spans usam perf_counter)
+_ids = itertools.count(1)
+# (id do span, pista) do span aberto no contexto atual
+_atual: ContextVar[Optional[Tuple[int, str]]] = ContextVar("span_atual", default=None)
+
+
+class Rastreio:
+    """Escreve os eventos (spans) num ficheiro Chrome trace, por lotes."""
+
+    def __init__(self, caminho: str, max_buffer: int = 200):
+        self.caminho = caminho
+        self.max_buffer = max_buffer
+        self._pid = os.getpid()
+        self._buffer: List[Dict[str, Any]] = []
+        self._pistas: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+        with open(caminho, "w", encoding="utf-8") as f:
+            f.write("[\n")
+
+    def _tid(self, pista: str) -> int:
+        """Nº da linha da pista (com o nome como metadado na primeira vez)."""
+        tid = self._pistas.get(pista)
+        if tid is None:
+            tid = self._pistas[pista] = len(self._pistas) + 1
+            self._buffer.append(
+                {"ph": "M", "name": "thread_name", "pid": self._pid, "tid": tid, "args": {"name": pista}}
+            )
+        return tid
+
+    def registar(self, nome: str, inicio: float, fim: float, pista: str, atributos: Dict[str, Any]):
+        """Um span completo; inicio e fim em segundos de time.perf_counter()."""
+        evento = {
+            "ph": "X",
+            "name": nome,
+            "ts": round((inicio - _ORIGEM) * 1e6, 1),
+            "dur": round((fim - inicio) * 1e6, 1),
+            "pid": self._pid,
+            "args": atributos,
+        }
+        with self._lock:
+            evento["tid"] = self._tid(pista)
+            self._buffer.append(evento)
+            if len(self._buffer) >= self.max_buffer:
+                self._gravar()
+
+    def _gravar(self):
+        if not self._buffer:
+            return
+        linhas = "".join(json.dumps(e, ensure_ascii=False, default=str) + ",\n" for e in self._buffer)
+        self._buffer.clear()
+        with open(self.caminho, "a", encoding="utf-8") as f:
+            f.write(linhas)
+
+    def fechar(self):
+        with self._lock:
+            self._gravar()
+
+
+class _Span:
+    __slots__ = ("rastreio", "nome", "pista", "atributos", "id", "_inicio", "_token")
+
+    def __init__(self, rastreio: Rastreio, nome: str, pista: Optional[str], atributos: Dict[str, Any]):
+        self.rastreio = rastreio
+        self.nome = nome
+        self.pista = pista
+        self.atributos = atributos
+
+    def definir(self, **atributos):
+        self.atributos.update(atributos)
+
+    def __enter__(self):
+        pai = _atual.get()
+        self.id = next(_ids)
+        self.atributos["id"] = self.id
+        if pai is not None:
+            self.atributos["pai"] = pai[0]
+        if self.pista is None:
+            self.pista = pai[1] if pai is not None else threading.current_thread().name
+        self._token = _atual.set((self.id, self.pista))
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, exc, tb):
+        fim = time.perf_counter()
+        _atual.reset(self._token)
+        if tipo is not None:
+            self.atributos["erro"] = tipo.__name__
+        self.rastreio.registar(self.nome, self._inicio, fim, self.pista, self.atributos)
+        return False
+
+
+class _SpanNulo:
+    """Span do rastreio desligado: não mede nem grava nada."""
+
+    __slots__ = ()
+
+    def definir(self, **atributos):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, exc, tb):
+        return False
+
+
+_NULO = _SpanNulo()
+
+_rastreio_global: Optional[Rastreio] = None
+_lock_global = threading.Lock()
+
+
+def obter_rastreio() -> Optional[Rastreio]:
+    """Devolve o rastreio único do processo, ou None se estiver desligado."""
+    global _rastreio_global
+    if not config.RASTREIO_ATIVO:
+        return None
+    with _lock_global:
+        if _rastreio_global is None:
+            _rastreio_global = Rastreio(config.CAMINHO_RASTREIO)
+            atexit.register(_rastreio_global.fechar)
+        return _rastreio_global
+
+
+def span(nome: str, pista: Optional[str] = None, **atributos):
+    """Context manager de um span (filho do span aberto no contexto atual)."""
+    if not config.RASTREIO_ATIVO:
+        return _NULO
+    return _Span(_rastreio_global or obter_rastreio(), nome, pista, atributos)
+
+
+def registar_span(nome: str, inicio: float, fim: Optional[float] = None, pista: Optional[str] = None, **atributos):
+    """
+    Span medido por fora (inicio/fim de time.perf_counter()), para intervalos
+    que atravessam várias tarefas, como um caso no pipeline assíncrono.
+    """
+    if not config.RASTREIO_ATIVO:
+        return
+    fim = time.perf_counter() if fim is None else fim
+    atributos["id"] = next(_ids)
+    (_rastreio_global or obter_rastreio()).registar(
+        nome, inicio, fim, pista or threading.current_thread().name, atributos
+    )
+
+
+def fechar_rastreio():
+    """Grava os eventos ainda no buffer."""
+    if _rastreio_global is not None:
+        _rastreio_global.fechar()
+
+
+def ler_rastreio(caminho: str) -> List[Dict[str, Any]]:
+    """Spans ("X") de um ficheiro escrito por Rastreio."""
+    eventos = []
+    with open(caminho, "r", encoding="utf-8") as f:
+        for linha in f:
+            linha = linha.strip().rstrip(",")
+            if linha.startswith("{"):
+                evento = json.loads(linha)
+                if evento.get("ph") == "X":
+                    eventos.append(evento)
+    return eventos
+
+
+def resumir(eventos: List[Dict[str, Any]]) -> Dict[str, Tuple[int, float, float]]:
+    """nome -> (nº de spans, tempo total s, tempo próprio s = total - filhos)."""
+    filhos: Dict[int, float] = {}
+    for e in eventos:
+        pai = e["args"].get("pai")
+        if pai is not None:
+            filhos[pai] = filhos.get(pai, 0.0) + e["dur"]
+    # spans sem pai (ex.: etapas do pipeline assíncrono, registadas em tarefas
+    # diferentes) ficam dentro do span sem pai que os contém na mesma pista
+    raizes: Dict[Tuple[int, int], List[Dict[str, Any]]] = {}
+    for e in eventos:
+        if e["args"].get("pai") is None:
+            raizes.setdefault((e["pid"], e["tid"]), []).append(e)
+    for lista in raizes.values():
+        lista.sort(key=lambda e: (e["ts"], -e["dur"]))
+        abertos: List[Dict[str, Any]] = []
+        for e in lista:
+            while abertos and abertos[-1]["ts"] + abertos[-1]["dur"] < e["ts"] + e["dur"]:
+                abertos.pop()
+            if abertos:
+                pai = abertos[-1]["args"].get("id")
+                filhos[pai] = filhos.get(pai, 0.0) + e["dur"]
+            abertos.append(e)
+    resumo: Dict[str, List[float]] = {}
+    for e in eventos:
+        r = resumo.setdefault(e["name"], [0, 0.0, 0.0])
+        r[0] += 1
+        r[1] += e["dur"] / 1e6
+        # filhos em paralelo (ex.: médicos no modo assíncrono) podem somar mais do que o pai
+        r[2] += max(0.0, e["dur"] - filhos.get(e["args"].get("id"), 0.0)) / 1e6
+    return {nome: (int(n), total, proprio) for nome, (n, total, proprio) in resumo.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumo do tempo por span de um rastreio.")
+    parser.add_argument("ficheiro", nargs="?", default=config.CAMINHO_RASTREIO)
+    args = parser.parse_args()
+
+    resumo = resumir(ler_rastreio(args.ficheiro))
+    print(f"{'span':22s} {'n':>6s} {'total (s)':>10s} {'próprio (s)':>12s} {'médio (ms)':>11s}")
+    for nome, (n, total, proprio) in sorted(resumo.items(), key=lambda kv: -kv[1][2]):
+        print(f"{nome:22s} {n:6d} {total:10.3f} {proprio:12.3f} {1000 * total / n:11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,36 @@
 # reputacao.py
+#
+# Reputação dos médicos (acertos / total).
+#
+# Dois modos de armazenamento (config.MODO_REPUTACAO):
+#   - "json":   o ficheiro output/reputacao.json é reescrito a cada atualização
+#               (modo original; um só processo).
+#   - "sqlite": cada atualização é um evento (médico, caso, correto, instante)
+#               acrescentado a output/reputacao.sqlite em modo WAL. Os eventos
+#               são gravados em lotes (um commit por REPUTACAO_EVENTOS_POR_COMMIT
+#               eventos) e, de REPUTACAO_COMPACTAR_CADA em REPUTACAO_COMPACTAR_CADA
+#               eventos, os antigos são somados numa tabela de snapshot e apagados.
+#               Ao arrancar, o estado é snapshot + soma dos eventos restantes.
+#               Vários processos podem partilhar a mesma base de dados: o SQLite
+#               serializa as escritas e cada processo lê os eventos dos outros
+#               sempre que grava os seus. Cada compactação incrementa a geração
+#               do snapshot; um processo que encontre outra geração (eventos que
+#               ainda não tinha lido podem já estar no snapshot) relê o estado
+#               completo em vez de só os eventos novos.
+#
+# Com aguardar_confirmacao (main.py e lote.py), os eventos de um caso só são
+# gravados depois de a linha do caso estar no histórico em disco (confirmar(),
+# chamado pelo HistoricoCSV a cada gravação). Se o processo morrer antes, o
+# caso é repetido ao retomar e a reputação não o conta duas vezes.
 
 from dataclasses import dataclass, asdict
-from typing import Dict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import atexit
 import json
 import os
+import sqlite3
+import threading
+import time
 
 import config  # novo import
 
@@ -21,21 +48,185 @@ class EstatisticasMedico:
         return self.acertos / self.total
 
 
+class _RegistoSQLite:
+    """Log de eventos de reputação + snapshot compactado, em SQLite (WAL)."""
+
+    def __init__(self, path_db: str):
+        self.path_db = path_db
+        os.makedirs(os.path.dirname(path_db) or ".", exist_ok=True)
+        # usado também pela thread que grava o histórico (confirmar); o GestorReputacao serializa
+        self.con = sqlite3.connect(path_db, timeout=30.0, isolation_level=None, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        # em WAL, NORMAL só faz fsync nos checkpoints: os commits em lote ficam baratos
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS eventos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                medico TEXT NOT NULL,
+                caso TEXT,
+                correto INTEGER NOT NULL,
+                instante REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS snapshot (
+                medico TEXT PRIMARY KEY,
+                acertos INTEGER NOT NULL,
+                total INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                chave TEXT PRIMARY KEY,
+                valor INTEGER NOT NULL
+            );
+            """
+        )
+        self.ultimo_id = 0  # último evento já refletido em memória
+        self.geracao = 0  # geração do snapshot a que corresponde o estado em memória
+
+    def vazio(self) -> bool:
+        cur = self.con.execute(
+            "SELECT (SELECT COUNT(*) FROM snapshot) + (SELECT COUNT(*) FROM eventos)"
+        )
+        return cur.fetchone()[0] == 0
+
+    def importar(self, estado: Dict[str, EstatisticasMedico]):
+        """Semeia o snapshot (ex.: a partir de um reputacao.json antigo)."""
+        with self.con:
+            self.con.execute("BEGIN IMMEDIATE")
+            self.con.executemany(
+                "INSERT OR REPLACE INTO snapshot (medico, acertos, total) VALUES (?, ?, ?)",
+                [(mid, s.acertos, s.total) for mid, s in estado.items()],
+            )
+
+    def _geracao_bd(self) -> int:
+        cur = self.con.execute("SELECT valor FROM meta WHERE chave = 'geracao'")
+        linha = cur.fetchone()
+        return linha[0] if linha else 0
+
+    def _ler_estado(self) -> Dict[str, Tuple[int, int]]:
+        """Snapshot + eventos; chamado dentro de uma transação. Atualiza ultimo_id e geracao."""
+        soma = {
+            m: (a, t)
+            for m, a, t in self.con.execute("SELECT medico, acertos, total FROM snapshot")
+        }
+        for m, a, t in self.con.execute(
+            "SELECT medico, SUM(correto), COUNT(*) FROM eventos GROUP BY medico"
+        ):
+            a0, t0 = soma.get(m, (0, 0))
+            soma[m] = (a0 + a, t0 + t)
+        self.ultimo_id = self.con.execute("SELECT COALESCE(MAX(id), 0) FROM eventos").fetchone()[0]
+        self.geracao = self._geracao_bd()
+        return soma
+
+    def estado(self) -> Dict[str, Tuple[int, int]]:
+        """medico -> (acertos, total) = snapshot + eventos."""
+        with self.con:
+            self.con.execute("BEGIN")  # leitura consistente das duas tabelas
+            return self._ler_estado()
+
+    def gravar(
+        self, eventos: List[tuple]
+    ) -> Tuple[Optional[Dict[str, Tuple[int, int]]], List[Tuple[str, int]]]:
+        """
+        Acrescenta os eventos numa transação. Devolve (None, novos), com
+        (medico, correto) de todos os eventos novos desde a última leitura
+        (deste e de outros processos), ou (estado completo, []) se entretanto
+        houve uma compactação.
+        """
+        with self.con:
+            self.con.execute("BEGIN IMMEDIATE")
+            self.con.executemany(
+                "INSERT INTO eventos (medico, caso, correto, instante) VALUES (?, ?, ?, ?)",
+                eventos,
+            )
+            if self._geracao_bd() != self.geracao:
+                return self._ler_estado(), []
+            novos = self.con.execute(
+                "SELECT id, medico, correto FROM eventos WHERE id > ? ORDER BY id",
+                (self.ultimo_id,),
+            ).fetchall()
+        if novos:
+            self.ultimo_id = novos[-1][0]
+        return None, [(m, c) for _, m, c in novos]
+
+    def compactar(self):
+        """Soma os eventos no snapshot e apaga-os (numa só transação)."""
+        with self.con:
+            self.con.execute("BEGIN IMMEDIATE")
+            limite = self.con.execute("SELECT COALESCE(MAX(id), 0) FROM eventos").fetchone()[0]
+            if limite == 0:
+                return
+            self.con.execute(
+                """
+                INSERT INTO snapshot (medico, acertos, total)
+                SELECT medico, SUM(correto), COUNT(*) FROM eventos WHERE id <= ? GROUP BY medico
+                ON CONFLICT(medico) DO UPDATE SET
+                    acertos = acertos + excluded.acertos,
+                    total = total + excluded.total
+                """,
+                (limite,),
+            )
+            self.con.execute("DELETE FROM eventos WHERE id <= ?", (limite,))
+            # a compactação pode ter levado eventos de outros processos que este
+            # ainda não leu: a geração nova obriga todos (este incluído) a reler
+            self.con.execute(
+                """
+                INSERT INTO meta (chave, valor) VALUES ('geracao', 1)
+                ON CONFLICT(chave) DO UPDATE SET valor = valor + 1
+                """
+            )
+        self.con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def fechar(self):
+        self.con.close()
+
+
 class GestorReputacao:
-    def __init__(self, medico_ids, path_json: str | None = None):
+    def __init__(
+        self,
+        medico_ids,
+        path_json: str | None = None,
+        modo: str | None = None,
+        path_db: str | None = None,
+        aguardar_confirmacao: bool = False,
+    ):
         if path_json is None:
             # reputação em output/reputacao.json dentro do proj/
             path_json = os.path.join(config.OUTPUT_DIR, "reputacao.json")
+        if modo is None:
+            modo = config.MODO_REPUTACAO
+        if modo not in ("json", "sqlite"):
+            raise ValueError(f"modo de reputação desconhecido: {modo}")
 
         self.path_json = path_json
+        self.modo = modo
         self.medicos: Dict[str, EstatisticasMedico] = {
             mid: EstatisticasMedico() for mid in medico_ids
         }
+        self.aguardar_confirmacao = aguardar_confirmacao
+        # eventos (medico, caso, correto, instante) já nos contadores mas ainda não gravados
+        self._pendentes: List[tuple] = []
+        self._confirmados: Set[str] = set()
+        self._lock = threading.RLock()
+
+        if modo == "json":
+            # se já existir ficheiro, carregar; caso contrário, criar de raiz
+            self._carregar_se_existir()
+            if not os.path.exists(self.path_json):
+                self._guardar()
+            return
 
-        # se já existir ficheiro, carregar; caso contrário, criar de raiz
-        self._carregar_se_existir()
-        if not os.path.exists(self.path_json):
-            self._guardar()
+        if path_db is None:
+            path_db = config.CAMINHO_REPUTACAO_DB
+        self._registo = _RegistoSQLite(path_db)
+        self._desde_compactacao = 0
+        if self._registo.vazio() and os.path.exists(self.path_json):
+            # primeira execução em sqlite: partir da reputação acumulada no json
+            self._carregar_se_existir()
+            self._registo.importar(self.medicos)
+        self._carregar_registo()
+        atexit.register(self.fechar)
+
+    # ---------------------- modo json -------------------------
 
     def _carregar_se_existir(self):
         if os.path.exists(self.path_json):
@@ -47,18 +238,126 @@ class GestorReputacao:
     def _guardar(self):
         os.makedirs(os.path.dirname(self.path_json), exist_ok=True)
         data = {mid: asdict(stats) for mid, stats in self.medicos.items()}
+        # eventos por confirmar ficam fora do ficheiro
+        for mid, _, correto, _ in self._pendentes:
+            data[mid]["total"] -= 1
+            data[mid]["acertos"] -= correto
         with open(self.path_json, "w", encoding="utf-8") as f:
             json.dump(data, f, indent=2)
 
-    def atualizar(self, medico_id: str, correto: bool):
-        stats = self.medicos[medico_id]
+    # ---------------------- modo sqlite -------------------------
+
+    def _carregar_registo(self, soma: Optional[Dict[str, Tuple[int, int]]] = None):
+        if soma is None:
+            soma = self._registo.estado()
+        for mid in self.medicos:
+            self.medicos[mid] = EstatisticasMedico()
+        for mid, (acertos, total) in soma.items():
+            self.medicos[mid] = EstatisticasMedico(acertos=acertos, total=total)
+
+    def _aplicar(self, medico_id: str, correto: bool):
+        stats = self.medicos.setdefault(medico_id, EstatisticasMedico())
         stats.total += 1
         if correto:
             stats.acertos += 1
-        self._guardar()
+
+    def _retirar(self, eventos: List[tuple]):
+        for mid, _, correto, _ in eventos:
+            stats = self.medicos[mid]
+            stats.total -= 1
+            stats.acertos -= int(correto)
+
+    def _separar_confirmados(self) -> List[tuple]:
+        """Tira de _pendentes e devolve os eventos que já podem ser gravados."""
+        if not self.aguardar_confirmacao:
+            prontos, self._pendentes = self._pendentes, []
+            return prontos
+        prontos = [e for e in self._pendentes if e[1] in self._confirmados]
+        self._pendentes = [e for e in self._pendentes if e[1] not in self._confirmados]
+        self._confirmados.clear()
+        return prontos
+
+    def sincronizar(self):
+        """Grava os eventos pendentes (confirmados) e incorpora os eventos de outros processos."""
+        if self.modo != "sqlite":
+            return
+        with self._lock:
+            pendentes = self._separar_confirmados()
+            # os pendentes já estão nos contadores: retirá-los antes de aplicar o que vem da BD
+            self._retirar(pendentes)
+            estado, novos = self._registo.gravar(pendentes)
+            if estado is not None:
+                # houve uma compactação: estado completo, mais o que ainda espera confirmação
+                self._carregar_registo(estado)
+                for mid, _, correto, _ in self._pendentes:
+                    self._aplicar(mid, bool(correto))
+            for mid, correto in novos:
+                self._aplicar(mid, bool(correto))
+
+            self._desde_compactacao += len(pendentes)
+            if self._desde_compactacao >= config.REPUTACAO_COMPACTAR_CADA:
+                self._desde_compactacao = 0
+                self._registo.compactar()
+
+    def confirmar(self, casos: Iterable[str]):
+        """
+        Os casos indicados já estão no histórico em disco: grava os seus
+        eventos (com aguardar_confirmacao).
+        """
+        with self._lock:
+            self._confirmados.update(casos)
+            if self.modo == "sqlite":
+                self.sincronizar()
+            else:
+                self._separar_confirmados()
+                self._guardar()
+
+    def fechar(self):
+        """
+        Grava o que falta (modo sqlite) e exporta o estado para o reputacao.json.
+        Os eventos de casos nunca confirmados (sem linha no histórico) são
+        descartados: esses casos são repetidos ao retomar.
+        """
+        with self._lock:
+            if self.modo == "sqlite":
+                if self._registo is None:
+                    return
+                self.sincronizar()
+            if self._pendentes:
+                print(f"[reputacao] {len(self._pendentes)} eventos de casos fora do histórico descartados")
+                self._retirar(self._pendentes)
+                self._pendentes = []
+            elif self.modo == "json":
+                return
+            if self.modo == "sqlite":
+                self._registo.fechar()
+                self._registo = None
+            self._guardar()  # cópia legível, compatível com o modo json
+
+    # ---------------------- API -------------------------
+
+    def atualizar(self, medico_id: str, correto: bool, caso: Optional[str] = None):
+        with self._lock:
+            if self.modo == "json":
+                stats = self.medicos[medico_id]
+                stats.total += 1
+                if correto:
+                    stats.acertos += 1
+                if self.aguardar_confirmacao:
+                    self._pendentes.append((medico_id, caso, int(bool(correto)), time.time()))
+                else:
+                    self._guardar()
+                return
+
+            self._aplicar(medico_id, correto)
+            self._pendentes.append((medico_id, caso, int(bool(correto)), time.time()))
+            if not self.aguardar_confirmacao and len(self._pendentes) >= config.REPUTACAO_EVENTOS_POR_COMMIT:
+                self.sincronizar()
 
     def obter_reputacao(self, medico_id: str) -> float:
-        return self.medicos[medico_id].reputacao
+        with self._lock:
+            return self.medicos[medico_id].reputacao
 
     def melhor_medico(self) -> str:
-        return max(self.medicos.keys(), key=lambda mid: self.medicos[mid].reputacao)
+        with self._lock:
+            return max(self.medicos.keys(), key=lambda mid: self.medicos[mid].reputacao)
@@ -0,0 +1,120 @@
+# test_reputacao.py
+#
+# Reputação em SQLite partilhada por vários processos (reputacao.py, modo
+# "sqlite"): nenhum evento se pode perder quando outro processo compacta.
+#
+# Uso: python -m pytest tests/test_reputacao.py
+
+import multiprocessing as mp
+import os
+import sys
+
+# módulos do projeto (pasta acima de tests/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from reputacao import GestorReputacao  # noqa: E402
+
+
+def _gestor(pasta: str) -> GestorReputacao:
+    return GestorReputacao(
+        ["A"],
+        path_json=os.path.join(pasta, "reputacao.json"),
+        modo="sqlite",
+        path_db=os.path.join(pasta, "reputacao.sqlite"),
+    )
+
+
+def _processo(pasta: str, resultados: list, por_commit: int, compactar_cada: int, barreira=None, fila=None):
+    """
+    Noutro processo: grava os resultados e compacta conforme o config dado.
+    Com barreira, espera pelos outros processos e envia para a fila o estado
+    em memória depois de uma última sincronização.
+    """
+    config.REPUTACAO_EVENTOS_POR_COMMIT = por_commit
+    config.REPUTACAO_COMPACTAR_CADA = compactar_cada
+    gestor = _gestor(pasta)
+    for i, correto in enumerate(resultados):
+        gestor.atualizar("A", correto, caso=f"{os.getpid()}-{i}")
+    if barreira is not None:
+        gestor.sincronizar()
+        barreira.wait(60)
+        gestor.sincronizar()
+        fila.put(_estado(gestor))
+        barreira.wait(60)  # ninguém fecha antes de todos terem lido o estado
+    gestor.fechar()
+
+
+def _correr(pasta: str, *args):
+    p = mp.get_context("spawn").Process(target=_processo, args=(pasta, *args))
+    p.start()
+    p.join(60)
+    assert p.exitcode == 0
+
+
+def _estado(gestor: GestorReputacao):
+    s = gestor.medicos["A"]
+    return s.acertos, s.total
+
+
+def test_compactacao_noutro_processo(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "REPUTACAO_EVENTOS_POR_COMMIT", 1)
+    monkeypatch.setattr(config, "REPUTACAO_COMPACTAR_CADA", 1000)
+    pasta = str(tmp_path)
+
+    g = _gestor(pasta)
+    g.atualizar("A", False)
+
+    # outro processo grava dois acertos e compacta-os no snapshot
+    _correr(pasta, [True, True], 1, 1)
+
+    g.atualizar("A", False)
+    assert _estado(g) == (2, 4)
+    g.fechar()
+    assert _estado(_gestor(pasta)) == (2, 4)
+
+
+def test_processos_em_paralelo(tmp_path):
+    pasta = str(tmp_path)
+    resultados = [i % 3 == 0 for i in range(300)]
+    ctx = mp.get_context("spawn")
+    barreira, fila = ctx.Barrier(2), ctx.Queue()
+    processos = [
+        ctx.Process(target=_processo, args=(pasta, resultados, 3, 7, barreira, fila))
+        for _ in range(2)
+    ]
+    for p in processos:
+        p.start()
+    estados = [fila.get(timeout=120) for _ in processos]
+    for p in processos:
+        p.join(120)
+        assert p.exitcode == 0
+
+    # cada processo vê os eventos de ambos, mesmo os que o outro já compactou
+    assert estados == [(200, 600), (200, 600)]
+    assert _estado(_gestor(pasta)) == (200, 600)
+
+
+def test_so_grava_casos_confirmados(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "REPUTACAO_EVENTOS_POR_COMMIT", 1)
+    pasta = str(tmp_path)
+
+    g = GestorReputacao(
+        ["A"],
+        path_json=os.path.join(pasta, "reputacao.json"),
+        modo="sqlite",
+        path_db=os.path.join(pasta, "reputacao.sqlite"),
+        aguardar_confirmacao=True,
+    )
+    g.atualizar("A", True, caso="1:10-100")
+    g.atualizar("A", False, caso="2:11-101")
+    assert _estado(g) == (1, 2)
+    assert _estado(_gestor(pasta)) == (0, 0)  # nada gravado antes do histórico
+
+    g.confirmar(["1:10-100"])
+    assert _estado(_gestor(pasta)) == (1, 1)
+
+    # o caso 2 nunca chegou ao histórico: é descartado (será repetido ao retomar)
+    g.fechar()
+    assert _estado(g) == (1, 1)
+    assert _estado(_gestor(pasta)) == (1, 1)
@@ -0,0 +1,182 @@
+# vetorizacao.py
+#
+# Vetorização de texto curto (nomes de diagnósticos, títulos ICD-9) em
+# vetores esparsos TF-IDF, sem vocabulário guardado: cada característica
+# (palavra ou n-grama de caracteres) é mapeada para uma dimensão por um
+# hash estável (crc32), por isso o mesmo texto dá sempre o mesmo vetor,
+# entre execuções e entre processos.
+#
+# Um vetor é representado por dois arrays NumPy: ids (dimensões, ordenados
+# e sem repetições) e pesos (float32, norma L2 = 1).
+#
+# Para notas clínicas inteiras (active_learning.py) há matriz_notas(): só
+# palavras e bigramas de palavras (sem n-gramas de caracteres), com a
+# tokenização feita por blocos em pandas/NumPy e o crc32 calculado uma vez
+# por palavra distinta. O resultado é uma MatrizEsparsa (linhas CSR).
+
+from dataclasses import dataclass
+from typing import Dict, List, Tuple, Iterable
+import itertools
+import re
+import zlib
+
+import numpy as np
+import pandas as pd
+
+
+_RE_PALAVRA = re.compile(r"[a-z0-9]+")
+
+VetorEsparso = Tuple[np.ndarray, np.ndarray]
+
+
+def palavras(texto: str) -> List[str]:
+    return _RE_PALAVRA.findall(str(texto or "").lower())
+
+
+def caracteristicas(texto: str, n: int = 3) -> List[str]:
+    """Palavras inteiras + n-gramas de caracteres de cada palavra (com margens)."""
+    out = []
+    for p in palavras(texto):
+        out.append(f"w:{p}")
+        marcada = f" {p} "
+        for i in range(len(marcada) - n + 1):
+            out.append(marcada[i : i + n])
+    return out
+
+
+def _hash(caracteristica: str, dim: int) -> int:
+    return zlib.crc32(caracteristica.encode("utf-8")) % dim
+
+
+class VetorizadorHash:
+    """
+    TF-IDF com "hashing trick". ajustar() calcula o IDF sobre uma coleção;
+    sem ajustar, todos os IDF valem 1.
+    """
+
+    def __init__(self, dim: int = 1 << 18, n: int = 3):
+        self.dim = dim
+        self.n = n
+        self.idf = None  # np.ndarray (dim,) depois de ajustar()
+
+    def contagens(self, texto: str) -> VetorEsparso:
+        ids = np.fromiter(
+            (_hash(c, self.dim) for c in caracteristicas(texto, self.n)), dtype=np.int64
+        )
+        ids, cont = np.unique(ids, return_counts=True)
+        return ids, cont.astype(np.float32)
+
+    def ajustar(self, textos: Iterable[str]) -> "VetorizadorHash":
+        df = np.zeros(self.dim, dtype=np.float32)
+        n_docs = 0
+        for texto in textos:
+            ids, _ = self.contagens(texto)
+            df[ids] += 1.0
+            n_docs += 1
+        # IDF suavizado (como no scikit-learn)
+        self.idf = (np.log((1.0 + n_docs) / (1.0 + df)) + 1.0).astype(np.float32)
+        return self
+
+    def transformar(self, texto: str) -> VetorEsparso:
+        ids, cont = self.contagens(texto)
+        pesos = 1.0 + np.log(cont)  # tf sublinear
+        if self.idf is not None:
+            pesos = pesos * self.idf[ids]
+        norma = float(np.sqrt(np.dot(pesos, pesos)))
+        if norma > 0:
+            pesos = pesos / norma
+        return ids, pesos.astype(np.float32)
+
+
+def similaridade(a: VetorEsparso, b: VetorEsparso) -> float:
+    """Cosseno entre dois vetores esparsos já normalizados."""
+    comuns, ia, ib = np.intersect1d(a[0], b[0], assume_unique=True, return_indices=True)
+    if len(comuns) == 0:
+        return 0.0
+    return float(np.dot(a[1][ia], b[1][ib]))
+
+
+@dataclass
+class MatrizEsparsa:
+    """Vetores TF-IDF (norma L2 = 1) de uma coleção, em linhas CSR."""
+    indptr: np.ndarray  # (n + 1,) início de cada linha em ids/pesos
+    ids: np.ndarray  # int32, dimensões ordenadas dentro de cada linha
+    pesos: np.ndarray  # float32
+    dim: int
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def linha(self, i: int) -> VetorEsparso:
+        ini, fim = self.indptr[i], self.indptr[i + 1]
+        return self.ids[ini:fim], self.pesos[ini:fim]
+
+
+def _contagens_bloco(
+    textos: List[str], dim: int, bigramas: bool, hashes: Dict[str, int]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(nº de entradas por nota, dimensões, contagens) de um bloco de notas."""
+    tokens = pd.Series(textos, dtype=object).fillna("").astype(str).str.lower().str.findall(_RE_PALAVRA.pattern)
+    n_tokens = tokens.str.len().to_numpy(dtype=np.int64)
+    codigos, unicas = pd.factorize(np.array(list(itertools.chain.from_iterable(tokens)), dtype=object))
+    # crc32 uma vez por palavra distinta (o mesmo "w:palavra" de caracteristicas())
+    for p in unicas:
+        if p not in hashes:
+            hashes[p] = zlib.crc32(f"w:{p}".encode("utf-8"))
+    h = np.fromiter((hashes[p] for p in unicas), dtype=np.uint64, count=len(unicas))[codigos]
+    doc = np.repeat(np.arange(len(textos), dtype=np.int64), n_tokens)
+
+    feats = [h % np.uint64(dim)]
+    docs = [doc]
+    if bigramas and len(h) > 1:
+        mesma_nota = doc[:-1] == doc[1:]
+        # combinação das duas palavras (aritmética uint64 com overflow)
+        hb = (h[:-1] * np.uint64(0x9E3779B1) + h[1:] + np.uint64(1))[mesma_nota]
+        feats.append(hb % np.uint64(dim))
+        docs.append(doc[:-1][mesma_nota])
+    chaves = np.concatenate(docs) * dim + np.concatenate(feats).astype(np.int64)
+    chaves, cont = np.unique(chaves, return_counts=True)
+    por_nota = np.bincount(chaves // dim, minlength=len(textos))
+    return por_nota, (chaves % dim).astype(np.int32), cont.astype(np.float32)
+
+
+def matriz_notas(
+    textos: Iterable[str],
+    dim: int = 1 << 20,
+    bigramas: bool = True,
+    lote: int = 2000,
+) -> MatrizEsparsa:
+    """
+    TF-IDF (tf sublinear, IDF suavizado) de palavras e bigramas de cada
+    texto, por hashing em `dim` dimensões. Lê os textos uma só vez.
+    """
+    hashes: Dict[str, int] = {}
+    por_nota, ids, cont = [], [], []
+    bloco: List[str] = []
+    for texto in itertools.chain(textos, [None]):
+        if texto is not None:
+            bloco.append(texto)
+            if len(bloco) < lote:
+                continue
+        if bloco:
+            n, i, c = _contagens_bloco(bloco, dim, bigramas, hashes)
+            por_nota.append(n)
+            ids.append(i)
+            cont.append(c)
+            bloco = []
+
+    por_nota = np.concatenate(por_nota) if por_nota else np.empty(0, np.int64)
+    ids = np.concatenate(ids) if ids else np.empty(0, np.int32)
+    cont = np.concatenate(cont) if cont else np.empty(0, np.float32)
+    n_docs = len(por_nota)
+    indptr = np.zeros(n_docs + 1, dtype=np.int64)
+    np.cumsum(por_nota, out=indptr[1:])
+
+    df = np.bincount(ids, minlength=dim).astype(np.float32)
+    idf = np.log((1.0 + n_docs) / (1.0 + df)) + 1.0
+    pesos = ((1.0 + np.log(cont)) * idf[ids]).astype(np.float32)
+    linhas = np.repeat(np.arange(n_docs), por_nota)
+    normas = np.sqrt(np.bincount(linhas, weights=pesos.astype(np.float64) ** 2, minlength=n_docs))
+    normas[normas == 0] = 1.0
+    pesos /= normas[linhas].astype(np.float32)
+    return MatrizEsparsa(indptr=indptr, ids=ids, pesos=pesos, dim=dim)